@@ -5,3 +5,6 @@ class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
 
+    def ready(self):
+        from . import signals  # noqa: F401
+
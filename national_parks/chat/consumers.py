@@ -1,10 +1,13 @@
+import asyncio
 import json
 import re
-from urllib.parse import unquote
+from urllib.parse import parse_qs, unquote
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
-from .models import ChatRoom, Message
+from django.utils import timezone
+from .models import Message
+from . import history, persistence, rooms
 
 User = get_user_model()
 
@@ -15,11 +18,36 @@ def slugify_room_name(room_name):
 
     return name
 
+
+def room_group_name(room):
+    # By id rather than name, so a rename doesn't split a room's connections.
+    return f'chat_room_{room.pk}'
+
+
+def last_message_id(scope):
+    """The ``last_message_id`` (or ``since``) a reconnecting client passes in the query string."""
+    params = parse_qs(scope.get('query_string', b'').decode())
+    value = (params.get('last_message_id') or params.get('since') or [None])[0]
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
+    # Seconds disconnect() waits for this connection's messages to be written behind.
+    flush_timeout = 5
+
     async def connect(self):
+        self.pending = set()
+        self.history = None
         self.room_name = unquote(self.scope['url_route']['kwargs']['room_name'])
-        slug_room_name = slugify_room_name(self.room_name)
-        self.room_group_name = f'chat_{slug_room_name}'
+        # Resolved once per connection; receive() reuses it for every message.
+        self.room = await self.get_room()
+        if self.room:
+            self.room_group_name = room_group_name(self.room)
+        else:
+            self.room_group_name = f'chat_{slugify_room_name(self.room_name)}'
 
         # Join room group
         await self.channel_layer.group_add(
@@ -29,14 +57,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
 
-        # Send room info
-        room = await self.get_room()
-        if room:
-            await self.send(text_data=json.dumps({
-                'type': 'room_info',
-                'room_name': room.name,
-                'room_id': room.id
-            }))
+        # Send room info, then the history the client hasn't seen
+        if self.room:
+            await self.send_room_info()
+            self.history = await history.join(self.room)
+            await self.send_history()
+
+    async def send_room_info(self):
+        await self.send(text_data=json.dumps({
+            'type': 'room_info',
+            'room_name': self.room.name,
+            'room_id': self.room.id
+        }))
+
+    async def send_history(self):
+        replay = await history.replay(self.room, self.history, last_message_id(self.scope))
+        await self.send(text_data=json.dumps({'type': 'history', **replay}))
 
     async def disconnect(self, close_code):
         # Leave room group
@@ -44,6 +80,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
+        if self.history is not None:
+            history.leave(self.history)
+            self.history = None
+        if self.pending:
+            await asyncio.wait(self.pending, timeout=self.flush_timeout)
 
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
@@ -54,25 +95,46 @@ class ChatConsumer(AsyncWebsocketConsumer):
             user = self.scope['user']
 
             if user.is_authenticated:
+                if self.room and persistence.enabled():
+                    await self.write_behind(user, message, text_data_json.get('client_id'))
                 # Save message to database
-                room = await self.get_room()
-                if room:
-                    saved_message = await self.save_message(room, user, message)
-
-                    # Send message to room group
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            'type': 'chat_message',
-                            'message': message,
-                            'user_id': user.id,
-                            'username': user.username,
-                            'message_id': saved_message.id,
-                            'timestamp': saved_message.timestamp.isoformat(),
-                        }
-                    )
+                elif self.room:
+                    saved_message = await self.save_message(self.room, user, message)
+                    await self.broadcast(saved_message)
+
+    async def write_behind(self, user, content, client_id):
+        message = Message(id=persistence.next_id(), room=self.room, user=user, content=content,
+                          timestamp=timezone.now())
+        # Waits while the writer's queue is full, which stops this connection reading.
+        saved = await persistence.get_writer().submit(message)
+        await self.broadcast(message)
+        task = asyncio.ensure_future(self.acknowledge(saved, message.id, client_id))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def broadcast(self, message):
+        event = history.message_event(message)
+        # Buffered before it goes out, so a connection joining meanwhile replays it.
+        if self.history is not None:
+            self.history.add(event)
+        # Send message to room group
+        await self.channel_layer.group_send(self.room_group_name, {'type': 'chat_message', **event})
+
+    async def acknowledge(self, saved, message_id, client_id):
+        # Tell the author once the message is committed, or that it never will be.
+        try:
+            await saved
+            event = 'message_saved'
+        except Exception:
+            event = 'message_failed'
+        try:
+            await self.send(text_data=json.dumps({'type': event, 'message_id': message_id, 'client_id': client_id}))
+        except Exception:
+            pass  # the connection is gone
 
     async def chat_message(self, event):
+        if self.history is not None and event['message_id'] not in self.history.ids:
+            self.history.add({key: event[key] for key in history.EVENT_FIELDS})
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
             'type': 'chat_message',
@@ -83,12 +145,24 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'timestamp': event['timestamp'],
         }))
 
-    @database_sync_to_async
-    def get_room(self):
-        try:
-            return ChatRoom.objects.get(name=self.room_name)
-        except ChatRoom.DoesNotExist:
-            return None
+    async def room_changed(self, event):
+        # Sent by chat.signals when this room is renamed or deleted.
+        if event['deleted']:
+            self.room = None
+            await self.send(text_data=json.dumps({'type': 'room_closed', 'room_id': event['room_id']}))
+            await self.close()
+        else:
+            self.room_name = event['room_name']
+            self.room = await self.get_room()
+            if self.room:
+                await self.send_room_info()
+
+    async def get_room(self):
+        # A cache hit skips the hop to the database thread altogether.
+        room = rooms.cached(self.room_name)
+        if room is None:
+            room = await database_sync_to_async(rooms.get_room)(self.room_name)
+        return room
 
     @database_sync_to_async
     def save_message(self, room, user, content):
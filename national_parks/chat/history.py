@@ -0,0 +1,194 @@
+"""Recent messages per room, replayed to WebSocket clients on connect.
+
+While a process has connections to a room it keeps that room's last
+``CHAT_HISTORY_SIZE`` messages in a ring buffer: seeded from the database by
+the first connection, then fed every message broadcast to the room by the
+connections (``ChatConsumer.broadcast`` and ``chat_message``). The buffer is dropped with the
+room's last local connection, since the process stops hearing about the room.
+
+``replay`` serves a connection from the buffer when it can: the last
+``CHAT_HISTORY_REPLAY`` messages for a fresh connection, or everything after the
+client's ``last_message_id`` on a reconnect. If that id has already left the
+buffer, the messages after it come from the ``(room, timestamp, id)`` index.
+Messages are ordered by ``(timestamp, id)`` like ``MessagePagination``, and
+``older`` is a cursor for its next page when there is more history to fetch.
+A message broadcast by another process at the very moment a connection joins
+can be both replayed and delivered live, so clients drop ids they have seen.
+"""
+import asyncio
+import bisect
+import threading
+from collections import deque
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from parks.pagination import after, encode_cursor
+from .models import Message
+
+DEFAULT_SIZE = 200
+DEFAULT_REPLAY = 50
+
+# What message_event returns, in chat_message events.
+EVENT_FIELDS = ('message', 'user_id', 'username', 'message_id', 'timestamp')
+
+_lock = threading.Lock()
+_buffers = {}  # room id -> RoomHistory
+
+
+def size():
+    return getattr(settings, 'CHAT_HISTORY_SIZE', DEFAULT_SIZE)
+
+
+def replay_limit():
+    return min(getattr(settings, 'CHAT_HISTORY_REPLAY', DEFAULT_REPLAY), size())
+
+
+def message_event(message):
+    """The fields clients get for a message, live (``chat_message``) or replayed."""
+    return {
+        'message': message.content,
+        'user_id': message.user_id,
+        'username': message.user.username,
+        'message_id': message.id,
+        'timestamp': message.timestamp.isoformat(timespec='microseconds'),
+    }
+
+
+def _key(event):
+    # Timestamps are all UTC with microseconds (see message_event), so they sort as strings.
+    return (event['timestamp'], event['message_id'])
+
+
+class RoomHistory:
+    def __init__(self, room_id):
+        self.room_id = room_id
+        self.events = deque(maxlen=size())
+        self.keys = deque(maxlen=size())
+        self.ids = set()
+        # Whether older messages exist than the ones buffered.
+        self.has_older = False
+        self.connections = 0
+        self.seeded = None
+
+    def add(self, event):
+        if event['message_id'] in self.ids:
+            return
+        key = _key(event)
+        if len(self.events) == self.events.maxlen:
+            if key < self.keys[0]:
+                self.has_older = True  # a straggler from before the buffered window
+                return
+            self.ids.discard(self.events[0]['message_id'])
+            self.events.popleft()
+            self.keys.popleft()
+            self.has_older = True
+        # Broadcasts arrive in order but for the odd straggler between processes.
+        position = len(self.keys) if not self.keys or key > self.keys[-1] else bisect.bisect(self.keys, key)
+        self.events.insert(position, event)
+        self.keys.insert(position, key)
+        self.ids.add(event['message_id'])
+
+    def recent(self, limit):
+        events = list(self.events)[-limit:]
+        older = self.has_older or len(self.events) > limit
+        return events, older
+
+    def after(self, message_id):
+        """The buffered messages after ``message_id``, or None if it isn't buffered."""
+        if message_id not in self.ids:
+            return None
+        for position, event in enumerate(self.events):
+            if event['message_id'] == message_id:
+                return list(self.events)[position + 1:]
+
+
+def _seed(room):
+    rows = list(Message.objects.filter(room=room).select_related('user').order_by('-timestamp', '-id')[:size() + 1])
+    return [message_event(message) for message in reversed(rows[:size()])], len(rows) > size()
+
+
+async def join(room):
+    """Count a local connection to ``room``; returns its history, seeded on first use."""
+    with _lock:
+        history = _buffers.get(room.pk)
+        if history is None:
+            history = _buffers[room.pk] = RoomHistory(room.pk)
+        history.connections += 1
+        seeding = history.seeded is None
+        if seeding:
+            history.seeded = asyncio.get_running_loop().create_future()
+    try:
+        if seeding:
+            events, has_older = await database_sync_to_async(_seed)(room)
+            for event in events:
+                history.add(event)
+            history.has_older = history.has_older or has_older
+            history.seeded.set_result(None)
+        else:
+            await asyncio.shield(history.seeded)
+    except BaseException as exc:
+        if seeding:
+            # Connections joining meanwhile fail too; the next one starts afresh.
+            with _lock:
+                if _buffers.get(room.pk) is history:
+                    del _buffers[room.pk]
+            if isinstance(exc, asyncio.CancelledError):
+                history.seeded.cancel()
+            else:
+                history.seeded.set_exception(exc)
+                history.seeded.exception()  # don't log it as unretrieved
+        leave(history)
+        raise
+    return history
+
+
+def leave(history):
+    """Undo ``join``; the buffer goes with the room's last local connection."""
+    with _lock:
+        history.connections -= 1
+        if history.connections <= 0 and _buffers.get(history.room_id) is history:
+            del _buffers[history.room_id]
+
+
+def _cursor(event):
+    return encode_cursor([event['timestamp'], event['message_id']])
+
+
+def _after_in_database(room, message_id, limit):
+    anchor = Message.objects.filter(room=room, pk=message_id).values_list('timestamp', 'id').first()
+    if anchor is None:
+        return None
+    rows = list(Message.objects.filter(room=room).filter(after(('timestamp', 'id'), anchor))
+                .select_related('user').order_by('timestamp', 'id')[:limit + 1])
+    return [message_event(message) for message in rows], anchor[0].isoformat(timespec='microseconds')
+
+
+async def replay(room, history, last_message_id=None):
+    """``{'messages', 'reset', 'older'}`` for a connection that has seen up to ``last_message_id``.
+
+    ``reset`` means the messages replace what the client has (a fresh connection,
+    or one that missed more than ``CHAT_HISTORY_REPLAY`` messages).
+    """
+    limit = replay_limit()
+    if last_message_id is not None:
+        events = history.after(last_message_id)
+        if events is None:
+            found = await database_sync_to_async(_after_in_database)(room, last_message_id, limit)
+            if found is not None:
+                rows, anchor_time = found
+                # Add what is buffered but perhaps not written yet (CHAT_WRITE_BEHIND).
+                anchor = (anchor_time, last_message_id)
+                seen = {event['message_id'] for event in rows}
+                buffered = [event for event in history.events
+                            if _key(event) > anchor and event['message_id'] not in seen]
+                events = sorted(rows + buffered, key=_key)
+        if events is not None and len(events) <= limit:
+            return {'messages': events, 'reset': False, 'older': None}
+    events, older = history.recent(limit)
+    return {'messages': events, 'reset': True, 'older': _cursor(events[0]) if older and events else None}
+
+
+def clear():
+    with _lock:
+        _buffers.clear()
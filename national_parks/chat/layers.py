@@ -0,0 +1,298 @@
+"""A channel layer for several ASGI worker processes on one host, without Redis.
+
+``serve(path)`` (``manage.py chat_broker``) runs a small broker on a Unix
+socket. Each process's ``UnixSocketChannelLayer`` keeps one connection to it;
+the broker holds the group memberships and forwards every message to the
+process that owns the destination channel, which queues it locally like
+``InMemoryChannelLayer`` does. When a process goes away the broker drops its
+channels from every group, so there is no group expiry to tune. A process
+that loses the broker (e.g. it restarted) reconnects and joins its groups
+and listened channels again.
+
+Frames are a 4-byte length and a msgpack list ``[op, *args]``:
+
+- process -> broker: ``hello id``, ``add group channel token``,
+  ``discard group channel token``, ``flush token``, ``listen channel``,
+  ``send channel message``, ``group group message``
+- broker -> process: ``msg channel message``, ``ok token``
+
+Process-specific channels (``new_channel``, what consumers use) are routed by
+the process id in their name; a general channel goes to one of the processes
+receiving on it. Like the Redis layer, a message for a full channel is dropped.
+Across hosts use Redis (``REDIS_URL``, see settings).
+"""
+import asyncio
+import itertools
+import logging
+import os
+import struct
+import uuid
+
+import msgpack
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('!I')
+# Stop forwarding to a process whose socket has this much unread data queued.
+MAX_BACKLOG = 16 * 1024 * 1024
+# Seconds between attempts to reach a broker that went away.
+RECONNECT_DELAY = 1
+
+
+def encode(*frame):
+    body = msgpack.packb(frame, use_bin_type=True)
+    return HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader):
+    size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return msgpack.unpackb(await reader.readexactly(size), raw=False)
+
+
+def owner_of(channel):
+    """The process id in a process-specific channel name, or None for a general channel."""
+    if '!' not in channel:
+        return None
+    return channel[:channel.index('!')].rsplit('.', 1)[-1]
+
+
+class Broker:
+    def __init__(self):
+        self.processes = {}  # process id -> writer
+        self.listeners = {}  # general channel -> [writers]
+        self.groups = {}  # group -> {channel}
+        self.stats = {'processes': 0, 'forwarded': 0, 'dropped': 0}
+
+    def deliver(self, channel, message):
+        owner = owner_of(channel)
+        if owner is not None:
+            writer = self.processes.get(owner)
+        else:
+            writers = self.listeners.get(channel)
+            writer = writers[0] if writers else None
+            if writer is not None and len(writers) > 1:
+                writers.append(writers.pop(0))
+        if writer is None or writer.is_closing() or writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+            self.stats['dropped'] += 1
+            return
+        writer.write(encode('msg', channel, message))
+        self.stats['forwarded'] += 1
+
+    async def handle(self, reader, writer):
+        process = None
+        try:
+            while True:
+                op, *args = await read_frame(reader)
+                if op == 'send':
+                    self.deliver(*args)
+                elif op == 'group':
+                    group, message = args
+                    for channel in self.groups.get(group, ()):
+                        self.deliver(channel, message)
+                elif op == 'add':
+                    group, channel, token = args
+                    self.groups.setdefault(group, set()).add(channel)
+                    writer.write(encode('ok', token))
+                elif op == 'discard':
+                    group, channel, token = args
+                    members = self.groups.get(group)
+                    if members is not None:
+                        members.discard(channel)
+                        if not members:
+                            del self.groups[group]
+                    writer.write(encode('ok', token))
+                elif op == 'listen':
+                    self.listeners.setdefault(args[0], []).append(writer)
+                elif op == 'flush':
+                    self.groups.clear()
+                    writer.write(encode('ok', args[0]))
+                elif op == 'hello':
+                    process = args[0]
+                    self.processes[process] = writer
+                    self.stats['processes'] += 1
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.forget(process, writer)
+            writer.close()
+
+    def forget(self, process, writer):
+        if process is not None and self.processes.get(process) is writer:
+            del self.processes[process]
+            for group, members in list(self.groups.items()):
+                members.difference_update([channel for channel in members if owner_of(channel) == process])
+                if not members:
+                    del self.groups[group]
+        for channel, writers in list(self.listeners.items()):
+            if writer in writers:
+                writers.remove(writer)
+                if not writers:
+                    del self.listeners[channel]
+
+
+async def serve(path):
+    """Run a broker on the Unix socket ``path`` until cancelled."""
+    if os.path.exists(path):
+        os.unlink(path)
+    broker = Broker()
+    server = await asyncio.start_unix_server(broker.handle, path)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    """Channel layer client of a ``chat.layers`` broker listening on ``path``."""
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path, expiry=60, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.path = path
+        self.id = uuid.uuid4().hex[:12]
+        self.tokens = itertools.count()
+        self.connection = None
+        self.lock = None
+        self.reset()
+
+    def reset(self):
+        self.queues = {}
+        self.waiting = {}
+        self.listening = set()
+        self.groups = set()  # (group, channel) joined through this layer
+
+    async def connect(self):
+        """The broker connection of the running loop, opened on first use."""
+        loop = asyncio.get_running_loop()
+        if self.connection is not None and self.connection[0] is loop and not self.connection[2].done():
+            return self.connection[1]
+        if self.lock is None or self.lock[0] is not loop:
+            self.lock = (loop, asyncio.Lock())
+        async with self.lock[1]:
+            if self.connection is None or self.connection[0] is not loop or self.connection[2].done():
+                lost = self.connection is not None and self.connection[0] is loop
+                if not lost:
+                    # Queues and groups belong to the old loop's consumers; start afresh.
+                    self.reset()
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                writer.write(encode('hello', self.id))
+                if lost:
+                    # A new broker knows nothing of this process; rejoin for the waiting consumers.
+                    for channel in self.listening:
+                        writer.write(encode('listen', channel))
+                    for group, channel in self.groups:
+                        writer.write(encode('add', group, channel, next(self.tokens)))
+                    logger.info('Reconnected to the channel layer broker at %s, rejoined %d group memberships',
+                                self.path, len(self.groups))
+                self.connection = (loop, writer, loop.create_task(self.read(reader)))
+        return self.connection[1]
+
+    async def reconnect(self):
+        """Reopen a lost broker connection, retrying until it succeeds or the layer is closed."""
+        while self.connection is not None:
+            try:
+                await self.connect()
+                return
+            except OSError:
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    async def read(self, reader):
+        try:
+            while True:
+                op, *args = await read_frame(reader)
+                if op == 'msg':
+                    channel, message = args
+                    queue = self.queue(channel)
+                    if not queue.full():
+                        queue.put_nowait(message)
+                elif op == 'ok':
+                    future = self.waiting.pop(args[0], None)
+                    if future is not None and not future.done():
+                        future.set_result(None)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.warning('Lost the channel layer broker at %s', self.path)
+            # Consumers blocked in receive() won't call connect(); reconnect for them.
+            asyncio.get_running_loop().create_task(self.reconnect())
+        finally:
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('channel layer broker went away'))
+            self.waiting.clear()
+
+    def queue(self, channel):
+        queue = self.queues.get(channel)
+        if queue is None:
+            queue = self.queues[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return queue
+
+    async def request(self, op, *args):
+        """Send ``op`` and wait for the broker to confirm it."""
+        writer = await self.connect()
+        token = next(self.tokens)
+        future = self.waiting[token] = asyncio.get_running_loop().create_future()
+        writer.write(encode(op, *args, token))
+        await writer.drain()
+        await future
+
+    async def write(self, *frame):
+        writer = await self.connect()
+        writer.write(encode(*frame))
+        await writer.drain()
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        await self.write('send', channel, message)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        await self.connect()
+        if owner_of(channel) is None and channel not in self.listening:
+            self.listening.add(channel)
+            await self.write('listen', channel)
+        queue = self.queue(channel)
+        try:
+            return await queue.get()
+        finally:
+            if queue.empty() and self.queues.get(channel) is queue:
+                del self.queues[channel]
+
+    async def new_channel(self, prefix='specific.'):
+        return f'{prefix}.{self.id}!{uuid.uuid4().hex[:12]}'
+
+    async def flush(self):
+        await self.request('flush')
+        self.queues = {}
+        self.groups.clear()
+
+    async def close(self):
+        if self.connection is not None:
+            self.connection[1].close()
+            self.connection[2].cancel()
+            self.connection = None
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self.request('add', group, channel)
+        self.groups.add((group, channel))
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        self.groups.discard((group, channel))
+        await self.request('discard', group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        await self.write('group', group, message)
@@ -0,0 +1,83 @@
+import asyncio
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from chat import persistence, rooms
+from chat.consumers import ChatConsumer
+from chat.models import ChatRoom, Message
+
+
+class PerMessageLookupConsumer(ChatConsumer):
+    """The consumer as it was: the room looked up again, uncached, for every message."""
+
+    async def receive(self, text_data):
+        self.room = await database_sync_to_async(ChatRoom.objects.filter(name=self.room_name).first)()
+        await super().receive(text_data)
+
+
+class Command(BaseCommand):
+    help = ("Messages per second per WebSocket connection through ChatConsumer, with the room looked "
+            "up on every message (before), resolved once per connection (after), and with messages "
+            "written behind (CHAT_WRITE_BEHIND). A temporary user and room are created and deleted again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500, help='Messages sent per connection')
+        parser.add_argument('--connections', type=int, default=1, help='Concurrent connections to the room')
+
+    async def connection(self, consumer, room, user):
+        communicator = WebsocketCommunicator(consumer.as_asgi(), f'/ws/chat/{room.name}/')
+        communicator.scope['user'] = user
+        communicator.scope['url_route'] = {'kwargs': {'room_name': room.name}}
+        connected, _ = await communicator.connect()
+        assert connected
+        await communicator.receive_json_from()  # room_info
+        return communicator
+
+    async def run(self, consumer, room, user, opts):
+        rooms.clear()
+        count, connections = opts['messages'], opts['connections']
+        communicators = [await self.connection(consumer, room, user) for _ in range(connections)]
+
+        async def chat(number, communicator):
+            # One message in flight per connection: send, then read until its own echo
+            # arrives (passing the other connections' messages), like a chat client would.
+            start = time.perf_counter()
+            for i in range(count):
+                text = f'benchmark {number}/{i}'
+                await communicator.send_json_to({'type': 'chat_message', 'message': text})
+                while (await communicator.receive_json_from(timeout=30)).get('message') != text:
+                    pass
+            return count / (time.perf_counter() - start)
+
+        rates = await asyncio.gather(*[chat(number, communicator) for number, communicator in enumerate(communicators)])
+        for communicator in communicators:
+            await communicator.disconnect()
+        if persistence.enabled():
+            await persistence.get_writer().flush()
+        return sum(rates) / len(rates), rooms.stats()
+
+    def handle(self, *args, **opts):
+        suffix = uuid.uuid4().hex[:8]
+        user = get_user_model().objects.create_user(f'chat-bench-{suffix}')
+        room = ChatRoom.objects.create(name=f'chat-bench-{suffix}', created_by=user)
+        try:
+            self.stdout.write(f"{'consumer':<22} {'msgs/s/connection':>18} {'room cache hits':>16} "
+                              f"{'misses':>7} {'stored':>7}")
+            for label, consumer, write_behind in (('lookup per message', PerMessageLookupConsumer, False),
+                                                  ('room per connection', ChatConsumer, False),
+                                                  ('write-behind', ChatConsumer, True)):
+                Message.objects.filter(room=room).delete()
+                with override_settings(CHAT_WRITE_BEHIND=write_behind):
+                    rate, stats = async_to_sync(self.run)(consumer, room, user, opts)
+                stored = Message.objects.filter(room=room).count()
+                self.stdout.write(f"{label:<22} {rate:>18.1f} {stats['hits']:>16} {stats['misses']:>7} {stored:>7}")
+        finally:
+            room.delete()
+            user.delete()
@@ -0,0 +1,25 @@
+import asyncio
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import layers
+
+
+class Command(BaseCommand):
+    help = ("Run the chat.layers broker that lets several ASGI workers on this host share groups "
+            "(CHANNEL_LAYERS via CHAT_LAYER_SOCKET)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=os.getenv('CHAT_LAYER_SOCKET'),
+                            help='Unix socket to listen on (default: $CHAT_LAYER_SOCKET)')
+
+    def handle(self, *args, **opts):
+        if not opts['path']:
+            raise CommandError('Give a socket path or set CHAT_LAYER_SOCKET.')
+        self.stdout.write(f"Channel layer broker listening on {opts['path']}")
+        self.stdout.flush()
+        try:
+            asyncio.run(layers.serve(opts['path']))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.consumers import ChatConsumer
+from chat.models import ChatRoom
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else None
+
+
+class Command(BaseCommand):
+    help = ("Run several worker processes sharing a channel layer, each with ChatConsumer connections "
+            "to one room, and check that every message reaches every connection in every worker. "
+            "Uses Redis with --redis, otherwise a chat.layers broker started for the run. Reports "
+            "deliveries and fan-out latency (send to receipt).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--connections', type=int, default=5, help='Connections per worker')
+        parser.add_argument('--messages', type=int, default=50, help='Messages sent per worker')
+        parser.add_argument('--rate', type=float, default=20, help='Messages per second per worker (0: no pause)')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for deliveries')
+        parser.add_argument('--redis', metavar='URL', help='Use the Redis channel layer at URL')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+        # Set on the worker processes this command starts.
+        parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+        parser.add_argument('--room', help=argparse.SUPPRESS)
+        parser.add_argument('--user', type=int, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **opts):
+        if opts['worker'] is not None:
+            result = asyncio.run(self.worker(opts))
+            self.stdout.write(json.dumps(result))
+            return
+
+        suffix = uuid.uuid4().hex[:8]
+        user = get_user_model().objects.create_user(f'layer-load-{suffix}')
+        room = ChatRoom.objects.create(name=f'layer-load-{suffix}', created_by=user)
+        broker = None
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'national_parks.settings'))
+        env.pop('REDIS_URL', None)
+        env.pop('CHAT_LAYER_SOCKET', None)
+        manage = [sys.executable, str(settings.BASE_DIR / 'manage.py')]
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                if opts['redis']:
+                    env['REDIS_URL'] = opts['redis']
+                    layer = f"redis ({opts['redis']})"
+                else:
+                    env['CHAT_LAYER_SOCKET'] = os.path.join(directory, 'layer.sock')
+                    broker = subprocess.Popen(manage + ['chat_broker', env['CHAT_LAYER_SOCKET']], env=env,
+                                              stdout=subprocess.DEVNULL)
+                    self.wait_for(env['CHAT_LAYER_SOCKET'], broker)
+                    layer = 'chat.layers broker'
+                results = self.run_workers(manage, env, room, user, opts)
+            finally:
+                if broker is not None:
+                    broker.terminate()
+                    broker.wait()
+                room.delete()
+                user.delete()
+        self.report(layer, results, opts)
+
+    def wait_for(self, path, broker):
+        deadline = time.monotonic() + 30
+        while not os.path.exists(path):
+            if broker.poll() is not None or time.monotonic() > deadline:
+                raise CommandError('The channel layer broker did not start.')
+            time.sleep(0.05)
+
+    def run_workers(self, manage, env, room, user, opts):
+        command = manage + ['loadtest_channel_layer', '--room', room.name, '--user', str(user.pk)]
+        for option in ('connections', 'messages', 'rate', 'timeout', 'workers'):
+            command += [f'--{option}', str(opts[option])]
+        workers = [subprocess.Popen(command + ['--worker', str(index)], env=env, text=True,
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                   for index in range(opts['workers'])]
+        try:
+            # Everyone connects first, then all start sending together.
+            for worker in workers:
+                if worker.stdout.readline().strip() != 'ready':
+                    raise CommandError('A worker failed to start.')
+            for worker in workers:
+                worker.stdin.write('go\n')
+                worker.stdin.flush()
+            return [json.loads(worker.stdout.readline()) for worker in workers]
+        finally:
+            for worker in workers:
+                try:
+                    worker.wait(timeout=opts['timeout'] + 30)
+                except subprocess.TimeoutExpired:
+                    worker.kill()
+
+    async def worker(self, opts):
+        user = await get_user_model().objects.aget(pk=opts['user'])
+        index, room = opts['worker'], opts['room']
+        expected = opts['workers'] * opts['messages']
+        communicators = []
+        for _ in range(opts['connections']):
+            communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f'/ws/chat/{room}/')
+            communicator.scope['user'] = user
+            communicator.scope['url_route'] = {'kwargs': {'room_name': room}}
+            connected, _ = await communicator.connect()
+            assert connected
+            await communicator.receive_json_from()  # room_info
+            communicators.append(communicator)
+        print('ready', flush=True)
+        await asyncio.to_thread(sys.stdin.readline)
+
+        latencies, cross_worker = [], 0
+        deadline = time.monotonic() + opts['timeout']
+
+        async def listen(communicator):
+            nonlocal cross_worker
+            received = 0
+            while received < expected and time.monotonic() < deadline:
+                try:
+                    event = await communicator.receive_json_from(timeout=deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    break
+                if event.get('type') != 'chat_message':
+                    continue
+                _, sender, _, sent_at = event['message'].split()
+                latencies.append(time.time() - float(sent_at))
+                cross_worker += int(sender) != index
+                received += 1
+            return received
+
+        async def send():
+            for number in range(opts['messages']):
+                await communicators[0].send_json_to(
+                    {'type': 'chat_message', 'message': f'load {index} {number} {time.time():.6f}'})
+                if opts['rate']:
+                    await asyncio.sleep(1 / opts['rate'])
+
+        received, _ = await asyncio.gather(asyncio.gather(*[listen(c) for c in communicators]), send())
+        for communicator in communicators:
+            await communicator.disconnect()
+        return {'worker': index, 'received': received, 'expected': expected,
+                'cross_worker': cross_worker, 'latencies': latencies}
+
+    def report(self, layer, results, opts):
+        latencies = [latency * 1000 for result in results for latency in result['latencies']]
+        received = sum(sum(result['received']) for result in results)
+        expected = sum(result['expected'] * len(result['received']) for result in results)
+        summary = {
+            'layer': layer,
+            'workers': opts['workers'],
+            'connections': opts['workers'] * opts['connections'],
+            'messages_sent': opts['workers'] * opts['messages'],
+            'deliveries': received,
+            'expected_deliveries': expected,
+            'cross_worker_deliveries': sum(result['cross_worker'] for result in results),
+            'latency_ms': {
+                name: round(value, 2) if value is not None else None for name, value in (
+                    ('p50', percentile(latencies, 0.5)),
+                    ('p95', percentile(latencies, 0.95)),
+                    ('p99', percentile(latencies, 0.99)),
+                    ('max', max(latencies, default=None)),
+                    ('mean', statistics.fmean(latencies) if latencies else None),
+                )
+            },
+        }
+        if opts['json']:
+            self.stdout.write(json.dumps(summary, indent=2))
+        else:
+            self.stdout.write(f"{summary['layer']}: {summary['workers']} workers, {summary['connections']} "
+                              f"connections, {summary['messages_sent']} messages")
+            self.stdout.write(f"delivered {received} of {expected} "
+                              f"({summary['cross_worker_deliveries']} across workers)")
+            if latencies:
+                self.stdout.write('fan-out latency ms: ' + ', '.join(
+                    f'{name} {value:.1f}' for name, value in summary['latency_ms'].items()))
+        if received < expected:
+            raise CommandError(f'{expected - received} deliveries missing.')
@@ -0,0 +1,209 @@
+import asyncio
+import json
+import platform
+import resource
+import subprocess
+import time
+import uuid
+from datetime import datetime, timezone
+
+import django
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from chat import persistence
+from chat.models import ChatRoom
+from chat.routing import websocket_urlpatterns
+from .loadtest_channel_layer import percentile
+
+
+def rss_kb():
+    """Resident memory of this process in KB (peak RSS where /proc is missing)."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def summarize(values, scale=1000):
+    """p50/p90/p99/max of ``values`` (seconds) in milliseconds."""
+    return {name: round(value * scale, 2) if value is not None else None for name, value in (
+        ('p50', percentile(values, 0.5)),
+        ('p90', percentile(values, 0.9)),
+        ('p99', percentile(values, 0.99)),
+        ('max', max(values, default=None)),
+    )}
+
+
+class Command(BaseCommand):
+    help = ("Load test the chat WebSocket path (chat.routing -> ChatConsumer) in process: open many "
+            "connections across many rooms, send messages at a fixed rate per room and measure connect "
+            "latency, end-to-end broadcast latency, throughput and memory per connection. Temporary "
+            "rooms and a user are created and deleted again. Use --output to append the results as a "
+            "JSON line, for tracking them over time.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=1000, help='Total connections, spread over the rooms')
+        parser.add_argument('--rooms', type=int, default=50)
+        parser.add_argument('--rate', type=float, default=1, help='Messages per second sent to each room')
+        parser.add_argument('--senders', type=int, default=1, help='Connections sending in each room')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to send for')
+        parser.add_argument('--connect-concurrency', type=int, default=100, help='Connections opened at once')
+        parser.add_argument('--drain', type=float, default=10, help='Seconds to wait for the last deliveries')
+        parser.add_argument('--label', default='', help='Free text stored with the results')
+        parser.add_argument('--output', metavar='FILE', help='Append the results to FILE as one JSON line')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **opts):
+        suffix = uuid.uuid4().hex[:8]
+        user = get_user_model().objects.create_user(f'chat-load-{suffix}')
+        rooms = ChatRoom.objects.bulk_create(
+            [ChatRoom(name=f'chat-load-{suffix}-{number}', created_by=user) for number in range(opts['rooms'])])
+        try:
+            metrics = asyncio.run(self.run(rooms, user, opts))
+        finally:
+            ChatRoom.objects.filter(pk__in=[room.pk for room in rooms]).delete()
+            user.delete()
+
+        results = {'run': self.environment(opts), 'metrics': metrics}
+        if opts['output']:
+            with open(opts['output'], 'a') as output:
+                output.write(json.dumps(results) + '\n')
+        if opts['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.print_summary(metrics)
+
+    def environment(self, opts):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                    capture_output=True, text=True, timeout=10).stdout.strip() or None
+        except OSError:
+            commit = None
+        return {
+            'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'label': opts['label'],
+            'commit': commit,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'channel_layer': type(get_channel_layer()).__name__,
+            'write_behind': persistence.enabled(),
+            'database': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+            'options': {name: opts[name] for name in ('connections', 'rooms', 'rate', 'senders', 'duration')},
+        }
+
+    async def run(self, rooms, user, opts):
+        application = URLRouter(websocket_urlpatterns)
+        latencies, connect_times, failed = [], [], 0
+        received = dict.fromkeys(range(len(rooms)), 0)
+        sent_times = {}
+        limit = asyncio.Semaphore(opts['connect_concurrency'])
+
+        async def connect(number):
+            nonlocal failed
+            room_index = number % len(rooms)
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{rooms[room_index].name}/')
+            communicator.scope['user'] = user
+            async with limit:
+                start = time.perf_counter()
+                try:
+                    connected, _ = await communicator.connect(timeout=30)
+                    connected = connected and (await communicator.receive_json_from(timeout=30))['type'] == 'room_info'
+                except Exception:
+                    connected = False
+                if not connected:
+                    failed += 1
+                    return None
+                connect_times.append(time.perf_counter() - start)
+            return room_index, communicator
+
+        async def listen(room_index, communicator):
+            while True:
+                event = await communicator.receive_json_from(timeout=3600)
+                if event.get('type') != 'chat_message':
+                    continue
+                sent = sent_times.get(event['message'])
+                if sent is not None:
+                    latencies.append(time.perf_counter() - sent)
+                    received[room_index] += 1
+
+        async def send(room_index, communicator, offset):
+            # Senders in a room take turns, so the room gets ``rate`` messages a second.
+            interval = opts['senders'] / opts['rate']
+            await asyncio.sleep(offset)
+            number, end = 0, time.perf_counter() + opts['duration']
+            while time.perf_counter() < end:
+                text = f'load {room_index} {id(communicator)} {number}'
+                sent_times[text] = time.perf_counter()
+                await communicator.send_json_to({'type': 'chat_message', 'message': text})
+                number += 1
+                await asyncio.sleep(interval)
+            return number
+
+        memory_before = rss_kb()
+        start = time.perf_counter()
+        connections = [c for c in await asyncio.gather(*[connect(n) for n in range(opts['connections'])]) if c]
+        connect_seconds = time.perf_counter() - start
+        memory_per_connection = (rss_kb() - memory_before) / len(connections) if connections else None
+
+        by_room = {}
+        for room_index, communicator in connections:
+            by_room.setdefault(room_index, []).append(communicator)
+        listeners = [asyncio.ensure_future(listen(room_index, c)) for room_index, c in connections]
+        senders = []
+        for room_index, communicators in by_room.items():
+            for position, communicator in enumerate(communicators[:opts['senders']]):
+                # Spread the first sends over the first interval instead of all at once.
+                offset = (room_index / len(rooms) + position) / opts['rate']
+                senders.append(send(room_index, communicator, offset))
+
+        start = time.perf_counter()
+        sent_by_sender = await asyncio.gather(*senders)
+        send_seconds = time.perf_counter() - start
+        expected = self.expected(by_room, sent_times)
+        deadline = time.perf_counter() + opts['drain']
+        while sum(received.values()) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - start
+
+        for listener in listeners:
+            listener.cancel()
+        await asyncio.gather(*listeners, return_exceptions=True)
+        for _, communicator in connections:
+            await communicator.disconnect()
+        if persistence.enabled():
+            await persistence.get_writer().flush()
+
+        sent, delivered = sum(sent_by_sender), sum(received.values())
+        return {
+            'connections': len(connections),
+            'failed_connections': failed,
+            'connect_seconds': round(connect_seconds, 3),
+            'connect_latency_ms': summarize(connect_times),
+            'memory_per_connection_kb': round(memory_per_connection, 1) if memory_per_connection is not None else None,
+            'messages_sent': sent,
+            'messages_per_second': round(sent / send_seconds, 1),
+            'deliveries': delivered,
+            'expected_deliveries': expected,
+            'lost_deliveries': expected - delivered,
+            'deliveries_per_second': round(delivered / elapsed, 1),
+            'broadcast_latency_ms': summarize(latencies),
+        }
+
+    def expected(self, by_room, sent_times):
+        # Every message reaches each connection in its room, the sender's included.
+        return sum(len(by_room[int(text.split()[1])]) for text in sent_times)
+
+    def print_summary(self, metrics):
+        for name, value in metrics.items():
+            if isinstance(value, dict):
+                value = ', '.join(f'{key} {number}' for key, number in value.items())
+            self.stdout.write(f'{name:<26} {value}')
@@ -24,12 +24,16 @@ class Message(models.Model):
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='messages')
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set by the caller when writing behind (chat.persistence), so not auto_now_add.
+    timestamp = models.DateTimeField(default=timezone.now)
     edited = models.BooleanField(default=False)
     edited_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['room', 'timestamp', 'id'], name='message_room_timestamp_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} in {self.room.name}: {self.content[:50]}"
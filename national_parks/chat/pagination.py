@@ -0,0 +1,8 @@
+from parks.pagination import KeysetPagination
+
+
+class MessagePagination(KeysetPagination):
+    """Newest messages first; following ``next`` walks back through older history."""
+    ordering = ('-timestamp', '-id')
+    page_size = 50
+    max_page_size = 200
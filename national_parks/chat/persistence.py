@@ -0,0 +1,203 @@
+"""Write-behind persistence for chat messages (``CHAT_WRITE_BEHIND``).
+
+With it on, ``ChatConsumer`` gives a message its id (``next_id``, snowflake
+style) and timestamp itself, broadcasts it at once and hands it to the
+``MessageWriter`` of its event loop. The writer inserts queued messages with
+one ``bulk_create`` per batch, once ``CHAT_WRITE_BATCH_SIZE`` messages are
+waiting or ``CHAT_WRITE_FLUSH_INTERVAL`` seconds after the first one.
+
+- Backpressure: the queue holds ``CHAT_WRITE_QUEUE_SIZE`` messages; when it is
+  full ``submit`` waits, so a flooding connection stops reading its socket.
+- Acknowledgement: ``submit`` returns a future that resolves once the message
+  is committed; the consumer only sends ``message_saved`` to the author then.
+  Failed batches are retried (a row the database rejects outright, e.g. for a
+  deleted room, fails alone and is never acknowledged).
+- Shutdown: ``flush()`` drains the queue, and an ``atexit`` hook writes
+  anything still queued or in flight synchronously, ignoring rows a batch had
+  already committed.
+- Ids: while it is on, any other ``Message.save()`` (REST API, admin) also
+  takes a ``next_id`` (``chat.signals``). ``bulk_create`` without ids and
+  processes running with the setting off still use the database sequence,
+  whose next value may land on a snowflake id, so every process writing
+  messages must agree on ``CHAT_WRITE_BEHIND``.
+"""
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+import weakref
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections
+
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+# Snowflake layout: milliseconds since EPOCH_MS (41 bits), worker (5), sequence (7).
+# 53 bits in all, so JavaScript clients can still hold ids as plain numbers.
+EPOCH_MS = 1704067200000  # 2024-01-01
+WORKER_BITS = 5
+SEQUENCE_BITS = 7
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 10.0
+
+_id_lock = threading.Lock()
+_id_state = {'ms': 0, 'sequence': 0}
+_writers = weakref.WeakKeyDictionary()
+# Writers with messages not yet written, for the atexit hook.
+_busy_writers = set()
+
+
+def enabled():
+    return getattr(settings, 'CHAT_WRITE_BEHIND', False)
+
+
+def worker_id():
+    # Must differ between processes writing at the same time; the pid is only a
+    # fallback, set CHAT_WORKER_ID (0-31) per server process in production.
+    configured = getattr(settings, 'CHAT_WORKER_ID', None)
+    return (os.getpid() if configured is None else configured) % (1 << WORKER_BITS)
+
+
+def next_id():
+    """A unique, roughly time-ordered message id (up to 128 per millisecond per worker)."""
+    with _id_lock:
+        now = int(time.time() * 1000)
+        if now <= _id_state['ms']:
+            now = _id_state['ms']
+            _id_state['sequence'] = (_id_state['sequence'] + 1) & MAX_SEQUENCE
+            if _id_state['sequence'] == 0:
+                now += 1  # sequence exhausted; borrow the next millisecond
+        else:
+            _id_state['sequence'] = 0
+        _id_state['ms'] = now
+        return ((now - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)) | (worker_id() << SEQUENCE_BITS) | _id_state['sequence']
+
+
+class MessageWriter:
+    def __init__(self, batch_size=None, flush_interval=None, queue_size=None):
+        self.batch_size = batch_size or getattr(settings, 'CHAT_WRITE_BATCH_SIZE', 200)
+        self.flush_interval = flush_interval or getattr(settings, 'CHAT_WRITE_FLUSH_INTERVAL', 0.05)
+        self.queue = asyncio.Queue(maxsize=queue_size or getattr(settings, 'CHAT_WRITE_QUEUE_SIZE', 10000))
+        # The batch being collected or written, kept until it is committed (see write_remaining).
+        self.in_flight = []
+        self.stats = {'queued': 0, 'written': 0, 'batches': 0, 'failed': 0, 'retries': 0}
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def submit(self, message):
+        """Queue ``message`` (id and timestamp already set); the returned future resolves once it is committed."""
+        future = asyncio.get_running_loop().create_future()
+        _busy_writers.add(self)
+        await self.queue.put((message, future))
+        self.stats['queued'] += 1
+        return future
+
+    async def next_batch(self):
+        """Fill ``in_flight`` with the next batch (taken off the queue as it arrives, so write_remaining sees it)."""
+        batch = self.in_flight = [await self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        while True:
+            batch = await self.next_batch()
+            delay = RETRY_DELAY
+            while True:
+                try:
+                    rejected = await database_sync_to_async(insert)([message for message, _ in batch])
+                    break
+                except DatabaseError:
+                    # e.g. the database is locked or unreachable: nothing is acknowledged, try again.
+                    logger.exception('Writing %d chat messages failed; retrying in %.1fs', len(batch), delay)
+                    self.stats['retries'] += 1
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, MAX_RETRY_DELAY)
+            for message, future in batch:
+                if future.done():
+                    continue
+                if message.pk in rejected:
+                    future.set_exception(rejected[message.pk])
+                else:
+                    future.set_result(message)
+            self.stats['batches'] += 1
+            self.stats['failed'] += len(rejected)
+            self.stats['written'] += len(batch) - len(rejected)
+            for _ in batch:
+                self.queue.task_done()
+            self.in_flight = []
+            if self.queue.empty():
+                _busy_writers.discard(self)
+
+    async def flush(self):
+        """Wait until everything queued so far is committed (or rejected)."""
+        await self.queue.join()
+
+    def write_remaining(self):
+        """Synchronously write what is queued or in flight, e.g. at interpreter exit."""
+        messages = [message for message, _ in self.in_flight]
+        while not self.queue.empty():
+            messages.append(self.queue.get_nowait()[0])
+        if messages:
+            Message.objects.bulk_create(messages, batch_size=500, ignore_conflicts=True)
+        _busy_writers.discard(self)
+        return len(messages)
+
+
+def insert(messages):
+    """Insert ``messages``; returns ``{id: error}`` for rows the database rejected.
+
+    One ``bulk_create`` in the common case. If it violates a constraint, the
+    rows are retried one by one so only the bad ones fail.
+    """
+    close_old_connections()
+    try:
+        Message.objects.bulk_create(messages)
+        return {}
+    except IntegrityError:
+        pass
+    rejected = {}
+    for message in messages:
+        try:
+            Message.objects.bulk_create([message])
+        except IntegrityError as exc:
+            rejected[message.pk] = exc
+    return rejected
+
+
+def get_writer():
+    """The writer of the running event loop, started on first use."""
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None or writer.task.done():
+        writer = _writers[loop] = MessageWriter()
+    return writer
+
+
+@atexit.register
+def _write_remaining():
+    for writer in list(_busy_writers):
+        try:
+            written = writer.write_remaining()
+        except Exception:
+            logger.exception('Could not write queued chat messages at exit')
+            continue
+        if written:
+            logger.warning('Wrote %d queued chat messages at exit', written)
@@ -0,0 +1,67 @@
+"""Process-wide cache of ``ChatRoom`` lookups by name, for the WebSocket consumer.
+
+``get_room`` hits the database once per name and then serves the cached row
+for ``CHAT_ROOM_CACHE_TTL`` seconds. Saving or deleting a room drops its
+entries in this process at once (see ``chat.signals``); the TTL bounds how
+long other processes can keep serving a renamed or deleted room. Cached rooms
+are shared between connections, so treat them as read-only.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from .models import ChatRoom
+
+DEFAULT_TTL = 60
+
+_lock = threading.Lock()
+# name -> (room, expires at)
+_rooms = {}
+_counts = {'hits': 0, 'misses': 0}
+
+
+def ttl():
+    return getattr(settings, 'CHAT_ROOM_CACHE_TTL', DEFAULT_TTL)
+
+
+def cached(name):
+    """The cached room called ``name``, or None on a miss; never touches the database."""
+    entry = _rooms.get(name)
+    if entry is not None and entry[1] > time.monotonic():
+        _counts['hits'] += 1
+        return entry[0]
+    return None
+
+
+def get_room(name):
+    """The room called ``name``, or None. Unknown names aren't cached, so a new room is found at once."""
+    room = cached(name)
+    if room is not None:
+        return room
+    _counts['misses'] += 1
+    room = ChatRoom.objects.filter(name=name).first()
+    with _lock:
+        if room is not None:
+            _rooms[name] = (room, time.monotonic() + ttl())
+        else:
+            _rooms.pop(name, None)
+    return room
+
+
+def invalidate(room):
+    """Forget ``room`` under its current name and any name it was cached under."""
+    with _lock:
+        for name, (cached, _) in list(_rooms.items()):
+            if name == room.name or cached.pk == room.pk:
+                del _rooms[name]
+
+
+def stats():
+    return {**_counts, 'entries': len(_rooms)}
+
+
+def clear():
+    with _lock:
+        _rooms.clear()
+        _counts.update(hits=0, misses=0)
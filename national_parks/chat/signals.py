@@ -0,0 +1,45 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import ChatRoom, Message
+from . import persistence
+from . import rooms
+
+
+def notify_consumers(room, deleted):
+    # Connections hold their room for their whole life; tell them it changed.
+    from .consumers import room_group_name
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(room_group_name(room), {
+        'type': 'room_changed',
+        'room_id': room.pk,
+        'room_name': room.name,
+        'deleted': deleted,
+    })
+
+
+@receiver(post_save, sender=ChatRoom)
+def room_saved(sender, instance, created=False, raw=False, **kwargs):
+    rooms.invalidate(instance)
+    if not created and not raw:
+        transaction.on_commit(lambda: notify_consumers(instance, deleted=False))
+
+
+@receiver(post_delete, sender=ChatRoom)
+def room_deleted(sender, instance, **kwargs):
+    rooms.invalidate(instance)
+    transaction.on_commit(lambda: notify_consumers(instance, deleted=True))
+
+
+@receiver(pre_save, sender=Message)
+def assign_message_id(sender, instance, raw=False, **kwargs):
+    # With write-behind on every message takes a snowflake id, whichever path
+    # saves it, so ids from the database sequence can't collide with them.
+    if instance.pk is None and not raw and persistence.enabled():
+        instance.pk = persistence.next_id()
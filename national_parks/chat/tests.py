@@ -1,4 +1,434 @@
-from django.test import TestCase
+import asyncio
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import timedelta
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
 
+from .layers import Broker, UnixSocketChannelLayer, encode, owner_of, read_frame, serve
+from .models import ChatRoom, Message
+from .routing import websocket_urlpatterns
+from . import history, persistence, rooms
+
+application = URLRouter(websocket_urlpatterns)
+
+
+async def connect(room_name, user, query=''):
+    """A connected communicator for ``room_name``, with ``room_info`` and ``history`` read off."""
+    communicator = WebsocketCommunicator(application, f'/ws/chat/{room_name}/' + (f'?{query}' if query else ''))
+    communicator.scope['user'] = user
+    connected, _ = await communicator.connect()
+    assert connected
+    room_info = await communicator.receive_json_from()
+    replay = await communicator.receive_json_from()
+    return communicator, room_info, replay
+
+
+class ChatTestCase(TransactionTestCase):
+    """WebSocket tests; transactional, since the consumer's database calls close old connections."""
+
+    def setUp(self):
+        rooms.clear()
+        history.clear()
+        async_to_sync(get_channel_layer().flush)()
+        self.user = get_user_model().objects.create_user('chatter', password='pw')
+        self.room = ChatRoom.objects.create(name='lobby', created_by=self.user)
+
+
+class RoomCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.room = ChatRoom.objects.create(name='lobby')
+
+    def setUp(self):
+        rooms.clear()
+
+    def test_hit_skips_the_database(self):
+        self.assertIsNone(rooms.cached('lobby'))
+        with self.assertNumQueries(1):
+            self.assertEqual(rooms.get_room('lobby'), self.room)
+        with self.assertNumQueries(0):
+            self.assertEqual(rooms.get_room('lobby'), self.room)
+        self.assertEqual(rooms.stats(), {'hits': 1, 'misses': 1, 'entries': 1})
+
+    def test_unknown_names_are_not_cached(self):
+        self.assertIsNone(rooms.get_room('nowhere'))
+        ChatRoom.objects.create(name='nowhere')
+        self.assertIsNotNone(rooms.get_room('nowhere'))
+
+    def test_rename_and_delete_invalidate(self):
+        rooms.get_room('lobby')
+        self.room.name = 'hall'
+        self.room.save()
+        self.assertIsNone(rooms.cached('lobby'))
+        self.assertIsNone(rooms.get_room('lobby'))
+        self.assertEqual(rooms.get_room('hall').pk, self.room.pk)
+        self.room.delete()
+        self.assertIsNone(rooms.cached('hall'))
+        self.assertIsNone(rooms.get_room('hall'))
+
+    def test_expired_entries_are_refetched(self):
+        with self.settings(CHAT_ROOM_CACHE_TTL=0):
+            rooms.get_room('lobby')
+            self.assertIsNone(rooms.cached('lobby'))
+
+
+class RoomChangeTests(ChatTestCase):
+    async def test_rename_is_pushed_to_connections(self):
+        communicator, room_info, _ = await connect('lobby', self.user)
+        self.assertEqual(room_info, {'type': 'room_info', 'room_name': 'lobby', 'room_id': self.room.pk})
+        self.room.name = 'hall'
+        await database_sync_to_async(self.room.save)()
+        self.assertEqual(await communicator.receive_json_from(),
+                         {'type': 'room_info', 'room_name': 'hall', 'room_id': self.room.pk})
+        await communicator.disconnect()
+
+    async def test_delete_closes_connections(self):
+        communicator, _, _ = await connect('lobby', self.user)
+        room_id = self.room.pk
+        await database_sync_to_async(self.room.delete)()
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'room_closed', 'room_id': room_id})
+        self.assertEqual((await communicator.receive_output())['type'], 'websocket.close')
+        await communicator.wait()
+
+
+@override_settings(CHAT_WRITE_BEHIND=True, CHAT_WRITE_FLUSH_INTERVAL=0.3)
+class WriteBehindTests(ChatTestCase):
+    def message(self, content, user=None):
+        return Message(id=persistence.next_id(), room=self.room, user=user or self.user, content=content,
+                       timestamp=timezone.now())
+
+    async def receive_until(self, communicator, event_type, count=1):
+        """Frames up to the ``count``-th one of ``event_type``."""
+        frames = []
+        while sum(frame['type'] == event_type for frame in frames) < count:
+            frames.append(await communicator.receive_json_from(timeout=5))
+        return frames
+
+    async def test_batch_is_committed_before_message_saved(self):
+        communicator, _, _ = await connect('lobby', self.user)
+        for number in range(3):
+            await communicator.send_json_to({'type': 'chat_message', 'message': f'hi {number}', 'client_id': f'c{number}'})
+        frames = await self.receive_until(communicator, 'chat_message', 3)
+        self.assertEqual([frame['message'] for frame in frames], ['hi 0', 'hi 1', 'hi 2'])
+        saved = await self.receive_until(communicator, 'message_saved', 3)
+        self.assertEqual([frame['client_id'] for frame in saved], ['c0', 'c1', 'c2'])
+        self.assertEqual([frame['message_id'] for frame in saved], [frame['message_id'] for frame in frames])
+        self.assertEqual(await Message.objects.filter(room=self.room).acount(), 3)
+        self.assertEqual(persistence.get_writer().stats['batches'], 1)
+        await communicator.disconnect()
+
+    def test_other_writes_take_snowflake_ids(self):
+        floor = persistence.next_id()
+        created = Message.objects.create(room=self.room, user=self.user, content='from the shell')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/chat/messages/', {'room': self.room.pk, 'content': 'from the API'})
+        self.assertEqual(response.status_code, 201)
+        self.assertGreater(created.id, floor)
+        self.assertGreater(response.data['id'], created.id)
+
+    async def test_rejected_row_fails_alone(self):
+        other = await get_user_model().objects.acreate(username='leaver')
+        author, _, _ = await connect('lobby', other)
+        reader, _, _ = await connect('lobby', self.user)
+        await author.send_json_to({'type': 'chat_message', 'message': 'gone soon', 'client_id': 'a'})
+        await reader.send_json_to({'type': 'chat_message', 'message': 'staying', 'client_id': 'b'})
+        await self.receive_until(reader, 'chat_message', 2)
+        # The author's account goes before the batch is written, so its row breaks the foreign key.
+        await get_user_model().objects.filter(pk=other.pk).adelete()
+        failed = (await self.receive_until(author, 'message_failed'))[-1]
+        saved = (await self.receive_until(reader, 'message_saved'))[-1]
+        self.assertEqual((failed['client_id'], saved['client_id']), ('a', 'b'))
+        contents = [message.content async for message in Message.objects.filter(room=self.room)]
+        self.assertEqual(contents, ['staying'])
+        self.assertEqual(persistence.get_writer().stats['failed'], 1)
+        await author.disconnect()
+        await reader.disconnect()
+
+    async def test_database_errors_are_retried(self):
+        insert, attempts = persistence.insert, []
+
+        def flaky_insert(messages):
+            attempts.append(len(messages))
+            if len(attempts) == 1:
+                raise OperationalError('database is locked')
+            return insert(messages)
+
+        persistence.insert, persistence.RETRY_DELAY = flaky_insert, 0.01
+        self.addCleanup(setattr, persistence, 'insert', insert)
+        self.addCleanup(setattr, persistence, 'RETRY_DELAY', 0.5)
+        writer = persistence.get_writer()
+        with self.assertLogs('chat.persistence', 'ERROR'):
+            saved = await writer.submit(self.message('retried'))
+            self.assertEqual((await saved).content, 'retried')
+        self.assertEqual(attempts, [1, 1])
+        self.assertEqual(writer.stats['retries'], 1)
+        self.assertTrue(await Message.objects.filter(content='retried').aexists())
+
+    @override_settings(CHAT_WRITE_FLUSH_INTERVAL=1)
+    async def test_disconnect_waits_for_pending_writes(self):
+        communicator, _, _ = await connect('lobby', self.user)
+        await communicator.send_json_to({'type': 'chat_message', 'message': 'last words'})
+        await communicator.receive_json_from()
+        self.assertFalse(await Message.objects.filter(content='last words').aexists())
+        await communicator.disconnect()
+        self.assertTrue(await Message.objects.filter(content='last words').aexists())
+
+    async def test_write_remaining_skips_committed_rows(self):
+        writer = persistence.get_writer()
+        committed = self.message('committed')
+        await (await writer.submit(committed))
+        writer.task.cancel()
+        # As if the process exited between the commit and clearing in_flight.
+        writer.in_flight = [(committed, None)]
+        writer.queue.put_nowait((self.message('queued'), None))
+        self.assertEqual(await database_sync_to_async(writer.write_remaining)(), 2)
+        contents = [message.content async for message in Message.objects.order_by('id')]
+        self.assertEqual(contents, ['committed', 'queued'])
+        self.assertNotIn(writer, persistence._busy_writers)
+
+
+async def until(condition, timeout=5):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError('timed out')
+        await asyncio.sleep(0.01)
+
+
+class BrokerTests(SimpleTestCase):
+    """Two ``UnixSocketChannelLayer`` "processes" talking through a broker on a temporary socket."""
+
+    @asynccontextmanager
+    async def layers(self, **config):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'layer.sock')
+            broker = Broker()
+            server = await asyncio.start_unix_server(broker.handle, path)
+            first, second = UnixSocketChannelLayer(path, **config), UnixSocketChannelLayer(path, **config)
+            try:
+                yield broker, first, second
+            finally:
+                await first.close()
+                await second.close()
+                # Let the broker see both go before the loop ends.
+                await until(lambda: not broker.processes)
+                server.close()
+                await server.wait_closed()
+
+    async def receive(self, layer, channel):
+        return await asyncio.wait_for(layer.receive(channel), 5)
+
+    async def test_group_membership(self):
+        async with self.layers() as (broker, a, b):
+            ca, cb = await a.new_channel(), await b.new_channel()
+            await a.group_add('room', ca)
+            await b.group_add('room', cb)
+            await a.group_send('room', {'type': 'hello', 'n': 1})
+            self.assertEqual(await self.receive(a, ca), {'type': 'hello', 'n': 1})
+            self.assertEqual(await self.receive(b, cb), {'type': 'hello', 'n': 1})
+
+            await b.group_discard('room', cb)
+            self.assertEqual(broker.groups, {'room': {ca}})
+            await a.group_send('room', {'type': 'hello', 'n': 2})
+            await a.send(cb, {'type': 'marker'})
+            # The broker handles a's frames in order, so b would have had n=2 first.
+            self.assertEqual(await self.receive(b, cb), {'type': 'marker'})
+            self.assertEqual(await self.receive(a, ca), {'type': 'hello', 'n': 2})
+
+            await a.flush()
+            self.assertEqual(broker.groups, {})
+
+    async def test_messages_go_to_the_owning_process(self):
+        async with self.layers() as (broker, a, b):
+            cb = await b.new_channel()
+            self.assertEqual(owner_of(cb), b.id)
+            await b.connect()
+            await until(lambda: b.id in broker.processes)
+            await a.send(cb, {'type': 'direct'})
+            self.assertEqual(await self.receive(b, cb), {'type': 'direct'})
+            self.assertNotIn(cb, a.queues)
+
+            # A general channel goes to a process receiving on it.
+            self.assertIsNone(owner_of('jobs'))
+            job = asyncio.ensure_future(self.receive(b, 'jobs'))
+            await until(lambda: 'jobs' in broker.listeners)
+            await a.send('jobs', {'type': 'job'})
+            self.assertEqual(await job, {'type': 'job'})
+
+    async def test_disconnected_process_is_forgotten(self):
+        async with self.layers() as (broker, a, b):
+            ca, cb = await a.new_channel(), await b.new_channel()
+            await a.group_add('room', ca)
+            await b.group_add('room', cb)
+            await b.close()
+            await until(lambda: b.id not in broker.processes)
+            self.assertEqual(broker.groups, {'room': {ca}})
+            await a.send(cb, {'type': 'lost'})
+            await until(lambda: broker.stats['dropped'] == 1)
+
+    async def test_rejoins_groups_after_losing_the_broker(self):
+        async with self.layers() as (broker, a, b):
+            ca, cb = await a.new_channel(), await b.new_channel()
+            await a.group_add('room', ca)
+            await b.group_add('room', cb)
+            waiting = asyncio.ensure_future(self.receive(a, ca))
+            with self.assertLogs('chat.layers', 'INFO') as logs:
+                # What a broker restart looks like to a: the connection drops and its groups are gone.
+                broker.processes[a.id].transport.abort()
+                await until(lambda: broker.stats['processes'] == 3 and broker.groups == {'room': {ca, cb}})
+            self.assertIn('rejoined 1 group memberships', logs.output[-1])
+            await b.group_send('room', {'type': 'hello'})
+            self.assertEqual(await waiting, {'type': 'hello'})
+
+    async def test_full_channel_drops_messages(self):
+        async with self.layers(capacity=1) as (broker, a, b):
+            cb, marker = await b.new_channel(), await b.new_channel()
+            await b.connect()
+            await until(lambda: b.id in broker.processes)
+            for n in range(3):
+                await a.send(cb, {'type': 'flood', 'n': n})
+            await a.send(marker, {'type': 'marker'})
+            await until(lambda: marker in b.queues)
+            self.assertEqual(await self.receive(b, cb), {'type': 'flood', 'n': 0})
+            await a.send(cb, {'type': 'flood', 'n': 3})
+            self.assertEqual(await self.receive(b, cb), {'type': 'flood', 'n': 3})
+
+    async def test_serve_removes_its_socket(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'layer.sock')
+            server = asyncio.ensure_future(serve(path))
+            await until(lambda: os.path.exists(path))
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write(encode('hello', 'p1') + encode('add', 'room', 'specific.p1!a', 7))
+            self.assertEqual(await read_frame(reader), ['ok', 7])
+            writer.write_eof()
+            self.assertEqual(await reader.read(), b'')  # the broker closed its end
+            writer.close()
+            server.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await server
+            self.assertFalse(os.path.exists(path))
+
+
+@override_settings(CHAT_HISTORY_SIZE=20, CHAT_HISTORY_REPLAY=10)
+class HistoryTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        start = timezone.now() - timedelta(hours=1)
+        self.messages = Message.objects.bulk_create([
+            Message(room=self.room, user=self.user, content=f'message {n}', timestamp=start + timedelta(seconds=n))
+            for n in range(60)
+        ])
+        self.ids = [message.id for message in self.messages]
+
+    def replayed(self, replay):
+        return [event['message_id'] for event in replay['messages']]
+
+    async def test_fresh_connection_gets_the_latest_messages(self):
+        communicator, _, replay = await connect('lobby', self.user)
+        self.assertEqual(replay['type'], 'history')
+        self.assertEqual(self.replayed(replay), self.ids[50:])
+        self.assertTrue(replay['reset'])
+        self.assertEqual(replay['messages'][0]['message'], 'message 50')
+        await communicator.disconnect()
+
+        # ``older`` continues from there through the messages API, newest first.
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = await database_sync_to_async(client.get)(
+            '/api/chat/messages/', {'room': self.room.pk, 'cursor': replay['older'], 'page_size': 5})
+        self.assertEqual([row['id'] for row in response.data['results']], self.ids[45:50][::-1])
+
+    async def test_reconnect_replays_from_the_buffer(self):
+        first, _, _ = await connect('lobby', self.user)
+        # Gone from the database, so these can only come from the buffer.
+        await Message.objects.filter(id__gt=self.ids[55]).adelete()
+        second, _, replay = await connect('lobby', self.user, f'last_message_id={self.ids[55]}')
+        self.assertEqual((self.replayed(replay), replay['reset'], replay['older']), (self.ids[56:], False, None))
+        _, _, replay = await connect('lobby', self.user, f'since={self.ids[-1]}')
+        self.assertEqual((replay['messages'], replay['reset']), ([], False))
+        await first.disconnect()
+        await second.disconnect()
+
+    @override_settings(CHAT_HISTORY_SIZE=10)
+    async def test_reconnect_after_an_evicted_id_reads_the_database(self):
+        _, _, replay = await connect('lobby', self.user, f'last_message_id={self.ids[49]}')
+        self.assertEqual((self.replayed(replay), replay['reset']), (self.ids[50:], False))
+
+    async def test_reconnect_after_too_many_messages_resets(self):
+        for query in (f'last_message_id={self.ids[5]}', 'last_message_id=999999999', 'last_message_id=x'):
+            with self.subTest(query=query):
+                communicator, _, replay = await connect('lobby', self.user, query)
+                self.assertEqual((self.replayed(replay), replay['reset']), (self.ids[50:], True))
+                self.assertIsNotNone(replay['older'])
+                await communicator.disconnect()
+
+    def test_ring_buffer_keeps_the_newest_in_order(self):
+        buffer = history.RoomHistory(self.room.pk)
+        events = [history.message_event(message) for message in self.messages]
+        for event in events[:30] + events[35:] + events[30:35]:  # a few stragglers
+            buffer.add(event)
+        buffer.add(events[-1])
+        self.assertEqual([event['message_id'] for event in buffer.events], self.ids[40:])
+        self.assertTrue(buffer.has_older)
+        self.assertEqual([event['message_id'] for event in buffer.after(self.ids[57])], self.ids[58:])
+        self.assertIsNone(buffer.after(self.ids[10]))
+
+    async def test_database_rows_merge_with_unwritten_events(self):
+        buffer = await history.join(self.room)
+        later = self.messages[-1].timestamp
+        # Written but never broadcast here (e.g. posted through the API), so not buffered.
+        unbuffered = await Message.objects.acreate(room=self.room, user=self.user, content='api',
+                                                  timestamp=later + timedelta(seconds=1))
+        # Broadcast but not written yet (write-behind), so only buffered.
+        unwritten = Message(id=persistence.next_id(), room=self.room, user=self.user, content='pending',
+                            timestamp=later + timedelta(seconds=2))
+        both = await Message.objects.acreate(room=self.room, user=self.user, content='both',
+                                            timestamp=later + timedelta(seconds=3))
+        for message in (unwritten, both):
+            buffer.add(history.message_event(message))
+        replay = await history.replay(self.room, buffer, unbuffered.id)
+        self.assertEqual((self.replayed(replay), replay['reset']), ([unwritten.id, both.id], False))
+        history.leave(buffer)
+
+    async def test_concurrent_joins_share_one_seed(self):
+        first, second = await asyncio.gather(history.join(self.room), history.join(self.room))
+        self.assertIs(first, second)
+        self.assertEqual((first.connections, len(first.events)), (2, 20))
+        history.leave(first)
+        self.assertIs(await history.join(self.room), first)
+        history.leave(first)
+        history.leave(first)
+        self.assertNotIn(self.room.pk, history._buffers)
+
+    async def test_failed_seed_releases_every_waiter(self):
+        unsaved = ChatRoom(name='unsaved')  # filtering on it raises
+        results = await asyncio.gather(history.join(unsaved), history.join(unsaved), return_exceptions=True)
+        self.assertEqual([type(result) for result in results], [ValueError, ValueError])
+        self.assertEqual(history._buffers, {})
+
+    async def test_cancelled_seed_releases_every_waiter(self):
+        seeding = asyncio.ensure_future(history.join(self.room))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(history.join(self.room))
+        await asyncio.sleep(0)
+        seeding.cancel()
+        results = await asyncio.gather(seeding, waiting, return_exceptions=True)
+        self.assertEqual([type(result) for result in results], [asyncio.CancelledError] * 2)
+        self.assertEqual(history._buffers, {})
+        # The next connection starts afresh.
+        buffer = await history.join(self.room)
+        self.assertEqual((buffer.connections, len(buffer.events)), (1, 20))
+        history.leave(buffer)
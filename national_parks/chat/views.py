@@ -5,6 +5,7 @@ from django.db.models import Q
 from django.views.generic import TemplateView
 from .models import ChatRoom, Message
 from .serializers import ChatRoomSerializer, MessageSerializer
+from .pagination import MessagePagination
 
 
 class ChatRoomViewSet(viewsets.ModelViewSet):
@@ -41,10 +42,11 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
 class MessageViewSet(viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessagePagination
 
     def get_queryset(self):
         room_id = self.request.query_params.get('room', None)
-        queryset = Message.objects.all()
+        queryset = Message.objects.select_related('user')
         if room_id:
             queryset = queryset.filter(room_id=room_id)
         return queryset.order_by('timestamp')
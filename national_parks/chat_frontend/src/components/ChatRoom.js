@@ -8,11 +8,19 @@ function ChatRoom({ room, onBack, apiBaseUrl }) {
   const [ws, setWs] = useState(null);
   const [connected, setConnected] = useState(false);
   const [loading, setLoading] = useState(true);
+  const [olderUrl, setOlderUrl] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const messagesEndRef = useRef(null);
   const wsRef = useRef(null);
+  const skipScrollRef = useRef(false);
+  // The newest message shown; a reconnect asks the server for what came after it.
+  const lastIdRef = useRef(null);
 
   useEffect(() => {
-    fetchMessages();
+    lastIdRef.current = null;
+    setMessages([]);
+    setOlderUrl(null);
+    setLoading(true);
     connectWebSocket();
 
     return () => {
@@ -23,6 +31,13 @@ function ChatRoom({ room, onBack, apiBaseUrl }) {
   }, [room.id]);
 
   useEffect(() => {
+    if (messages.length) {
+      lastIdRef.current = messages[messages.length - 1].id;
+    }
+    if (skipScrollRef.current) {
+      skipScrollRef.current = false;
+      return;
+    }
     scrollToBottom();
   }, [messages]);
 
@@ -30,15 +45,37 @@ function ChatRoom({ room, onBack, apiBaseUrl }) {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
 
-  const fetchMessages = async () => {
+  const toMessage = (data) => ({
+    id: data.message_id,
+    content: data.message,
+    user: {
+      id: data.user_id,
+      username: data.username,
+    },
+    timestamp: data.timestamp,
+  });
+
+  // A replay and a live broadcast can carry the same message; keep the first.
+  const appendNew = (prev, incoming) => {
+    const seen = new Set(prev.map((message) => message.id));
+    const fresh = incoming.filter((message) => !seen.has(message.id));
+    return fresh.length ? [...prev, ...fresh] : prev;
+  };
+
+  // The API pages newest-first; `next` points at the page of older messages.
+  const loadOlder = async () => {
+    if (!olderUrl || loadingOlder) return;
     try {
-      setLoading(true);
-      const response = await axios.get(`${apiBaseUrl}/messages/?room=${room.id}`);
-      setMessages(response.data);
+      setLoadingOlder(true);
+      const response = await axios.get(olderUrl);
+      const older = response.data.results.slice().reverse();
+      skipScrollRef.current = true;
+      setMessages((prev) => [...older, ...prev]);
+      setOlderUrl(response.data.next);
     } catch (err) {
-      console.error('Error fetching messages:', err);
+      console.error('Error loading older messages:', err);
     } finally {
-      setLoading(false);
+      setLoadingOlder(false);
     }
   };
 
@@ -48,7 +85,10 @@ function ChatRoom({ room, onBack, apiBaseUrl }) {
   // חובה! לקודד את שם החדר
   const encodedRoom = encodeURIComponent(room.name);
 
-  const wsUrl = `${protocol}//${window.location.host}/ws/chat/${encodedRoom}/`;
+  // History arrives over the socket: the latest messages, or after a reconnect
+  // only the ones after the last we have.
+  const since = lastIdRef.current ? `?last_message_id=${lastIdRef.current}` : '';
+  const wsUrl = `${protocol}//${window.location.host}/ws/chat/${encodedRoom}/${since}`;
   console.log(wsUrl)
   const websocket = new WebSocket(wsUrl);
   wsRef.current = websocket;
@@ -62,16 +102,16 @@ function ChatRoom({ room, onBack, apiBaseUrl }) {
     const data = JSON.parse(event.data);
 
     if (data.type === 'chat_message') {
-      const message = {
-        id: data.message_id,
-        content: data.message,
-        user: {
-          id: data.user_id,
-          username: data.username,
-        },
-        timestamp: data.timestamp,
-      };
-      setMessages((prev) => [...prev, message]);
+      setMessages((prev) => appendNew(prev, [toMessage(data)]));
+    } else if (data.type === 'history') {
+      const replayed = data.messages.map(toMessage);
+      if (data.reset) {
+        setMessages(replayed);
+        setOlderUrl(data.older ? `${apiBaseUrl}/messages/?room=${room.id}&cursor=${data.older}` : null);
+      } else {
+        setMessages((prev) => appendNew(prev, replayed));
+      }
+      setLoading(false);
     } else if (data.type === 'room_info') {
       console.log('Room info:', data);
     }
@@ -149,6 +189,11 @@ function ChatRoom({ room, onBack, apiBaseUrl }) {
           </div>
         ) : (
           <div className="messages-list">
+            {olderUrl && (
+              <button onClick={loadOlder} disabled={loadingOlder} className="load-older-btn">
+                {loadingOlder ? 'Loading...' : 'Load older messages'}
+              </button>
+            )}
             {messages.map((message) => (
               <div key={message.id} className="message">
                 <div className="message-header">
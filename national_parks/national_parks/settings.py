@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 from django.conf.global_settings import DATABASES
@@ -172,22 +173,84 @@ STORAGES = {
     },
 }
 
-# Channels Configuration
-CHANNEL_LAYERS = {
+CACHES = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered anonymous responses (see parks.response_cache). Point this at a
+    # shared backend (e.g. Redis) when running more than one server process.
+    'responses': {
+        'BACKEND': os.getenv('RESPONSE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('RESPONSE_CACHE_LOCATION', 'responses'),
+    },
+    # Bodies and validators of outbound GETs (see parks.http_client); kept on
+    # disk so re-imports can revalidate instead of downloading again.
+    'outbound': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('HTTP_CACHE_DIR', str(BASE_DIR / '.http_cache')),
+        'OPTIONS': {'MAX_ENTRIES': 50000},
     },
 }
-
-# For production, use Redis:
-# CHANNEL_LAYERS = {
-#     'default': {
-#         'BACKEND': 'channels_redis.core.RedisChannelLayer',
-#         'CONFIG': {
-#             "hosts": [('127.0.0.1', 6379)],
-#         },
-#     },
-# }
+HTTP_CLIENT_CACHE_ALIAS = 'outbound'
+RESPONSE_CACHE_ALIAS = 'responses'
+
+# OpenAI-compatible chat completions API behind the trip planner (see
+# parks.trip_planner); the key defaults to GROQ_API_KEY.
+TRIP_PLANNER_API_URL = os.getenv('TRIP_PLANNER_API_URL', 'https://api.groq.com/openai/v1/chat/completions')
+TRIP_PLANNER_MODEL = os.getenv('TRIP_PLANNER_MODEL', 'llama-3.1-8b-instant')
+# Set TRIP_PLANNER_TOPICS = {topic: [keywords]} to replace parks.topics.DEFAULT_TOPICS.
+# Generated plans (see parks.plan_cache): seconds fresh, then seconds served
+# stale while regenerating, and entries kept per process.
+TRIP_PLAN_CACHE_TTL = 6 * 60 * 60
+TRIP_PLAN_CACHE_STALE = 24 * 60 * 60
+TRIP_PLAN_CACHE_SIZE = 1000
+
+# Seconds a chat room lookup is cached per process (see chat.rooms).
+CHAT_ROOM_CACHE_TTL = 60
+# Messages buffered per room for replay on connect, and the most replayed at
+# once (see chat.history).
+CHAT_HISTORY_SIZE = 200
+CHAT_HISTORY_REPLAY = 50
+# Write chat messages behind (see chat.persistence): broadcast at once, then
+# insert in batches of up to CHAT_WRITE_BATCH_SIZE at most CHAT_WRITE_FLUSH_INTERVAL
+# seconds apart; senders wait while CHAT_WRITE_QUEUE_SIZE messages are queued.
+# Give each server process its own CHAT_WORKER_ID (0-31) for message ids.
+CHAT_WRITE_BEHIND = os.getenv('CHAT_WRITE_BEHIND', '') == '1'
+CHAT_WRITE_BATCH_SIZE = 200
+CHAT_WRITE_FLUSH_INTERVAL = 0.05
+CHAT_WRITE_QUEUE_SIZE = 10000
+if os.getenv('CHAT_WORKER_ID'):
+    CHAT_WORKER_ID = int(os.getenv('CHAT_WORKER_ID'))
+
+# Channels Configuration: Redis when REDIS_URL is set (any number of workers and
+# hosts), the chat.layers broker when CHAT_LAYER_SOCKET is set (several workers on
+# one host; run `manage.py chat_broker`), otherwise in memory (a single process).
+if os.getenv('REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [os.getenv('REDIS_URL')],
+                'capacity': 1000,
+            },
+        },
+    }
+elif os.getenv('CHAT_LAYER_SOCKET'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'chat.layers.UnixSocketChannelLayer',
+            'CONFIG': {
+                'path': os.getenv('CHAT_LAYER_SOCKET'),
+                'capacity': 1000,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
 
 # CORS Configuration
 CORS_ALLOWED_ORIGINS = [
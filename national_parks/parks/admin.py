@@ -1,5 +1,38 @@
 from django.contrib import admin
-from .models import Park, Rating, ParkIdentifier
+from .models import CountryFlag, Park, Rating, ParkIdentifier, ParkRatingSummary
+from . import ratings as rating_store
+
 admin.site.register(Park)
 admin.site.register(ParkIdentifier)
-admin.site.register(Rating)
+
+
+@admin.register(Rating)
+class RatingAdmin(admin.ModelAdmin):
+    list_display = ['park', 'user', 'score', 'created_at']
+
+    def save_model(self, request, obj, form, change):
+        park_ids = {obj.park_id}
+        if change:
+            park_ids.add(Rating.objects.get(pk=obj.pk).park_id)
+        super().save_model(request, obj, form, change)
+        rating_store.rebuild_summaries(park_ids)
+
+    def delete_model(self, request, obj):
+        rating_store.delete_rating(obj)
+
+    def delete_queryset(self, request, queryset):
+        park_ids = set(queryset.values_list('park_id', flat=True))
+        super().delete_queryset(request, queryset)
+        rating_store.rebuild_summaries(park_ids)
+
+
+@admin.register(ParkRatingSummary)
+class ParkRatingSummaryAdmin(admin.ModelAdmin):
+    list_display = ['park', 'count', 'average']
+    readonly_fields = ['count', 'total', 'average', 'score_1', 'score_2', 'score_3', 'score_4', 'score_5']
+
+
+@admin.register(CountryFlag)
+class CountryFlagAdmin(admin.ModelAdmin):
+    list_display = ['code', 'image', 'sha256']
+    readonly_fields = ['sha256']
@@ -1,8 +1,18 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import Park, Rating
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.utils.decorators import method_decorator
+from .models import HAS_IMAGE, HAS_WEBSITE, Park, Rating, iexact
 from .serializers import ParkSerializer, RatingSerializer
+from . import bulk as bulk_import
+from . import facets as park_facets
+from . import ratings as rating_store
+from . import search as park_search
+from .pagination import ParkPagination, RatingPagination
+from .response_cache import cached_response
+from .stats import park_stats
 
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
@@ -21,13 +31,67 @@ class AdminOrReadOnly(permissions.BasePermission):
         return bool(request.user and request.user.is_authenticated and request.user.is_superuser)
 
 
+def run_bulk_import(request, importer):
+    """Feed an NDJSON or CSV request body to ``importer`` a line at a time."""
+    fmt = bulk_import.format_for(request.content_type)
+    if fmt is None:
+        return Response({'detail': 'send application/x-ndjson or text/csv'},
+                        status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    result = importer(bulk_import.read_rows(request.stream or (), fmt))
+    return Response(result.as_dict())
+
+
+# Every query parameter ParkViewSet, its pagination and its actions read.
+PARK_CACHE_PARAMS = ('country', 'region', 'name', 'location', 'has_image', 'has_website', 'fields',
+                     'cursor', 'page_size', 'q', 'limit', 'facet_limit', 'format')
+
+
+@method_decorator(cached_response(params=PARK_CACHE_PARAMS, vary=('Accept',)), name='dispatch')
 class ParkViewSet(viewsets.ModelViewSet):
     queryset = Park.objects.all().order_by('name')
     serializer_class = ParkSerializer
     permission_classes = [AdminOrReadOnly]
+    pagination_class = ParkPagination
+    # Left out of list responses unless asked for via ?fields=
+    heavy_fields = ('description',)
+    filter_params = ('country', 'region', 'name', 'location', 'has_image', 'has_website')
+
+    def get_sparse_fields(self):
+        """Serializer fields to render for this request, or None for all of them."""
+        if self.action not in ('list', 'retrieve', 'search'):
+            return None
+        all_fields = ParkSerializer.Meta.fields
+        requested = self.request.query_params.get('fields')
+        if requested:
+            names = {name.strip() for name in requested.split(',')}
+            return [name for name in all_fields if name in names or name == 'id']
+        if self.action in ('list', 'search'):
+            return [name for name in all_fields if name not in self.heavy_fields]
+        return None
+
+    def get_serializer(self, *args, **kwargs):
+        if self.get_serializer_class() is ParkSerializer:
+            kwargs.setdefault('fields', self.get_sparse_fields())
+        return super().get_serializer(*args, **kwargs)
 
     def get_queryset(self):
         qs = super().get_queryset()
+        fields = self.get_sparse_fields()
+        if fields is None or 'average_rating' in fields or 'ratings_count' in fields:
+            qs = qs.annotate(
+                avg_rating=F('rating_summary__average'),
+                num_ratings=Coalesce(F('rating_summary__count'), Value(0)),
+            )
+        if fields is not None:
+            model_fields = {f.name for f in Park._meta.concrete_fields}
+            columns = {name for name in fields if name in model_fields}
+            if 'image_variants' in columns:
+                columns.add('image')  # variant URLs are checked against the current image
+            qs = qs.only('id', *columns)
+        return self.filter_parks(qs)
+
+    def filter_parks(self, qs):
+        """Apply the country/region/name/location/has_image/has_website query parameters."""
         country = self.request.query_params.get('country')
         region = self.request.query_params.get('region')
         name = self.request.query_params.get('name')
@@ -36,17 +100,17 @@ class ParkViewSet(viewsets.ModelViewSet):
         has_website = self.request.query_params.get('has_website')
         
         if country:
-            qs = qs.filter(country__iexact=country)
+            qs = qs.filter(iexact('country', country))
         if region:
-            qs = qs.filter(region__iexact=region)
+            qs = qs.filter(iexact('region', region))
         if name:
             qs = qs.filter(name__icontains=name)
         if location:
             qs = qs.filter(location__icontains=location)
         if has_image:
-            qs = qs.exclude(image='').exclude(image__isnull=True)
+            qs = qs.filter(HAS_IMAGE)
         if has_website:
-            qs = qs.exclude(official_website='').exclude(official_website__isnull=True)
+            qs = qs.filter(HAS_WEBSITE)
         return qs
 
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
@@ -60,47 +124,76 @@ class ParkViewSet(viewsets.ModelViewSet):
             return Response({'detail': 'score must be an integer between 1 and 5'}, status=status.HTTP_400_BAD_REQUEST)
         if score_int < 1 or score_int > 5:
             return Response({'detail': 'score must be between 1 and 5'}, status=status.HTTP_400_BAD_REQUEST)
-        rating, created = Rating.objects.update_or_create(
-            user=request.user,
-            park=park,
-            defaults={'score': score_int, 'comment': comment}
-        )
+        rating, created = rating_store.save_rating(request.user, park, score_int, comment)
         serializer = RatingSerializer(rating)
         return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
     @action(detail=True, methods=['get'], permission_classes=[permissions.AllowAny])
     def ratings(self, request, pk=None):
         park = self.get_object()
-        qs = park.ratings.all().order_by('-created_at')
-        page = self.paginate_queryset(qs)
-        if page is not None:
-            serializer = RatingSerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = RatingSerializer(qs, many=True)
+        qs = park.ratings.select_related('user')
+        paginator = RatingPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+        serializer = RatingSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
+    def search(self, request):
+        """Ranked full-text search over name, description, country and region (?q=)"""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'detail': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', 50))
+        except ValueError:
+            return Response({'detail': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, park_search.DEFAULT_LIMIT))
+        qs = park_search.filter_queryset(self.get_queryset(), query, limit=limit)
+        serializer = self.get_serializer(qs, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
+    def facets(self, request):
+        """Counts per country, region, has_image, has_website and rating bucket for the current filters.
+
+        Without filters the counts come from the materialized ``FacetCount`` table.
+        """
+        try:
+            limit = max(1, min(int(request.query_params.get('facet_limit', park_facets.DEFAULT_LIMIT)), 500))
+        except ValueError:
+            limit = park_facets.DEFAULT_LIMIT
+        if any(request.query_params.get(name) for name in self.filter_params):
+            return Response(park_facets.compute(self.filter_parks(Park.objects.all()), limit))
+        return Response(park_facets.materialized(limit))
+
     @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
     def stats(self, request):
-        """Get park statistics"""
-        total_parks = Park.objects.count()
-        parks_with_images = Park.objects.exclude(image='').exclude(image__isnull=True).count()
-        parks_with_websites = Park.objects.exclude(official_website='').exclude(official_website__isnull=True).count()
-        total_ratings = Rating.objects.count()
-        
-        return Response({
-            'total_parks': total_parks,
-            'parks_with_images': parks_with_images,
-            'parks_with_websites': parks_with_websites,
-            'total_ratings': total_ratings,
-            'image_percentage': round((parks_with_images / total_parks * 100) if total_parks > 0 else 0, 1),
-            'website_percentage': round((parks_with_websites / total_parks * 100) if total_parks > 0 else 0, 1),
-        })
+        """Park statistics; see ``parks.stats``."""
+        return Response(park_stats())
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Create or update parks from an NDJSON or CSV body; see ``parks.bulk``."""
+        return run_bulk_import(request, bulk_import.import_parks)
 
 
 class RatingViewSet(viewsets.ModelViewSet):
-    queryset = Rating.objects.all().order_by('-created_at')
+    queryset = Rating.objects.select_related('user').order_by('-created_at')
     serializer_class = RatingSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
+    pagination_class = RatingPagination
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user) 
\ No newline at end of file
+        rating_store.create_rating(serializer, user=self.request.user)
+
+    def perform_update(self, serializer):
+        rating_store.update_rating(serializer)
+
+    def perform_destroy(self, instance):
+        rating_store.delete_rating(instance)
+
+    @action(detail=False, methods=['post'], permission_classes=[AdminOrReadOnly])
+    def bulk(self, request):
+        """Upsert ratings for any users from an NDJSON or CSV body; see ``parks.bulk``."""
+        return run_bulk_import(request, bulk_import.import_ratings)
+ 
\ No newline at end of file
@@ -0,0 +1,321 @@
+"""Bulk rating and park ingestion from NDJSON or CSV streams.
+
+Used by the ``/api/ratings/bulk/`` and ``/api/parks/bulk/`` endpoints and the
+``bulk_import`` command. Input is read a line at a time and handled in batches:
+
+1. validate - each column of the batch is checked at once with numpy (scores,
+              ids, lengths; free text stays in plain lists), and its parks
+              and users are looked up with one query each
+2. upsert   - valid rows are written in one transaction per batch: ratings with
+              ``INSERT ... ON CONFLICT (park, user) DO UPDATE`` followed by a
+              rebuild of the touched parks' rating summaries, parks with
+              ``bulk_create``/``bulk_update`` keyed on ``(source, source_id)``
+
+Invalid rows are reported with their line number and skipped; they never fail
+the rest of their batch.
+"""
+import csv
+import json
+from dataclasses import dataclass, field
+from itertools import islice
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import transaction
+
+from .caching import invalidate_countries
+from .models import Park, ParkIdentifier, Rating
+from . import facets
+from . import ratings as rating_store
+from . import response_cache
+from . import search
+
+BATCH_SIZE = 5000
+# Errors kept for the report; the rest are only counted.
+MAX_ERRORS = 1000
+CONTENT_TYPES = {
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+    'application/csv': 'csv',
+}
+PARK_FIELDS = ('name', 'description', 'location', 'country', 'region', 'official_website')
+# Longest id accepted before the int64 conversion could overflow.
+MAX_ID_DIGITS = 18
+
+
+@dataclass
+class BulkResult:
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    written: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)
+
+    def error(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def as_dict(self):
+        return {'rows': self.rows, 'written': self.written, 'created': self.created,
+                'updated': self.updated, 'failed': self.failed, 'errors': self.errors}
+
+    def summary(self):
+        return (f"Read {self.rows} rows, wrote {self.written}"
+                + (f" (created {self.created}, updated {self.updated})" if self.created or self.updated else "")
+                + f", rejected {self.failed}.")
+
+
+def format_for(content_type):
+    """``'ndjson'`` or ``'csv'`` for a request Content-Type, None if unsupported."""
+    return CONTENT_TYPES.get((content_type or '').split(';')[0].strip().lower())
+
+
+def read_rows(lines, fmt='ndjson'):
+    """Yield ``(line_number, row)`` for the records in ``lines`` (an iterable of bytes).
+
+    ``row`` is a dict, or an error message when the line can't be decoded or parsed.
+    CSV records are numbered by the line they end on.
+    """
+    position = {'line': 0, 'bad': []}
+
+    def text():
+        for number, raw in enumerate(lines, 1):
+            position['line'] = number
+            try:
+                yield raw.decode('utf-8-sig' if number == 1 else 'utf-8')
+            except UnicodeDecodeError:
+                position['bad'].append(number)
+
+    def undecodable():
+        while position['bad']:
+            yield position['bad'].pop(0), 'line is not valid UTF-8'
+
+    if fmt == 'csv':
+        for row in csv.DictReader(text()):
+            yield from undecodable()
+            row.pop(None, None)  # cells beyond the header
+            yield position['line'], row
+    else:
+        for line in text():
+            yield from undecodable()
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield position['line'], f'invalid JSON: {exc}'
+                continue
+            yield position['line'], row if isinstance(row, dict) else 'expected a JSON object'
+    yield from undecodable()
+
+
+def _batches(rows, size, result):
+    """Group ``read_rows`` output into lists of ``(line, dict)``, reporting unparsable lines."""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        result.rows += len(chunk)
+        batch = []
+        for line, row in chunk:
+            if isinstance(row, dict):
+                batch.append((line, row))
+            else:
+                result.error(line, {'non_field_errors': row})
+        if batch:
+            yield batch
+
+
+def _text(batch, key):
+    """Column ``key`` of the batch as a list of stripped strings."""
+    return ['' if row.get(key) is None else str(row.get(key)).strip() for _, row in batch]
+
+
+def _column(batch, key, width):
+    """Column ``key`` as a numpy string array, for the short key columns checked with numpy.
+
+    Values are cut to ``width`` characters: a fixed-width array is as wide as its
+    longest value, so one oversized value would make it huge. Pass one more than
+    the longest valid value, so that a cut value still fails its length check.
+    """
+    return np.array([value[:width] for value in _text(batch, key)], dtype=str)
+
+
+def _lengths(values):
+    return np.array([len(value) for value in values], dtype=np.int64)
+
+
+def _ints(column):
+    """``(values, ok)``: the column as int64, and which entries were non-negative integers."""
+    lengths = np.char.str_len(column)
+    # isdigit() also accepts non-ASCII digits, which int() would but astype() won't.
+    is_ascii = np.char.str_len(np.char.encode(column, 'utf-8')) == lengths
+    ok = np.char.isdigit(column) & is_ascii & (lengths <= MAX_ID_DIGITS)
+    values = np.zeros(len(column), dtype=np.int64)
+    values[ok] = column[ok].astype(np.int64)
+    return values, ok
+
+
+def _report(batch, checks, result):
+    """Record an error for every row failing one of ``checks`` (``{field: (ok, message)}``);
+    returns the mask of rows that passed them all."""
+    valid = np.ones(len(batch), dtype=bool)
+    for ok, _ in checks.values():
+        valid &= ok
+    for index in np.flatnonzero(~valid):
+        result.error(batch[index][0], {name: message for name, (ok, message) in checks.items() if not ok[index]})
+    return valid
+
+
+# -- ratings ----------------------------------------------------------------
+
+def _known(queryset, values):
+    values = np.unique(values)
+    if not len(values):
+        return np.array([], dtype=values.dtype)
+    return np.array(list(queryset(values.tolist())), dtype=values.dtype)
+
+
+def _rating_batch(batch, result):
+    User = get_user_model()
+    scores, score_ok = _ints(_column(batch, 'score', MAX_ID_DIGITS + 1))
+    score_ok &= (scores >= 1) & (scores <= 5)
+
+    park_ids, park_ok = _ints(_column(batch, 'park', MAX_ID_DIGITS + 1))
+    parks = _known(lambda ids: Park.objects.filter(pk__in=ids).values_list('pk', flat=True), park_ids[park_ok])
+    park_ok &= np.isin(park_ids, parks)
+
+    # A user is given by id ("user") or, for data from other systems, by "username".
+    user_ids, by_id = _ints(_column(batch, 'user', MAX_ID_DIGITS + 1))
+    usernames = _column(batch, 'username', User._meta.get_field(User.USERNAME_FIELD).max_length + 1)
+    by_name = ~by_id & (np.char.str_len(usernames) > 0)
+    users = _known(lambda ids: User.objects.filter(pk__in=ids).values_list('pk', flat=True), user_ids[by_id])
+    named = dict(User.objects.filter(username__in=np.unique(usernames[by_name]).tolist())
+                 .values_list('username', 'pk')) if by_name.any() else {}
+    user_ids = np.where(by_name, np.array([named.get(name, 0) for name in usernames], dtype=np.int64), user_ids)
+    user_ok = (by_id & np.isin(user_ids, users)) | (by_name & (user_ids > 0))
+
+    valid = _report(batch, {
+        'score': (score_ok, 'score must be an integer between 1 and 5'),
+        'park': (park_ok, 'unknown park id'),
+        'user': (user_ok, 'unknown user; give a user id ("user") or "username"'),
+    }, result)
+
+    # The upsert can't touch the same row twice, so the last rating per (park, user) wins.
+    comments = _text(batch, 'comment')
+    ratings = {}
+    for index in np.flatnonzero(valid):
+        key = (int(park_ids[index]), int(user_ids[index]))
+        ratings[key] = Rating(park_id=key[0], user_id=key[1], score=int(scores[index]), comment=comments[index])
+    result.written += rating_store.upsert_ratings(list(ratings.values()))
+
+
+def import_ratings(rows, batch_size=BATCH_SIZE):
+    """Upsert ratings from ``read_rows`` output.
+
+    Each row needs ``park`` (id), ``score`` (1-5) and ``user`` (id) or ``username``;
+    ``comment`` is optional. Rating summaries, facet counts and cached responses
+    are refreshed as each batch commits.
+    """
+    result = BulkResult()
+    for batch in _batches(rows, batch_size, result):
+        _rating_batch(batch, result)
+    return result
+
+
+# -- parks ------------------------------------------------------------------
+
+def _max_length(name):
+    return Park._meta.get_field(name).max_length
+
+
+def _park_batch(batch, result):
+    source_max = ParkIdentifier._meta.get_field('source_id').max_length
+    columns = {name: _text(batch, name) for name in PARK_FIELDS}
+    sources, source_ids = _column(batch, 'source', source_max + 1), _column(batch, 'source_id', source_max + 1)
+    lengths = {name: _lengths(column) for name, column in columns.items()}
+    checks = {'name': ((lengths['name'] > 0) & (lengths['name'] <= _max_length('name')),
+                       f'name is required and at most {_max_length("name")} characters')}
+    for name in ('location', 'country', 'region'):
+        checks[name] = (lengths[name] <= _max_length(name), f'at most {_max_length(name)} characters')
+
+    # URLValidator is a regex per value, so only the non-empty ones are checked.
+    website_ok = np.ones(len(batch), dtype=bool)
+    validate_url = URLValidator(schemes=['http', 'https'])
+    for index in np.flatnonzero(lengths['official_website'] > 0):
+        try:
+            validate_url(columns['official_website'][index])
+        except ValidationError:
+            website_ok[index] = False
+    checks['official_website'] = (website_ok, 'enter a valid http(s) URL')
+
+    keyed = (np.char.str_len(sources) > 0) & (np.char.str_len(source_ids) > 0)
+    checks['source_id'] = (
+        (keyed | ((np.char.str_len(sources) == 0) & (np.char.str_len(source_ids) == 0)))
+        & (np.char.str_len(sources) <= source_max) & (np.char.str_len(source_ids) <= source_max),
+        f'give both source and source_id (at most {source_max} characters each) or neither',
+    )
+    valid = _report(batch, checks, result)
+
+    # Rows sharing a (source, source_id) update the same park; the last one wins.
+    rows, unkeyed = {}, []
+    for index in np.flatnonzero(valid):
+        values = {name: columns[name][index] for name in PARK_FIELDS if name in batch[index][1]}
+        if 'official_website' in values:
+            values['official_website'] = values['official_website'] or None
+        if keyed[index]:
+            rows[(str(sources[index]), str(source_ids[index]))] = values
+        else:
+            unkeyed.append(values)
+
+    existing = {}
+    for source in {source for source, _ in rows}:
+        ids = [source_id for key_source, source_id in rows if key_source == source]
+        for identifier in (ParkIdentifier.objects.filter(source_name=source, source_id__in=ids)
+                           .select_related('park')):
+            existing[(source, identifier.source_id)] = identifier.park
+    updated = []
+    for key, park in existing.items():
+        for name, value in rows[key].items():
+            setattr(park, name, value)
+        updated.append(park)
+    new_keys = [key for key in rows if key not in existing]
+
+    with transaction.atomic():
+        Park.objects.bulk_update(updated, PARK_FIELDS, batch_size=1000)
+        created = Park.objects.bulk_create(
+            [Park(**rows[key]) for key in new_keys] + [Park(**values) for values in unkeyed], batch_size=1000,
+        )
+        ParkIdentifier.objects.bulk_create([
+            ParkIdentifier(park=park, source_name=source, source_id=source_id)
+            for park, (source, source_id) in zip(created, new_keys)
+        ], batch_size=1000)
+        # bulk writes skip the Park signals, so keep the derived data in step here.
+        search.index_parks([park.pk for park in updated + created])
+    result.created += len(created)
+    result.updated += len(updated)
+    result.written += len(created) + len(updated)
+
+
+def import_parks(rows, batch_size=BATCH_SIZE):
+    """Create or update parks from ``read_rows`` output.
+
+    Rows hold the ``PARK_FIELDS`` (``name`` is required). Rows with ``source``
+    and ``source_id`` update the park imported under that identifier, if any,
+    so re-running an import doesn't duplicate parks; other rows always create one.
+    """
+    result = BulkResult()
+    for batch in _batches(rows, batch_size, result):
+        _park_batch(batch, result)
+    if result.written:
+        invalidate_countries()
+        facets.rebuild()
+        response_cache.invalidate()
+    return result
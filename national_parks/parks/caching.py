@@ -0,0 +1,18 @@
+from django.core.cache import cache
+
+from . import facets
+
+COUNTRIES_KEY = 'parks:countries'
+COUNTRIES_TIMEOUT = 60 * 60
+
+
+def get_countries():
+    """Distinct, sorted non-empty park countries, cached until a park changes."""
+    def load():
+        # From the materialized facet counts rather than a DISTINCT over parks.
+        return sorted(row['value'] for row in facets.materialized(limit=None)['country'])
+    return cache.get_or_set(COUNTRIES_KEY, load, COUNTRIES_TIMEOUT)
+
+
+def invalidate_countries():
+    cache.delete(COUNTRIES_KEY)
@@ -0,0 +1,173 @@
+"""Facet counts for the park filters: country, region, has_image, has_website and rating.
+
+``compute`` counts any filtered queryset in three grouped queries. The counts
+for the whole table are materialized in ``FacetCount``: park saves and deletes
+apply +1/-1 to the values they touched (``park_changed``), single rating
+writes move their park between rating buckets (``rating_moved``), bulk
+rating writes recount the buckets (``refresh_ratings``) and ``rebuild``
+recomputes everything, e.g. after bulk imports.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest
+
+from .models import HAS_IMAGE, HAS_WEBSITE, FacetCount, Park, ParkRatingSummary
+
+FACETS = ('country', 'region', 'has_image', 'has_website', 'rating')
+DEFAULT_LIMIT = 50
+# Facets listed in this fixed order; the others are sorted by count.
+FIXED_ORDER = {
+    'has_image': ('true', 'false'),
+    'has_website': ('true', 'false'),
+    'rating': ('4-5', '3-4', '2-3', '1-2', 'unrated'),
+}
+# Average rating ranges [low, high); parks without ratings are 'unrated'.
+RATING_BUCKETS = {'4-5': (4, None), '3-4': (3, 4), '2-3': (2, 3), '1-2': (None, 2)}
+TOTAL = ('total', '')
+UNRATED = ('rating', 'unrated')
+
+
+def _bucket(label, prefix=''):
+    low, high = RATING_BUCKETS[label]
+    condition = Q(**{f'{prefix}average__isnull': False})
+    if low is not None:
+        condition &= Q(**{f'{prefix}average__gte': low})
+    if high is not None:
+        condition &= Q(**{f'{prefix}average__lt': high})
+    return condition
+
+
+def _shape(counts, total, limit):
+    """``{facet: [{'value': ..., 'count': ...}, ...]}`` from ``{facet: {value: count}}``."""
+    result = {'total': total}
+    for facet in FACETS:
+        values = counts.get(facet, {})
+        if facet in FIXED_ORDER:
+            ordered = [(value, values.get(value, 0)) for value in FIXED_ORDER[facet]]
+        else:
+            ordered = sorted(values.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        result[facet] = [{'value': value, 'count': count} for value, count in ordered]
+    return result
+
+
+def _flag_and_rating_counts(queryset):
+    buckets = list(RATING_BUCKETS)
+    row = queryset.aggregate(
+        total=Count('id'),
+        has_image=Count('id', filter=HAS_IMAGE),
+        has_website=Count('id', filter=HAS_WEBSITE),
+        **{f'rating_{i}': Count('id', filter=_bucket(label, 'rating_summary__')) for i, label in enumerate(buckets)},
+    )
+    rating = {label: row[f'rating_{i}'] for i, label in enumerate(buckets)}
+    rating['unrated'] = row['total'] - sum(rating.values())
+    counts = {
+        'has_image': {'true': row['has_image'], 'false': row['total'] - row['has_image']},
+        'has_website': {'true': row['has_website'], 'false': row['total'] - row['has_website']},
+        'rating': rating,
+    }
+    return row['total'], counts
+
+
+def _value_counts(queryset, column, limit=None):
+    rows = (queryset.exclude(**{column: ''}).values_list(column).annotate(count=Count('id'))
+            .order_by('-count', column))
+    if limit is not None:
+        rows = rows[:limit]
+    return dict(rows)
+
+
+def compute(queryset, limit=DEFAULT_LIMIT):
+    """Facet counts for ``queryset`` (three queries)."""
+    queryset = queryset.order_by()
+    total, counts = _flag_and_rating_counts(queryset)
+    counts['country'] = _value_counts(queryset, 'country', limit)
+    counts['region'] = _value_counts(queryset, 'region', limit)
+    return _shape(counts, total, limit)
+
+
+def rebuild():
+    """Recompute the materialized counts for the whole table."""
+    queryset = Park.objects.order_by()
+    total, counts = _flag_and_rating_counts(queryset)
+    counts['country'] = _value_counts(queryset, 'country')
+    counts['region'] = _value_counts(queryset, 'region')
+    rows = [FacetCount(facet=TOTAL[0], value=TOTAL[1], count=total)]
+    rows += [FacetCount(facet=facet, value=value, count=count)
+             for facet, values in counts.items() for value, count in values.items()]
+    with transaction.atomic():
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def materialized(limit=DEFAULT_LIMIT):
+    """Facet counts for all parks from ``FacetCount`` (one query), building the table on first use."""
+    rows = list(FacetCount.objects.values_list('facet', 'value', 'count'))
+    if not rows:
+        rebuild()
+        rows = list(FacetCount.objects.values_list('facet', 'value', 'count'))
+    counts, total = {}, 0
+    for facet, value, count in rows:
+        if (facet, value) == TOTAL:
+            total = count
+        else:
+            counts.setdefault(facet, {})[value] = count
+    return _shape(counts, total, limit)
+
+
+def facet_values(park):
+    """The (facet, value) pairs ``park`` counts towards, rating aside."""
+    values = {TOTAL, ('has_image', 'true' if park.image else 'false'),
+              ('has_website', 'true' if park.official_website else 'false')}
+    if park.country:
+        values.add(('country', park.country))
+    if park.region:
+        values.add(('region', park.region))
+    return values
+
+
+def park_changed(old, new):
+    """Move a park's counts from the ``old`` to the ``new`` value set (either may be empty)."""
+    if not FacetCount.objects.filter(facet=TOTAL[0], value=TOTAL[1]).exists():
+        return  # not built yet; materialized() builds it from scratch
+    for (facet, value), delta in [(pair, -1) for pair in old - new] + [(pair, 1) for pair in new - old]:
+        row, _ = FacetCount.objects.get_or_create(facet=facet, value=value)
+        FacetCount.objects.filter(pk=row.pk).update(count=Greatest(F('count') + delta, 0))
+    # Only the values this park left can have dropped to zero.
+    emptied = Q()
+    for facet, value in old - new:
+        if facet not in FIXED_ORDER and (facet, value) != TOTAL:
+            emptied |= Q(facet=facet, value=value)
+    if emptied:
+        FacetCount.objects.filter(emptied, count=0).delete()
+
+
+def rating_bucket(average):
+    """The rating facet value for a park's average rating, 'unrated' for None."""
+    if average is None:
+        return UNRATED[1]
+    for label, (low, high) in RATING_BUCKETS.items():
+        if (low is None or average >= low) and (high is None or average < high):
+            return label
+
+
+def rating_moved(old_average, new_average):
+    """Move a park between rating buckets after its average went from ``old_average`` to ``new_average``."""
+    old, new = rating_bucket(old_average), rating_bucket(new_average)
+    if old != new:
+        park_changed({('rating', old)}, {('rating', new)})
+
+
+def refresh_ratings():
+    """Recount the rating buckets from every summary, after bulk rating writes."""
+    if not FacetCount.objects.filter(facet=TOTAL[0], value=TOTAL[1]).exists():
+        return
+    buckets = list(RATING_BUCKETS)
+    rated = ParkRatingSummary.objects.aggregate(
+        **{f'rating_{i}': Count('pk', filter=_bucket(label)) for i, label in enumerate(buckets)}
+    )
+    counts = {label: rated[f'rating_{i}'] for i, label in enumerate(buckets)}
+    total = FacetCount.objects.get(facet=TOTAL[0], value=TOTAL[1]).count
+    counts['unrated'] = max(total - sum(counts.values()), 0)
+    for value, count in counts.items():
+        FacetCount.objects.update_or_create(facet='rating', value=value, defaults={'count': count})
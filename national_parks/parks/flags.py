@@ -0,0 +1,45 @@
+"""Country flag assets, stored once per content hash and shared by every park in the country."""
+import hashlib
+
+from django.core.files.base import ContentFile
+
+from .models import CountryFlag
+
+
+def save_file(content, ext='.png'):
+    """Store flag bytes under their SHA-256 unless that file already exists; returns (name, sha256)."""
+    sha256 = hashlib.sha256(content).hexdigest()
+    storage = CountryFlag._meta.get_field('image').storage
+    name = f"flags/{sha256}{ext}"
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(content))
+    return name, sha256
+
+
+def store(code, name, sha256):
+    """Point the flag for ``code`` at a stored file, creating the row if needed."""
+    flag, _ = CountryFlag.objects.update_or_create(
+        code=code.lower(), defaults={'image': name, 'sha256': sha256},
+    )
+    return flag
+
+
+def unused_files():
+    """Stored files under ``flags/`` that no CountryFlag points at, e.g. the per-park copies from before 0011."""
+    storage = CountryFlag._meta.get_field('image').storage
+    used = set(CountryFlag.objects.values_list('image', flat=True))
+    try:
+        _, files = storage.listdir('flags')
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in (f'flags/{file}' for file in files) if name not in used)
+
+
+def prune(dry_run=False):
+    """Delete ``unused_files``; returns their names."""
+    storage = CountryFlag._meta.get_field('image').storage
+    names = unused_files()
+    if not dry_run:
+        for name in names:
+            storage.delete(name)
+    return names
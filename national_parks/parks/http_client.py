@@ -0,0 +1,261 @@
+"""Shared client for outbound HTTP (Wikidata, Wikipedia, flagcdn).
+
+One pooled ``requests.Session`` per host so connections are kept alive,
+per-host concurrency and rate limits, retries with jittered exponential
+backoff, and an HTTP cache for GETs: fresh responses are served without a
+request, stale ones are revalidated with If-None-Match/If-Modified-Since and
+a 304 reuses the cached body. Counters per host are available from
+``HttpClient.stats()``.
+
+The cache uses the ``HTTP_CLIENT_CACHE_ALIAS`` cache (default ``"outbound"``,
+falling back to ``"default"`` when that alias isn't configured).
+
+The trip planner's LLM calls don't go through here: they are streamed POSTs
+made from async views, which a blocking ``requests`` session would hold a
+thread for, and which are neither cached nor retried. ``parks.trip_planner``
+keeps its own pooled ``httpx.AsyncClient`` per event loop instead.
+"""
+import hashlib
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+CACHE_TIMEOUT = 30 * 24 * 60 * 60
+MAX_CACHED_BODY = 2 * 1024 * 1024
+
+
+class HostLimiter:
+    """Caps in-flight requests and request rate per host, shared by all threads."""
+
+    def __init__(self, concurrency=8, rate=0.0):
+        self.concurrency = concurrency
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    @contextmanager
+    def limit(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = {'slots': threading.BoundedSemaphore(self.concurrency), 'next': 0.0}
+        with state['slots']:
+            if self.interval:
+                with self._lock:
+                    now = time.monotonic()
+                    start = max(now, state['next'])
+                    state['next'] = start + self.interval
+                if start > now:
+                    time.sleep(start - now)
+            yield
+
+
+def _cache():
+    alias = getattr(settings, 'HTTP_CLIENT_CACHE_ALIAS', 'outbound')
+    return caches[alias if alias in settings.CACHES else 'default']
+
+
+def _max_age(headers):
+    """Seconds the response may be served without revalidation, or None if it must not be stored."""
+    directives = {}
+    for part in headers.get('Cache-Control', '').split(','):
+        name, _, value = part.strip().partition('=')
+        directives[name.lower()] = value
+    if 'no-store' in directives or 'private' in directives:
+        return None
+    if 'no-cache' in directives:
+        return 0
+    try:
+        return int(directives.get('s-maxage') or directives.get('max-age') or 0)
+    except ValueError:
+        return 0
+
+
+def _cached_response(entry, url, status=200):
+    response = requests.Response()
+    response.status_code = status
+    response._content = entry['content']
+    response.headers = CaseInsensitiveDict(entry['headers'])
+    response.url = url
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response.from_cache = True
+    return response
+
+
+class HttpClient:
+    def __init__(self, host_concurrency=8, host_rate=0.0, retries=3, backoff=0.5, pool_size=16,
+                 user_agent=None):
+        self.limiter = HostLimiter(host_concurrency, host_rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.user_agent = user_agent
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: defaultdict(float))
+
+    def session(self, host):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = self._sessions[host] = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                if self.user_agent:
+                    session.headers['User-Agent'] = self.user_agent
+            return session
+
+    def count(self, host, **values):
+        with self._lock:
+            for name, value in values.items():
+                self._stats[host][name] += value
+
+    def stats(self):
+        """Per-host counters: requests, hits, revalidated, misses, retries, errors and latency."""
+        with self._lock:
+            snapshot = {}
+            for host, values in self._stats.items():
+                values = dict(values)
+                requests_made = values.get('requests', 0)
+                values['avg_latency_ms'] = values.get('latency', 0) * 1000 / requests_made if requests_made else 0.0
+                snapshot[host] = values
+            return snapshot
+
+    def report(self):
+        """One line of counters per host, for command output."""
+        return [
+            f"{host}: {int(c.get('requests', 0))} requests, {int(c.get('hits', 0))} cache hits, "
+            f"{int(c.get('revalidated', 0))} revalidated (304), {int(c.get('misses', 0))} misses, "
+            f"{int(c.get('retries', 0))} retries, {int(c.get('errors', 0))} errors, "
+            f"avg {c['avg_latency_ms']:.0f} ms"
+            for host, c in sorted(self.stats().items())
+        ]
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def request(self, method, url, retries=None, cache=None, **kwargs):
+        """Send a request and ``raise_for_status`` once retries are used up.
+
+        ``cache`` defaults to True for non-streamed GETs; responses served from
+        the cache have ``from_cache = True``. ``retries`` defaults to the
+        client's setting for idempotent methods and 0 otherwise.
+        """
+        method = method.upper()
+        host = urlsplit(url).netloc
+        if cache is None:
+            cache = method == 'GET' and not kwargs.get('stream')
+        if retries is None:
+            # Don't repeat a non-idempotent request unless the caller asks for it.
+            retries = self.retries if method in IDEMPOTENT_METHODS else 0
+
+        key = entry = None
+        if cache:
+            key = self.cache_key(url, kwargs.get('params'))
+            entry = _cache().get(key)
+            if entry and entry['fresh_until'] > time.time():
+                self.count(host, hits=1)
+                return _cached_response(entry, url)
+            if entry:
+                headers = dict(kwargs.pop('headers', None) or {})
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+                kwargs['headers'] = headers
+
+        response = self._send(method, url, host, retries, **kwargs)
+
+        if cache and response.status_code == 304 and entry:
+            self.count(host, revalidated=1)
+            self.store(key, entry, response.headers)
+            return _cached_response(entry, url)
+        response.raise_for_status()
+        if cache:
+            self.count(host, misses=1)
+            self.store(key, None, response.headers, response)
+        response.from_cache = False
+        return response
+
+    def _send(self, method, url, host, retries, **kwargs):
+        session = self.session(host)
+        for attempt in range(retries + 1):
+            response = None
+            started = time.perf_counter()
+            try:
+                with self.limiter.limit(host):
+                    response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self.count(host, requests=1, errors=1, latency=time.perf_counter() - started)
+                if attempt == retries:
+                    raise
+            else:
+                self.count(host, requests=1, latency=time.perf_counter() - started)
+                if response.status_code not in RETRY_STATUSES or attempt == retries:
+                    return response
+                response.close()
+            self.count(host, retries=1)
+            time.sleep(self.delay(attempt, response))
+
+    def delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    @staticmethod
+    def cache_key(url, params=None):
+        prepared = requests.Request('GET', url, params=params).prepare().url
+        return 'http:' + hashlib.sha256(prepared.encode()).hexdigest()
+
+    def store(self, key, entry, headers, response=None):
+        max_age = _max_age(headers)
+        etag = headers.get('ETag') or (entry or {}).get('etag')
+        last_modified = headers.get('Last-Modified') or (entry or {}).get('last_modified')
+        if max_age is None or not (etag or last_modified or max_age):
+            return
+        if response is not None:
+            if len(response.content) > MAX_CACHED_BODY:
+                return
+            entry = {
+                'content': response.content,
+                'headers': {name: value for name, value in response.headers.items()
+                            if name.lower() in ('content-type', 'etag', 'last-modified', 'cache-control')},
+            }
+        entry = dict(entry, etag=etag, last_modified=last_modified, fresh_until=time.time() + max_age)
+        _cache().set(key, entry, CACHE_TIMEOUT)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_client():
+    """The process-wide client, for code that doesn't configure its own."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = HttpClient()
+        return _default
+
@@ -0,0 +1,184 @@
+"""Resized, re-encoded variants of park images for ``srcset``/``<picture>``.
+
+``render_variants`` is a pure function over the original's bytes so it can run
+in a process pool (see the ``generate_image_variants`` command); ``store`` and
+``generate`` write the files next to the original and record them in
+``Park.image_variants``::
+
+    {"source": "parks/12.jpg", "width": 4000, "height": 3000,
+     "formats": {"avif": [{"width": 320, "height": 240, "name": "..."}, ...], ...}}
+"""
+import io
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+WIDTHS = (320, 640, 1280)
+# Preferred first; the last one is the <img> fallback.
+FORMATS = ('avif', 'webp', 'jpeg')
+CONTENT_TYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+EXTENSIONS = {'avif': '.avif', 'webp': '.webp', 'jpeg': '.jpg'}
+ENCODER_OPTIONS = {
+    'avif': {'quality': 55, 'speed': 8},
+    'webp': {'quality': 78, 'method': 4},
+    'jpeg': {'quality': 82, 'optimize': True, 'progressive': True},
+}
+VARIANT_DIR = 'parks/variants'
+ORIENTATION_TAG = 0x0112
+
+# Ingesting downloaded originals: overridable with IMAGE_MAX_BYTES / IMAGE_MAX_DIMENSION.
+MAX_BYTES = 30 * 1024 * 1024
+MAX_DIMENSION = 12000
+# Downloads stay in memory up to this size and spill to a temporary file beyond it.
+SPOOL_SIZE = 1024 * 1024
+ORIGINAL_EXTENSIONS = {'jpeg': '.jpg', 'png': '.png', 'webp': '.webp', 'gif': '.gif'}
+
+
+class ImageRejected(ValueError):
+    pass
+
+
+def sniff(head):
+    """Image format from the first bytes of a file, or None."""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    return None
+
+
+def _accept(head, allowed):
+    fmt = sniff(head)
+    if fmt not in allowed:
+        raise ImageRejected(f"unsupported content ({fmt or 'not an image'})")
+    return fmt
+
+
+def spool(chunks, allowed=('jpeg', 'png'), max_bytes=None, max_dimension=None):
+    """Collect a downloaded image from ``chunks`` into a spooled temporary file.
+
+    The format is sniffed from the first bytes, the size capped while reading and
+    the dimensions checked from the header, so a rejected download is dropped
+    before it's fully read. Returns ``(file, format, (width, height))`` with the
+    file rewound; raises ``ImageRejected``.
+    """
+    max_bytes = max_bytes or getattr(settings, 'IMAGE_MAX_BYTES', MAX_BYTES)
+    max_dimension = max_dimension or getattr(settings, 'IMAGE_MAX_DIMENSION', MAX_DIMENSION)
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        head, size, fmt = b'', 0, None
+        for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise ImageRejected(f"larger than {max_bytes} bytes")
+            if fmt is None:
+                head += chunk[:12 - len(head)]
+                if len(head) == 12:
+                    fmt = _accept(head, allowed)
+            spooled.write(chunk)
+        fmt = fmt or _accept(head, allowed)
+        spooled.seek(0)
+        try:
+            with Image.open(spooled) as image:
+                dimensions = image.size
+        except Exception as e:
+            raise ImageRejected(f"unreadable image: {e}")
+        if max(dimensions) > max_dimension:
+            raise ImageRejected(f"{dimensions[0]}x{dimensions[1]} exceeds {max_dimension}px")
+        spooled.seek(0)
+        return spooled, fmt, dimensions
+    except BaseException:
+        spooled.close()
+        raise
+
+
+def widths():
+    return tuple(getattr(settings, 'PARK_IMAGE_WIDTHS', WIDTHS))
+
+
+def formats():
+    return tuple(getattr(settings, 'PARK_IMAGE_FORMATS', FORMATS))
+
+
+def render_variants(data, widths=WIDTHS, formats=FORMATS):
+    """Encode ``data`` (bytes or a binary file) at each width narrower than the original, in each format.
+
+    Returns ``(original_size, [(format, width, height, bytes), ...])``. When the
+    original is narrower than every width it is re-encoded at its own size.
+    """
+    with Image.open(io.BytesIO(data) if isinstance(data, bytes) else data) as image:
+        width, height = image.size
+        if image.getexif().get(ORIENTATION_TAG) in (5, 6, 7, 8):
+            width, height = height, width
+        original_size = (width, height)
+        targets = sorted({w for w in widths if w < width}) or [width]
+        # Lets the JPEG decoder scale down by up to 8x while reading; asking for
+        # a square keeps both sides large enough whatever the orientation.
+        image.draft('RGB', (max(targets), max(targets)))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        rendered = []
+        for width in targets:
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS) if width != image.width else image
+            for fmt in formats:
+                frame = resized.convert('RGB') if fmt == 'jpeg' and resized.mode != 'RGB' else resized
+                buffer = io.BytesIO()
+                frame.save(buffer, fmt.upper(), **ENCODER_OPTIONS.get(fmt, {}))
+                rendered.append((fmt, width, height, buffer.getvalue()))
+    return original_size, rendered
+
+
+def store(source_name, original_size, rendered, storage):
+    """Save rendered variants and return the ``image_variants`` value describing them."""
+    stem = os.path.splitext(os.path.basename(source_name))[0]
+    variants = {'source': source_name, 'width': original_size[0], 'height': original_size[1], 'formats': {}}
+    for fmt, width, height, content in rendered:
+        name = storage.save(f"{VARIANT_DIR}/{stem}-{width}w{EXTENSIONS[fmt]}", ContentFile(content))
+        variants['formats'].setdefault(fmt, []).append({'width': width, 'height': height, 'name': name})
+    return variants
+
+
+def build(source_name, data, storage):
+    """Render and store the variants of an image that was just saved as ``source_name``."""
+    original_size, rendered = render_variants(data, widths(), formats())
+    return store(source_name, original_size, rendered, storage)
+
+
+def is_current(park):
+    """True when ``park.image_variants`` describes the park's current image."""
+    if not park.image:
+        return not park.image_variants
+    return (park.image_variants or {}).get('source') == park.image.name
+
+
+def generate(park, save=True):
+    """(Re)build the variants of ``park.image`` from its stored original."""
+    if not park.image:
+        park.image_variants = {}
+    else:
+        with park.image.open('rb') as f:
+            data = f.read()
+        park.image_variants = build(park.image.name, data, park.image.storage)
+    if save:
+        park.save(update_fields=['image_variants'])
+    return park.image_variants
+
+
+def candidates(park, fmt):
+    """``[(url, width), ...]`` for one format, narrowest first."""
+    variants = (park.image_variants or {}).get('formats', {}).get(fmt, [])
+    storage = park.image.storage
+    return [(storage.url(v['name']), v['width']) for v in variants]
+
+
+def srcset(park, fmt):
+    return ', '.join(f'{url} {width}w' for url, width in candidates(park, fmt))
@@ -0,0 +1,458 @@
+"""Staged Wikidata import pipeline used by the ``import_parks_wikidata`` command.
+
+1. fetch    - SPARQL pages keyed on the item IRI, each response parsed as a
+              stream so memory is bounded by the page size
+2. upsert   - per batch, create missing parks/identifiers with ``bulk_create``
+3. enrich   - flags for countries not seen yet (one per country code, shared
+              by all its parks), then image (plus its resized variants) and
+              Wikipedia lookups for the batch on a thread pool,
+              through ``http_client`` (pooled sessions, per-host limits,
+              retries, and revalidation of anything fetched before)
+4. write    - one ``bulk_update`` per batch, then the batch is checkpointed;
+              facet counts, the countries list and cached responses are
+              refreshed once, when the run ends
+
+Each page is written before the next one is requested. The checkpoint holds
+the keyset position of the last finished page plus the ids already written
+from the current one, so an interrupted run resumes where it stopped.
+"""
+import codecs
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import quote
+
+import requests
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+
+from .caching import invalidate_countries
+from .http_client import HttpClient
+from .models import CountryFlag, Park, ParkIdentifier
+from . import facets
+from . import flags as flag_store
+from . import images
+from . import response_cache
+from . import search
+from . import wiki_cache
+
+# Overridable from settings, e.g. to point an import at local stubs.
+SPARQL_URL = 'https://query.wikidata.org/sparql'
+WIKIPEDIA_SUMMARY_URL = 'https://en.wikipedia.org/api/rest_v1/page/summary/'
+FLAG_URL = 'https://flagcdn.com/w40/{code}.png'
+
+# One page of parks: the inner query picks the next {limit} items after the
+# keyset position, the outer one fetches their details (possibly several rows
+# per item when it has several images or regions).
+WD_SPARQL = """
+SELECT ?item ?itemLabel ?itemDescription ?image ?countryLabel ?countryCode ?adminLabel WHERE {
+  {
+    SELECT DISTINCT ?item WHERE {
+      ?item wdt:P31 wd:Q46169.
+      FILTER(STR(?item) > "{after}")
+    }
+    ORDER BY STR(?item)
+    LIMIT {limit}
+  }
+  OPTIONAL { ?item wdt:P18 ?image }
+  OPTIONAL { ?item wdt:P17 ?country .
+             ?country wdt:P297 ?countryCode }
+  OPTIONAL { ?item wdt:P131 ?admin . }
+  SERVICE wikibase:label { bd:serviceParam wikibase:language "[AUTO_LANGUAGE],en". }
+}
+ORDER BY STR(?item)
+"""
+
+USER_AGENT = 'NationalParksImporter/1.0 (https://example.com; contact@example.com)'
+SPARQL_HEADERS = {
+    'Accept': 'application/sparql-results+json',
+    'User-Agent': USER_AGENT,
+}
+IMG_HEADERS = {
+    'User-Agent': USER_AGENT,
+}
+
+# Sniffed from the downloaded bytes, whatever the URL or Content-Type says.
+ALLOWED_IMAGE_FORMATS = ('jpeg', 'png')
+CHECKPOINT_FILE = "import_checkpoint.json"
+
+
+def iter_bindings(chunks):
+    """Yield each object of ``results.bindings`` from a SPARQL JSON response as it streams in.
+
+    ``chunks`` is an iterable of bytes; only the text of the binding currently
+    being parsed is held in memory.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    in_array = False
+    for chunk in chunks:
+        buffer += text_decoder.decode(chunk)
+        if not in_array:
+            key = buffer.find('"bindings"')
+            start = buffer.find('[', key) if key != -1 else -1
+            if start == -1:
+                continue
+            buffer = buffer[start + 1:]
+            in_array = True
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                binding, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # incomplete object, wait for more data
+            yield binding
+        buffer = buffer[pos:]
+    if not in_array:
+        raise ValueError("SPARQL response has no results.bindings array")
+
+
+class Checkpoint:
+    """Import progress, persisted atomically after every batch.
+
+    ``after`` is the item IRI the last finished page ended on, ``done`` the
+    Wikidata ids already written from the page in progress and ``imported``
+    the number of parks on finished pages, counted against ``--limit``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.reset()
+
+    def reset(self):
+        self.after = ''
+        self.done = set()
+        self.imported = 0
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+            self.after = state.get('after', '')
+            self.done = set(state.get('done', []))
+            self.imported = state.get('imported', 0)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.reset()
+        return self
+
+    def save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({'after': self.after, 'done': sorted(self.done), 'imported': self.imported}, f)
+        os.replace(tmp, self.path)
+
+    def page_finished(self, after, count):
+        self.after = after
+        self.imported += count
+        self.done = set()
+        self.save()
+
+    def clear(self):
+        self.reset()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+@dataclass
+class Candidate:
+    item: str
+    wikidata_id: str
+    name: str
+    description: str
+    country: str
+    country_code: str
+    region: str
+    image_url: str
+
+    @classmethod
+    def from_binding(cls, row):
+        def value(key):
+            return (row.get(key) or {}).get('value', '')
+        uri = value('item')
+        return cls(
+            item=uri,
+            wikidata_id=uri.rsplit('/', 1)[-1] if uri else '',
+            name=value('itemLabel'),
+            description=value('itemDescription'),
+            country=value('countryLabel'),
+            country_code=value('countryCode'),
+            region=value('adminLabel'),
+            image_url=value('image'),
+        )
+
+
+@dataclass
+class Enrichment:
+    park: Park
+    image: str = None
+    image_variants: dict = None
+    flag: CountryFlag = None
+    wiki: dict = None
+    fetched_wiki: bool = False
+    log: list = field(default_factory=list)
+
+
+@dataclass
+class ImportStats:
+    rows: int = 0
+    created: int = 0
+    skipped: int = 0
+    images: int = 0
+    flags: int = 0
+
+    def summary(self):
+        return (f"Imported/updated {self.rows} items, created {self.created}, "
+                f"downloaded {self.images} images, downloaded {self.flags} flags"
+                + (f", skipped {self.skipped} already imported" if self.skipped else "") + ".")
+
+
+class WikidataImporter:
+    def __init__(self, workers=8, batch_size=100, page_size=500, host_concurrency=4, host_rate=0.0,
+                 checkpoint_path=CHECKPOINT_FILE, log=None, retries=5, backoff=2.0):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.page_size = page_size
+        self.retries = retries
+        self.backoff = backoff
+        self.http = HttpClient(host_concurrency=host_concurrency, host_rate=host_rate,
+                               pool_size=max(workers, 10), user_agent=USER_AGENT)
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.log = log or (lambda message, level='info': print(message))
+        self.sparql_url = getattr(settings, 'WIKIDATA_SPARQL_URL', SPARQL_URL)
+        self.summary_url = getattr(settings, 'WIKIPEDIA_SUMMARY_URL', WIKIPEDIA_SUMMARY_URL)
+        self.flag_url = getattr(settings, 'FLAG_CDN_URL', FLAG_URL)
+        # Country code -> CountryFlag, or None when fetching it failed this run.
+        self.flags = {}
+
+    def get(self, url, **kwargs):
+        return self.http.get(url, **kwargs)
+
+    # -- stage 1: fetch ----------------------------------------------------
+
+    def fetch_page(self, after, limit):
+        """Candidates for the next ``limit`` items after ``after``, retried with backoff."""
+        query = WD_SPARQL.replace('{after}', after.replace('"', '\\"')).replace('{limit}', str(limit))
+        for attempt in range(self.retries + 1):
+            try:
+                # Retried here rather than in the client so a failure mid-stream restarts the page too.
+                r = self.http.get(self.sparql_url, params={'query': query}, headers=SPARQL_HEADERS,
+                                  timeout=60, stream=True, retries=0)
+                with r:
+                    candidates, seen = [], set()
+                    for row in iter_bindings(r.iter_content(chunk_size=64 * 1024)):
+                        candidate = Candidate.from_binding(row)
+                        # Items with several images/regions come back once per combination.
+                        if candidate.wikidata_id and candidate.wikidata_id not in seen:
+                            seen.add(candidate.wikidata_id)
+                            candidates.append(candidate)
+                return candidates
+            except (requests.RequestException, ValueError) as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                self.log(f"SPARQL page after {after or 'start'} failed ({e}); retrying in {delay:.1f}s", 'warning')
+                time.sleep(delay)
+
+    def pages(self, limit):
+        """Yield pages of candidates from the checkpointed position until ``limit`` parks were read."""
+        after = self.checkpoint.after
+        remaining = limit - self.checkpoint.imported if limit else None
+        while remaining is None or remaining > 0:
+            size = self.page_size if remaining is None else min(self.page_size, remaining)
+            page = self.fetch_page(after, size)
+            if not page:
+                return
+            yield page
+            after = page[-1].item
+            if remaining is not None:
+                remaining -= len(page)
+            if len(page) < size:
+                return
+
+    # -- stage 2: upsert ---------------------------------------------------
+
+    def upsert(self, candidates, stats):
+        ids = [c.wikidata_id for c in candidates]
+        existing = {
+            identifier.source_id: identifier.park
+            for identifier in ParkIdentifier.objects.filter(source_name='wikidata', source_id__in=ids)
+                                                    .select_related('park')
+        }
+        new = [c for c in candidates if c.wikidata_id not in existing]
+        with transaction.atomic():
+            parks = Park.objects.bulk_create([
+                Park(name=c.name, description=c.description, country=c.country,
+                     region=c.region, location='')
+                for c in new
+            ])
+            ParkIdentifier.objects.bulk_create([
+                ParkIdentifier(park=park, source_name='wikidata', source_id=c.wikidata_id)
+                for park, c in zip(parks, new)
+            ])
+        for park, c in zip(parks, new):
+            existing[c.wikidata_id] = park
+            self.log(f"Created park: {park.name}")
+        stats.created += len(new)
+        return [(existing[c.wikidata_id], c) for c in candidates]
+
+    # -- stage 3: enrich ---------------------------------------------------
+
+    def enrich(self, park, candidate, cached_wiki):
+        result = Enrichment(park=park)
+        if not park.image and candidate.image_url:
+            try:
+                result.image, result.image_variants = self.download_image(park, candidate.image_url)
+                if result.image:
+                    result.log.append((f"Downloaded image for {park.name}", 'info'))
+            except Exception as e:
+                result.log.append((f"Failed to download image for {park.name}: {e}", 'warning'))
+        if candidate.country_code:
+            result.flag = self.flags.get(candidate.country_code.lower())
+
+        wiki = cached_wiki.get(candidate.wikidata_id)
+        if wiki is not None:
+            result.log.append((f"Using cached Wikipedia data for {park.name}", 'info'))
+        else:
+            wiki = self.fetch_wikipedia_summary(park.name)
+            result.fetched_wiki = True
+        result.wiki = wiki
+        return result
+
+    def download_image(self, park, url):
+        """Stream an original into storage; memory use is bounded whatever its size.
+
+        The body goes through a spooled temporary file (see ``images.spool``)
+        that the storage uploads from in chunks, e.g. as an S3 multipart upload.
+        """
+        max_bytes = getattr(settings, 'IMAGE_MAX_BYTES', images.MAX_BYTES)
+        with self.get(url, headers=IMG_HEADERS, timeout=40, stream=True) as resp:
+            length = resp.headers.get('Content-Length')
+            if length and length.isdigit() and int(length) > max_bytes:
+                raise images.ImageRejected(f"larger than {max_bytes} bytes")
+            spooled, fmt, _ = images.spool(resp.iter_content(chunk_size=64 * 1024), ALLOWED_IMAGE_FORMATS,
+                                           max_bytes=max_bytes)
+        with spooled:
+            image_field = Park._meta.get_field('image')
+            name = image_field.generate_filename(park, f"{park.id}{images.ORIGINAL_EXTENSIONS[fmt]}")
+            name = image_field.storage.save(name, File(spooled, name=name))
+            spooled.seek(0)
+            return name, images.build(name, spooled, image_field.storage)
+
+    def download_flag(self, country_code):
+        resp = self.get(self.flag_url.format(code=country_code), timeout=20)
+        return flag_store.save_file(resp.content)
+
+    def resolve_flags(self, codes, pool, stats):
+        """Load or download the flags of ``codes`` not resolved earlier in this run."""
+        missing = {code.lower() for code in codes if code} - self.flags.keys()
+        if not missing:
+            return
+        for flag in CountryFlag.objects.filter(code__in=missing):
+            self.flags[flag.code] = flag
+        missing = sorted(missing - self.flags.keys())
+
+        def fetch(code):
+            try:
+                return self.download_flag(code), None
+            except Exception as e:
+                return None, e
+
+        for code, (stored, error) in zip(missing, pool.map(fetch, missing)):
+            if error is not None:
+                self.flags[code] = None
+                self.log(f"Failed to download flag for {code.upper()}: {error}", 'warning')
+                continue
+            self.flags[code] = flag_store.store(code, *stored)
+            stats.flags += 1
+            self.log(f"Downloaded flag for {code.upper()}")
+
+    def fetch_wikipedia_summary(self, park_name):
+        url = self.summary_url + quote(park_name.replace(' ', '_'), safe='')
+        try:
+            data = self.get(url, timeout=20).json()
+            return {
+                "description": data.get("extract", ""),
+                "official_website": data.get("content_urls", {}).get("desktop", {}).get("page")
+            }
+        except Exception:
+            return {"description": None, "official_website": None}
+
+    # -- stage 4: write ----------------------------------------------------
+
+    def write(self, results, stats):
+        changed = []
+        for result in results:
+            park = result.park
+            if result.image:
+                park.image = result.image
+                park.image_variants = result.image_variants
+                stats.images += 1
+            if result.flag and park.country_flag_id != result.flag.pk:
+                park.country_flag = result.flag
+            if result.wiki.get("description"):
+                park.description = result.wiki["description"]
+            if result.wiki.get("official_website"):
+                park.official_website = result.wiki["official_website"]
+            changed.append(park)
+        with transaction.atomic():
+            Park.objects.bulk_update(changed, ['description', 'official_website', 'image', 'image_variants', 'country_flag'])
+            # bulk writes skip the Park signals, so keep the derived data in step here.
+            search.index_parks([park.pk for park in changed])
+
+    def refresh(self):
+        """Rebuild what is derived from all parks; once per run, not per batch."""
+        invalidate_countries()
+        facets.rebuild()
+        response_cache.invalidate()
+
+    # -- driver ------------------------------------------------------------
+
+    def run(self, limit, resume=True):
+        """Import up to ``limit`` parks (0 = all of them)."""
+        stats = ImportStats()
+        if resume:
+            self.checkpoint.load()
+        else:
+            self.checkpoint.clear()
+
+        try:
+            self.import_pages(limit, stats)
+        finally:
+            # Also after a failure: the batches written so far are in the database.
+            if stats.rows:
+                self.refresh()
+        self.checkpoint.clear()
+        return stats
+
+    def import_pages(self, limit, stats):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for page in self.pages(limit):
+                stats.rows += len(page)
+                pending = [c for c in page if c.wikidata_id not in self.checkpoint.done]
+                stats.skipped += len(page) - len(pending)
+                for start in range(0, len(pending), self.batch_size):
+                    batch = self.upsert(pending[start:start + self.batch_size], stats)
+                    self.resolve_flags([c.country_code for _, c in batch], pool, stats)
+                    cached_wiki = wiki_cache.get_many(c.wikidata_id for _, c in batch)
+                    results = list(pool.map(lambda item: self.enrich(item[0], item[1], cached_wiki), batch))
+                    for result in results:
+                        for message, level in result.log:
+                            self.log(message, level)
+                    self.write(results, stats)
+                    wiki_cache.put_many(
+                        (c.wikidata_id, result.wiki, result.park.name)
+                        for (_, c), result in zip(batch, results) if result.fetched_wiki
+                    )
+                    self.checkpoint.done.update(c.wikidata_id for _, c in batch)
+                    self.checkpoint.save()
+                self.checkpoint.page_finished(page[-1].item, len(page))
+                self.log(f"Finished page ending at {page[-1].wikidata_id} ({self.checkpoint.imported} parks so far)")
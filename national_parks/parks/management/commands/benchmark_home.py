@@ -0,0 +1,84 @@
+import contextlib
+import io
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from parks.caching import invalidate_countries
+from parks.models import Park
+from parks.views import HomeView
+
+COUNTRIES = ['Israel', 'United States', 'Kenya', 'Canada', 'Chile', 'Japan', 'Norway', 'Australia']
+
+
+class Command(BaseCommand):
+    help = ("Time the home page render against growing park tables. Parks are created inside a "
+            "transaction that is rolled back, so the database is left untouched. Fails when a deep "
+            "keyset page is more than --max-ratio times slower than the first page.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 50000])
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--max-ratio', type=float, default=3.0,
+                            help='Largest allowed deep page / first page median time.')
+
+    def render(self, factory, params):
+        request = factory.get('/', params)
+        # Signed-in requests bypass the response cache, so every render is timed.
+        request.user = get_user_model()(username='benchmark')
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = HomeView.as_view()(request)
+            response.render()
+        return response
+
+    def handle(self, *args, **opts):
+        factory = RequestFactory()
+        self.stdout.write(f"{'parks':>8} {'first page ms':>14} {'deep page ms':>13} {'ratio':>6} "
+                          f"{'queries':>8} {'bytes':>8}")
+        slow = []
+        with transaction.atomic():
+            created = 0
+            for size in sorted(opts['sizes']):
+                Park.objects.bulk_create(
+                    [Park(name=f'Bench Park {i:06d}', description='Lorem ipsum ' * 200,
+                          country=COUNTRIES[i % len(COUNTRIES)]) for i in range(created, size)],
+                    batch_size=2000,
+                )
+                created = size
+                invalidate_countries()
+                self.render(factory, {})  # warm the country cache
+
+                first, deep = [], []
+                for _ in range(opts['repeat']):
+                    start = time.perf_counter()
+                    with CaptureQueriesContext(connection) as queries:
+                        response = self.render(factory, {})
+                    first.append(time.perf_counter() - start)
+
+                    last = Park.objects.order_by('-name', '-id').only('name', 'id')[30]
+                    start = time.perf_counter()
+                    self.render(factory, {'after': _cursor(last)})
+                    deep.append(time.perf_counter() - start)
+
+                ratio = statistics.median(deep) / statistics.median(first)
+                if ratio > opts['max_ratio']:
+                    slow.append(f'{size} parks ({ratio:.1f}x)')
+                self.stdout.write(
+                    f"{size:>8} {statistics.median(first) * 1000:>14.2f} {statistics.median(deep) * 1000:>13.2f} "
+                    f"{ratio:>6.2f} {len(queries):>8} {len(response.content):>8}"
+                )
+            transaction.set_rollback(True)
+        invalidate_countries()
+        if slow:
+            raise CommandError(f"Deep pages are more than {opts['max_ratio']}x slower than the first page at "
+                               f"{', '.join(slow)}")
+
+
+def _cursor(park):
+    from parks.pagination import encode_cursor
+    return encode_cursor([park.name, park.id])
@@ -0,0 +1,165 @@
+import bisect
+import io
+import json
+import multiprocessing
+import re
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from PIL import Image
+
+from parks.importer import WikidataImporter
+
+COUNTRY_CODES = ['US', 'IL', 'KE', 'CA', 'CL', 'JP', 'NO', 'AU']
+
+
+def _image_bytes(fmt):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (40, 120, 60)).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+class StubServer(ThreadingHTTPServer):
+    """Local stand-in for Wikidata, Wikimedia, flagcdn and Wikipedia with fixed per-request latency."""
+    daemon_threads = True
+
+    def __init__(self, parks, latency, counter):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.parks = parks
+        self.latency = latency
+        self.counter = counter
+        # Keyset order of the SPARQL stub: items sorted by IRI string.
+        self.items = sorted(f'http://www.wikidata.org/entity/Q{i}' for i in range(1, parks + 1))
+        self.jpeg = _image_bytes('JPEG')
+        self.png = _image_bytes('PNG')
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def bindings(self, query):
+        after = re.search(r'FILTER\(STR\(\?item\) > "([^"]*)"\)', query)
+        limit = re.search(r'LIMIT (\d+)', query)
+        start = bisect.bisect_right(self.items, after.group(1)) if after else 0
+        end = start + int(limit.group(1)) if limit else len(self.items)
+        rows = []
+        for item in self.items[start:end]:
+            i = int(item.rsplit('Q', 1)[1])
+            code = COUNTRY_CODES[i % len(COUNTRY_CODES)]
+            rows.append({
+                'item': {'value': item},
+                'itemLabel': {'value': f'Stub Park {i}'},
+                'itemDescription': {'value': 'national park'},
+                'image': {'value': f'{self.base_url}/img/Q{i}.jpg'},
+                'countryLabel': {'value': f'Country {code}'},
+                'countryCode': {'value': code},
+                'adminLabel': {'value': 'Region'},
+            })
+        return rows
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.counter.get_lock():
+            server.counter.value += 1
+        time.sleep(server.latency)
+        url = urlsplit(self.path)
+        if url.path == '/sparql':
+            query = parse_qs(url.query).get('query', [''])[0]
+            body = json.dumps({'results': {'bindings': server.bindings(query)}}).encode()
+            self.reply(body, 'application/sparql-results+json')
+        elif url.path.startswith('/img/'):
+            self.reply(server.jpeg, 'image/jpeg')
+        elif url.path.startswith('/flag/'):
+            self.reply(server.png, 'image/png')
+        elif url.path.startswith('/summary/'):
+            body = json.dumps({
+                'extract': 'A stub park. ' * 20,
+                'content_urls': {'desktop': {'page': f'{server.base_url}/wiki{url.path[8:]}'}},
+            }).encode()
+            self.reply(body, 'application/json')
+        else:
+            self.send_error(404)
+
+
+def serve(parks, latency, counter, port):
+    server = StubServer(parks, latency, counter)
+    port.value = server.server_address[1]
+    server.serve_forever()
+
+
+class Command(BaseCommand):
+    help = ("Run the Wikidata import against local HTTP stubs with simulated latency and report "
+            "throughput. Database writes are rolled back and files go to a temporary directory.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--parks', type=int, default=5000)
+        parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every stub response')
+        parser.add_argument('--workers', type=int, default=32)
+        parser.add_argument('--host-concurrency', type=int, default=32)
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--page-size', type=int, default=1000)
+
+    def handle(self, *args, **opts):
+        # The stubs run in their own process so they don't compete with the importer for the GIL.
+        counter, port = multiprocessing.Value('i', 0), multiprocessing.Value('i', 0)
+        server = multiprocessing.Process(target=serve, args=(opts['parks'], opts['latency'], counter, port),
+                                         daemon=True)
+        server.start()
+        while not port.value:
+            time.sleep(0.01)
+        base = f'http://127.0.0.1:{port.value}'
+
+        with tempfile.TemporaryDirectory() as media, tempfile.TemporaryDirectory() as work:
+            storages = {
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                            'OPTIONS': {'location': media}},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            }
+            with override_settings(STORAGES=storages,
+                                   WIKIDATA_SPARQL_URL=f'{base}/sparql',
+                                   WIKIPEDIA_SUMMARY_URL=f'{base}/summary/',
+                                   FLAG_CDN_URL=f'{base}/flag/{{code}}.png'):
+                importer = WikidataImporter(
+                    workers=opts['workers'],
+                    batch_size=opts['batch_size'],
+                    page_size=opts['page_size'],
+                    host_concurrency=opts['host_concurrency'],
+                    checkpoint_path=f'{work}/checkpoint.json',
+                    log=lambda message, level='info': None,
+                )
+                start = time.perf_counter()
+                with transaction.atomic():
+                    stats = importer.run(opts['parks'], resume=False)
+                    transaction.set_rollback(True)
+                elapsed = time.perf_counter() - start
+
+        server.terminate()
+        serial = counter.value * opts['latency']
+        self.stdout.write(stats.summary())
+        for line in importer.http.report():
+            self.stdout.write(line)
+        self.stdout.write(
+            f"{opts['parks']} parks, {counter.value} requests in {elapsed:.1f}s "
+            f"({opts['parks'] / elapsed:.0f} parks/s); serial latency alone would be {serial:.1f}s, "
+            f"ideal at {opts['workers']} workers {serial / opts['workers']:.1f}s"
+        )
@@ -0,0 +1,67 @@
+import contextlib
+import io
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+
+from parks import response_cache
+from parks.models import Park
+
+COUNTRIES = ['Israel', 'United States', 'Kenya', 'Canada', 'Chile', 'Japan', 'Norway', 'Australia']
+
+
+class Command(BaseCommand):
+    help = ("Time anonymous requests to the cached park endpoints: uncached, cache hit and "
+            "conditional (304). Parks are created in a transaction that is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--parks', type=int, default=2000)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def timed(self, client, url, **headers):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = client.get(url, headers=headers)
+        return (time.perf_counter() - start) * 1000, response
+
+    def handle(self, *args, **opts):
+        client = Client()
+        with transaction.atomic(), override_settings(DEBUG=False):
+            Park.objects.bulk_create(
+                [Park(name=f'Bench Park {i:06d}', description='Lorem ipsum ' * 200,
+                      country=COUNTRIES[i % len(COUNTRIES)]) for i in range(opts['parks'])],
+                batch_size=2000,
+            )
+            pk = Park.objects.order_by('id').values_list('id', flat=True).first()
+            endpoints = ['/', f'/park/{pk}/', '/api/parks/', f'/api/parks/{pk}/', '/api/parks/stats/']
+            response_cache.invalidate()
+            response_cache.reset_stats()
+
+            self.stdout.write(f"{'endpoint':<22} {'uncached ms':>12} {'hit ms':>8} {'304 ms':>8} {'bytes':>8}")
+            for url in endpoints:
+                uncached = []
+                for _ in range(min(opts['repeat'], 10)):
+                    response_cache.invalidate()
+                    elapsed, response = self.timed(client, url)
+                    uncached.append(elapsed)
+                hits = [self.timed(client, url)[0] for _ in range(opts['repeat'])]
+                etag = response['ETag']
+                revalidated = [self.timed(client, url, if_none_match=etag)[0] for _ in range(opts['repeat'])]
+                self.stdout.write(
+                    f"{url:<22} {statistics.median(uncached):>12.2f} {statistics.median(hits):>8.2f} "
+                    f"{statistics.median(revalidated):>8.2f} {len(response.content):>8}"
+                )
+            transaction.set_rollback(True)
+
+        self.stdout.write("\nPer-endpoint counters (response_cache.stats()):")
+        for endpoint, row in response_cache.stats().items():
+            self.stdout.write(
+                f"  {endpoint:<14} hit ratio {row['hit_ratio']}: {row['hit']} hits ({row['hit_ms']} ms), "
+                f"{row['miss']} misses ({row['miss_ms']} ms), {row['not_modified']} not modified "
+                f"({row['not_modified_ms']} ms)"
+            )
+        response_cache.invalidate()
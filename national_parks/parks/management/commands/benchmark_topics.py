@@ -0,0 +1,74 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from parks import topics
+from parks.trip_planner import detect_request_type
+
+PHRASES = [
+    'family with kids', 'nature walks', 'great views at sunset', 'where do we stay near the entrance',
+    'cheap hostels', 'vegetarian dinner options', 'best trails for beginners', 'tent camping spots',
+    'buses from the airport', 'romantic weekend', 'bird watching', 'winter trip with a dog',
+    'parking at the visitor center', 'two day itinerary', 'wheelchair accessible paths',
+]
+
+
+OLD_TOPICS = {
+    "hotels": ["hotel", "hotels", "accommodation", "lodging", "hostel", "airbnb", "inn"],
+    "restaurants": ["restaurant", "food", "dining", "eat"],
+    "hikes": ["hike", "trail", "walk", "trek"],
+    "camping": ["camp", "camping", "tent"],
+    "transport": ["bus", "car", "train", "transport"],
+}
+
+
+def substring_scan(user_input, keywords_by_topic=OLD_TOPICS):
+    """The previous detect_request_type: a substring scan over every keyword."""
+    if not user_input or len(user_input.strip()) == 0:
+        return "general"
+    text = user_input.lower()
+    for topic, keywords in keywords_by_topic.items():
+        if any(word in text for word in keywords):
+            return f"specific:{topic}"
+    return "general"
+
+
+class Command(BaseCommand):
+    help = "Time detect_request_type (parks.topics) against the old per-keyword substring scan"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inputs', type=int, default=5000, help='Generated user inputs per run')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--words', type=int, default=3, help='Phrases joined into each input')
+        parser.add_argument('--extra-keywords', type=int, default=0,
+                            help='Synthetic keywords added (to both) in topics checked first, '
+                                 'to show how each scales with the keyword count')
+
+    def handle(self, *args, **opts):
+        rng = random.Random(0)
+        inputs = [', '.join(rng.sample(PHRASES, opts['words'])) for _ in range(opts['inputs'])]
+        old_topics, detect = OLD_TOPICS, detect_request_type
+        if opts['extra_keywords']:
+            extra = {f'extra{i}': [f'keyword{i:05d}x{j}' for j in range(10)]
+                     for i in range(0, opts['extra_keywords'], 10)}
+            old_topics = {**extra, **OLD_TOPICS}
+            classifier = topics.TopicClassifier({**extra, **topics.DEFAULT_TOPICS})
+            detect = classifier.best
+        topics.get_classifier()  # compile outside the timed loop
+
+        self.stdout.write(f"{'implementation':<18} {'median us/call':>15} {'best us/call':>13}")
+        results = {}
+        for name, run in (('substring scan', lambda text: substring_scan(text, old_topics)), ('word table', detect)):
+            runs = []
+            for _ in range(opts['repeat']):
+                start = time.perf_counter()
+                results[name] = [run(text) for text in inputs]
+                runs.append((time.perf_counter() - start) / len(inputs) * 1_000_000)
+            self.stdout.write(f"{name:<18} {statistics.median(runs):>15.2f} {min(runs):>13.2f}")
+
+        if not opts['extra_keywords']:
+            changed = sum(old != new for old, new in zip(results['substring scan'], results['word table']))
+            self.stdout.write(f"\n{changed} of {len(inputs)} inputs classified differently "
+                              f"(word boundaries, plurals, new keywords).")
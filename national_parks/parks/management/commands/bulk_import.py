@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from parks import bulk
+
+
+class Command(BaseCommand):
+    help = "Upsert ratings or parks in batches from an NDJSON or CSV file (see parks.bulk for the columns)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['ratings', 'parks'])
+        parser.add_argument('path', help='Input file, or - for stdin')
+        parser.add_argument('--format', choices=['ndjson', 'csv'],
+                            help='Input format (default: from the file extension, else ndjson)')
+        parser.add_argument('--batch-size', type=int, default=bulk.BATCH_SIZE,
+                            help='Rows validated and written per transaction')
+        parser.add_argument('--show-errors', type=int, default=20,
+                            help='Rejected rows to print')
+
+    def handle(self, *args, **opts):
+        path = opts['path']
+        fmt = opts['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        importer = bulk.import_ratings if opts['kind'] == 'ratings' else bulk.import_parks
+        try:
+            stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        except OSError as exc:
+            raise CommandError(exc)
+        with stream:
+            result = importer(bulk.read_rows(stream, fmt), batch_size=opts['batch_size'])
+        for error in result.errors[:opts['show_errors']]:
+            details = '; '.join(f'{name}: {message}' for name, message in error['errors'].items())
+            self.stdout.write(self.style.WARNING(f"line {error['line']}: {details}"))
+        self.stdout.write(self.style.SUCCESS(result.summary()))
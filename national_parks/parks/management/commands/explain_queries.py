@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from chat.models import Message
+from parks.models import HAS_IMAGE, HAS_WEBSITE, Park, Rating, iexact
+from parks.pagination import after as keyset_after
+
+COUNTRIES = ['Israel', 'United States', 'Kenya', 'Canada', 'Chile', 'Japan', 'Norway', 'Australia']
+
+
+def hot_queries():
+    """(label, queryset, index the plan is expected to use) for each query the site runs per request."""
+    cards = Park.objects.only('id', 'name', 'country', 'image', 'image_variants').order_by('name', 'id')
+    return [
+        ('home: first page', cards[:25], 'park_name_id_idx'),
+        ('home: keyset page', cards.filter(keyset_after(('name', 'id'), ['M', 0]))[:25], 'park_name_id_idx'),
+        ('home/api: country filter', cards.filter(iexact('country', 'israel'))[:25], 'park_country_lower_name_idx'),
+        ('api: region filter', cards.filter(iexact('region', 'galilee'))[:25], 'park_region_lower_name_idx'),
+        ('api: has_image', cards.filter(HAS_IMAGE)[:25], 'park_with_image_name_idx'),
+        ('api: has_website', cards.filter(HAS_WEBSITE)[:25], 'park_with_website_name_idx'),
+        ('home: countries menu',
+         Park.objects.exclude(country='').values_list('country', flat=True).distinct().order_by('country'),
+         'park_country_region_idx'),
+        ('stats: parks per region',
+         Park.objects.exclude(region='').values('country', 'region').order_by('country', 'region').distinct(),
+         'park_country_region_idx'),
+        ('park ratings, newest first',
+         Rating.objects.filter(park_id=1).order_by('-created_at', '-id')[:20], 'rating_park_created_idx'),
+        ('all ratings, newest first', Rating.objects.order_by('-created_at', '-id')[:20], 'rating_created_idx'),
+        ('room messages, newest first',
+         Message.objects.filter(room_id=1).order_by('-timestamp', '-id')[:50], 'message_room_timestamp_idx'),
+    ]
+
+
+class Command(BaseCommand):
+    help = ("Print the EXPLAIN plan of each hot query and whether it uses the index it was built for. "
+            "With --check, exit with an error when one doesn't.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Fail if any query misses its index')
+        parser.add_argument('--parks', type=int, default=0,
+                            help='Seed this many parks first (rolled back afterwards) so the planner sees '
+                                 'realistic table sizes')
+        parser.add_argument('--quiet', action='store_true', help='Only print the summary line per query')
+
+    def handle(self, *args, **opts):
+        with transaction.atomic():
+            if opts['parks']:
+                Park.objects.bulk_create(
+                    [Park(name=f'Explain Park {i:06d}', country=COUNTRIES[i % len(COUNTRIES)],
+                          region=f'Region {i % 40}', image='parks/x.jpg' if i % 3 else '',
+                          official_website='https://example.com' if i % 2 else None)
+                     for i in range(opts['parks'])],
+                    batch_size=2000,
+                )
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+            missing = []
+            for label, queryset, index in hot_queries():
+                plan = queryset.explain()
+                ok = index in plan
+                status = self.style.SUCCESS('ok') if ok else self.style.ERROR('MISSING')
+                self.stdout.write(f"[{status}] {label} (expects {index})")
+                if not opts['quiet'] or not ok:
+                    for line in plan.splitlines():
+                        self.stdout.write(f"      {line}")
+                if not ok:
+                    missing.append(label)
+            transaction.set_rollback(True)
+
+        if missing and opts['check']:
+            raise CommandError(f"{len(missing)} queries don't use their index: {', '.join(missing)}")
+        self.stdout.write(f"{len(hot_queries()) - len(missing)} of {len(hot_queries())} queries use their index.")
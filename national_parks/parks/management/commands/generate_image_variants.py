@@ -0,0 +1,73 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from parks import images
+from parks.models import Park
+
+
+class Command(BaseCommand):
+    help = ("Build the resized AVIF/WebP/JPEG variants of park images that don't have current ones. "
+            "Decoding and encoding run in a process pool; storage reads and writes on threads.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes used for resizing/encoding (default: one per core)')
+        parser.add_argument('--io-threads', type=int, default=8,
+                            help='Threads reading originals from and writing variants to storage')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Parks per bulk_update; also bounds the originals held in memory')
+        parser.add_argument('--park', type=int, action='append', help='Only this park id (repeatable)')
+        parser.add_argument('--force', action='store_true', help='Rebuild variants that are already current')
+
+    def handle(self, *args, **opts):
+        parks = Park.objects.exclude(image='').exclude(image__isnull=True).only('id', 'image', 'image_variants')
+        if opts['park']:
+            parks = parks.filter(pk__in=opts['park'])
+        pending = [park for park in parks.order_by('id').iterator() if opts['force'] or not images.is_current(park)]
+        self.stdout.write(f"{len(pending)} park images need variants")
+
+        widths, formats = images.widths(), images.formats()
+        built = failed = 0
+        with ProcessPoolExecutor(max_workers=opts['workers']) as processes, \
+                ThreadPoolExecutor(max_workers=opts['io_threads']) as io:
+            for start in range(0, len(pending), opts['batch_size']):
+                batch = pending[start:start + opts['batch_size']]
+                renders = [
+                    (park, processes.submit(images.render_variants, data, widths, formats)
+                     if isinstance(data, bytes) else data)
+                    for park, data in zip(batch, io.map(self.read, batch))
+                ]
+
+                def save(item):
+                    park, future = item
+                    if isinstance(future, Exception):
+                        return future
+                    try:
+                        original_size, rendered = future.result()
+                        return images.store(park.image.name, original_size, rendered, park.image.storage)
+                    except Exception as e:
+                        return e
+
+                done = []
+                for (park, _), variants in zip(renders, io.map(save, renders)):
+                    if isinstance(variants, dict):
+                        park.image_variants = variants
+                        done.append(park)
+                    else:
+                        failed += 1
+                        self.stdout.write(self.style.WARNING(f"Park {park.pk} ({park.image.name}): {variants}"))
+                Park.objects.bulk_update(done, ['image_variants'])
+                built += len(done)
+                self.stdout.write(f"{start + len(batch)}/{len(pending)} processed")
+
+        self.stdout.write(self.style.SUCCESS(f"Built variants for {built} parks, {failed} failed."))
+
+    @staticmethod
+    def read(park):
+        try:
+            with park.image.open('rb') as f:
+                return f.read()
+        except Exception as e:
+            return e
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from parks import flags as flag_store
+
+
+class Command(BaseCommand):
+    help = "Delete stored flag files no country flag uses (e.g. the per-park copies left by migration 0011)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='List the files without deleting them')
+
+    def handle(self, *args, **opts):
+        names = flag_store.prune(dry_run=opts['dry_run'])
+        for name in names:
+            self.stdout.write(f"  {name}")
+        verb = "Would delete" if opts['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(names)} unused flag files."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from parks import ratings as rating_store
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized rating summaries (count, sum, histogram) from the Rating table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--park', type=int, action='append', dest='parks',
+                            help='Only rebuild the given park id (repeatable)')
+
+    def handle(self, *args, **opts):
+        written = rating_store.rebuild_summaries(opts['parks'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} rating summaries."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from parks import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the park full-text search index (FTS5 on SQLite, tsvector on Postgres)"
+
+    def handle(self, *args, **opts):
+        if search.backend() is None:
+            self.stdout.write(self.style.WARNING("This database has no search index; search uses icontains."))
+            return
+        indexed = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} parks."))
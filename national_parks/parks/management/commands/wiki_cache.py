@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from parks import wiki_cache
+from parks.models import WikiCacheEntry
+
+
+class Command(BaseCommand):
+    help = "Inspect and prune the importer's Wikipedia summary cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--show', metavar='WIKIDATA_ID', help='Print the cached entry for one item')
+        parser.add_argument('--prune', action='store_true', help='Delete expired entries')
+        parser.add_argument('--purge-negative', action='store_true',
+                            help='Delete every cached failure, expired or not, so they are looked up again')
+        parser.add_argument('--clear', action='store_true', help='Delete every entry')
+
+    def handle(self, *args, **opts):
+        if opts['show']:
+            try:
+                entry = WikiCacheEntry.objects.get(pk=opts['show'])
+            except WikiCacheEntry.DoesNotExist:
+                raise CommandError(f"No cache entry for {opts['show']}")
+            self.stdout.write(f"{entry.wikidata_id} {entry.title!r}")
+            self.stdout.write(f"  negative:   {entry.negative}")
+            self.stdout.write(f"  fetched at: {entry.fetched_at:%Y-%m-%d %H:%M}")
+            self.stdout.write(f"  expires at: {entry.expires_at:%Y-%m-%d %H:%M}")
+            self.stdout.write(f"  website:    {entry.official_website}")
+            self.stdout.write(f"  summary:    {(entry.description or '')[:200]}")
+            return
+
+        if opts['clear']:
+            self.stdout.write(f"Deleted {wiki_cache.prune(expired_only=False)} entries.")
+        else:
+            if opts['purge_negative']:
+                self.stdout.write(f"Deleted {wiki_cache.prune(negative_only=True, expired_only=False)} cached failures.")
+            if opts['prune']:
+                self.stdout.write(f"Deleted {wiki_cache.prune()} expired entries.")
+
+        stats = wiki_cache.stats()
+        self.stdout.write(
+            f"{stats['total']} entries, {stats['negative']} negative, {stats['expired']} expired "
+            f"(TTL {wiki_cache.ttl(False)}s, negative TTL {wiki_cache.ttl(True)}s)"
+        )
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def build_summaries(apps, schema_editor):
+    Rating = apps.get_model('parks', 'Rating')
+    ParkRatingSummary = apps.get_model('parks', 'ParkRatingSummary')
+    rows = (
+        Rating.objects.values('park_id')
+        .annotate(
+            count=Count('id'),
+            total=Sum('score'),
+            **{f'score_{score}': Count('id', filter=Q(score=score)) for score in range(1, 6)},
+        )
+        .order_by()
+    )
+    ParkRatingSummary.objects.bulk_create(
+        [ParkRatingSummary(average=row['total'] / row['count'], **row) for row in rows],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parks', '0005_park_flag_alter_park_description'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParkRatingSummary',
+            fields=[
+                ('park', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to='parks.park')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('average', models.FloatField(blank=True, db_index=True, null=True)),
+                ('score_1', models.PositiveIntegerField(default=0)),
+                ('score_2', models.PositiveIntegerField(default=0)),
+                ('score_3', models.PositiveIntegerField(default=0)),
+                ('score_4', models.PositiveIntegerField(default=0)),
+                ('score_5', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS parks_park_fts USING fts5("
+            "name, description, country, region, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS parks_park_fts_vocab USING fts5vocab(parks_park_fts, 'row')"
+        )
+        schema_editor.execute(
+            "INSERT INTO parks_park_fts (rowid, name, description, country, region) "
+            "SELECT id, name, description, country, region FROM parks_park"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE IF NOT EXISTS parks_park_search ("
+            "park_id bigint PRIMARY KEY REFERENCES parks_park (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS parks_park_search_document_gin ON parks_park_search USING GIN (document)"
+        )
+        schema_editor.execute(
+            "INSERT INTO parks_park_search (park_id, document) "
+            "SELECT id, "
+            "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(description, '')), 'C') || "
+            "setweight(to_tsvector('simple', coalesce(country, '')), 'B') || "
+            "setweight(to_tsvector('simple', coalesce(region, '')), 'B') "
+            "FROM parks_park"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS parks_park_fts_vocab")
+        schema_editor.execute("DROP TABLE IF EXISTS parks_park_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS parks_park_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parks', '0006_parkratingsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
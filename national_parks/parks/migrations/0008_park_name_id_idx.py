@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parks', '0007_park_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='park',
+            index=models.Index(fields=['name', 'id'], name='park_name_id_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parks', '0009_rating_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WikiCacheEntry',
+            fields=[
+                ('wikidata_id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('title', models.CharField(blank=True, max_length=300)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('official_website', models.URLField(blank=True, max_length=500, null=True)),
+                ('negative', models.BooleanField(default=False)),
+                ('fetched_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
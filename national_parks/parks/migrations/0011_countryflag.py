@@ -0,0 +1,78 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:24
+
+import hashlib
+import os
+
+import django.db.models.deletion
+import parks.models
+from django.db import migrations, models
+
+
+def flag_code(name):
+    # Flags were saved as flags/<code>.png, plus a random suffix on storages that don't overwrite.
+    return os.path.basename(name).split('.')[0].split('_')[0].lower()
+
+
+def collapse_flags(apps, schema_editor):
+    """One CountryFlag per country code, and parks point at it.
+
+    The first existing file of each country is kept under its current name so
+    nothing has to be re-uploaded. The duplicate copies are left in storage
+    (files can't be rolled back with the schema); once this has migrated,
+    ``manage.py prune_flags`` deletes them.
+    """
+    Park = apps.get_model('parks', 'Park')
+    CountryFlag = apps.get_model('parks', 'CountryFlag')
+    storage = CountryFlag._meta.get_field('image').storage
+    by_code = {}
+    for park_id, name in Park.objects.exclude(flag__isnull=True).exclude(flag='').values_list('id', 'flag'):
+        by_code.setdefault(flag_code(name), {}).setdefault(name, []).append(park_id)
+
+    for code, files in by_code.items():
+        keep = min(files)
+        try:
+            with storage.open(keep) as f:
+                sha256 = hashlib.sha256(f.read()).hexdigest()
+        except Exception:
+            sha256 = ''
+        flag = CountryFlag.objects.create(code=code, image=keep, sha256=sha256)
+        Park.objects.filter(id__in=[pk for ids in files.values() for pk in ids]).update(country_flag=flag)
+
+
+def restore_flags(apps, schema_editor):
+    Park = apps.get_model('parks', 'Park')
+    for park in Park.objects.exclude(country_flag=None).select_related('country_flag'):
+        park.flag = park.country_flag.image.name
+        park.save(update_fields=['flag'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parks', '0010_wikicacheentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountryFlag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=8, unique=True)),
+                ('image', models.ImageField(upload_to=parks.models.flag_upload_to)),
+                ('sha256', models.CharField(blank=True, db_index=True, max_length=64)),
+            ],
+            options={
+                'ordering': ['code'],
+            },
+        ),
+        migrations.AddField(
+            model_name='park',
+            name='country_flag',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='parks', to='parks.countryflag'),
+        ),
+        migrations.RunPython(collapse_flags, restore_flags),
+        migrations.RemoveField(
+            model_name='park',
+            name='flag',
+        ),
+    ]
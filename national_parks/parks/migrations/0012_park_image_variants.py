@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parks', '0011_countryflag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='park',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:30
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def clamp_scores(apps, schema_editor):
+    """Bring scores outside 1-5 into range so the constraint below can be added.
+
+    Ratings could be saved with any score through the API before it validated
+    them; the closest valid score keeps what the user meant. The summaries of
+    the parks concerned are recomputed from the fixed rows.
+    """
+    Rating = apps.get_model('parks', 'Rating')
+    ParkRatingSummary = apps.get_model('parks', 'ParkRatingSummary')
+    low, high = Rating.objects.filter(score__lt=1), Rating.objects.filter(score__gt=5)
+    park_ids = set(low.values_list('park_id', flat=True)) | set(high.values_list('park_id', flat=True))
+    if not park_ids:
+        return
+    low.update(score=1)
+    high.update(score=5)
+    rows = (
+        Rating.objects.filter(park_id__in=park_ids).values('park_id')
+        .annotate(count=Count('id'), total=Sum('score'),
+                  **{f'score_{score}': Count('id', filter=Q(score=score)) for score in range(1, 6)})
+        .order_by()
+    )
+    for row in rows:
+        park_id = row.pop('park_id')
+        ParkRatingSummary.objects.update_or_create(
+            park_id=park_id, defaults=dict(row, average=row['total'] / row['count']))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parks', '0012_park_image_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='park',
+            index=models.Index(django.db.models.functions.text.Lower('country'), models.F('name'), models.F('id'), name='park_country_lower_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='park',
+            index=models.Index(django.db.models.functions.text.Lower('region'), models.F('name'), models.F('id'), name='park_region_lower_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='park',
+            index=models.Index(fields=['country', 'region'], name='park_country_region_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='park',
+            index=models.Index(condition=models.Q(('image__gt', '')), fields=['name', 'id'], name='park_with_image_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='park',
+            index=models.Index(condition=models.Q(('official_website__gt', '')), fields=['name', 'id'], name='park_with_website_name_idx'),
+        ),
+        migrations.RunPython(clamp_scores, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rating',
+            constraint=models.CheckConstraint(condition=models.Q(('score__gte', 1), ('score__lte', 5)), name='rating_score_1_to_5'),
+        ),
+    ]
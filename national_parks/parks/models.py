@@ -1,6 +1,53 @@
+import hashlib
+import os
+
 from django.db import models
+from django.db.models import Q, Value
+from django.db.models.functions import Lower
+from django.db.models.lookups import Exact
 from django.conf import settings
 
+# Filters for the has_image/has_website API parameters. Queries must use these
+# exact conditions for the planner to pick the matching partial indexes.
+HAS_IMAGE = Q(image__gt='')
+HAS_WEBSITE = Q(official_website__gt='')
+
+
+def iexact(field, value):
+    """Case-insensitive match on ``field`` that its ``Lower()`` index can serve, unlike ``__iexact``."""
+    return Exact(Lower(field), Lower(Value(value)))
+
+
+def flag_upload_to(instance, filename):
+    ext = os.path.splitext(filename)[1].lower() or '.png'
+    return f"flags/{instance.sha256}{ext}"
+
+
+class CountryFlag(models.Model):
+    """One flag image per country code, shared by all parks in that country.
+
+    Files are named after the SHA-256 of their content, so identical images are
+    stored once; see ``parks.flags``.
+    """
+    code = models.CharField(max_length=8, unique=True)
+    image = models.ImageField(upload_to=flag_upload_to)
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+
+    class Meta:
+        ordering = ['code']
+
+    def save(self, *args, **kwargs):
+        if self.image and not self.image._committed:
+            digest = hashlib.sha256()
+            for chunk in self.image.chunks():
+                digest.update(chunk)
+            self.sha256 = digest.hexdigest()
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.code.upper()
+
+
 class Park(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
@@ -9,7 +56,25 @@ class Park(models.Model):
     region = models.CharField(max_length=100, blank=True)
     official_website = models.URLField(blank=True, null=True)
     image = models.ImageField(upload_to="parks/", blank=True, null=True)
-    flag = models.ImageField(upload_to="flags/", blank=True, null=True)
+    # Resized/re-encoded copies of ``image``, maintained by ``parks.images``.
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    country_flag = models.ForeignKey(CountryFlag, on_delete=models.SET_NULL, blank=True, null=True,
+                                     related_name='parks')
+
+    class Meta:
+        indexes = [
+            # Keyset pagination order for the home page and the API.
+            models.Index(fields=['name', 'id'], name='park_name_id_idx'),
+            # Case-insensitive country/region filters (``Lower(col) = Lower(value)``),
+            # still ordered by name so a filtered page needs no sort.
+            models.Index(Lower('country'), 'name', 'id', name='park_country_lower_name_idx'),
+            models.Index(Lower('region'), 'name', 'id', name='park_region_lower_name_idx'),
+            # Distinct countries and the per-country/region stats groupings.
+            models.Index(fields=['country', 'region'], name='park_country_region_idx'),
+            # has_image / has_website listings.
+            models.Index(fields=['name', 'id'], condition=HAS_IMAGE, name='park_with_image_name_idx'),
+            models.Index(fields=['name', 'id'], condition=HAS_WEBSITE, name='park_with_website_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -31,7 +96,63 @@ class Rating(models.Model):
 
     class Meta:
         unique_together = ('park', 'user')
+        indexes = [
+            # Keyset pagination orders: per park and global, newest first.
+            models.Index(fields=['park', 'created_at', 'id'], name='rating_park_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='rating_created_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(condition=Q(score__gte=1, score__lte=5), name='rating_score_1_to_5'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} rated {self.park.name} as {self.score}"
 
+
+
+class ParkRatingSummary(models.Model):
+    """Denormalized rating aggregates for a park, maintained by ``parks.ratings``."""
+    park = models.OneToOneField(Park, on_delete=models.CASCADE, primary_key=True, related_name='rating_summary')
+    count = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    average = models.FloatField(null=True, blank=True, db_index=True)
+    score_1 = models.PositiveIntegerField(default=0)
+    score_2 = models.PositiveIntegerField(default=0)
+    score_3 = models.PositiveIntegerField(default=0)
+    score_4 = models.PositiveIntegerField(default=0)
+    score_5 = models.PositiveIntegerField(default=0)
+
+    @property
+    def histogram(self):
+        return {score: getattr(self, f'score_{score}') for score in range(1, 6)}
+
+    def __str__(self):
+        return f"{self.park_id}: {self.average} ({self.count} ratings)"
+
+
+class WikiCacheEntry(models.Model):
+    """Cached Wikipedia summary lookup for a Wikidata item, see ``parks.wiki_cache``."""
+    wikidata_id = models.CharField(max_length=32, primary_key=True)
+    title = models.CharField(max_length=300, blank=True)
+    description = models.TextField(blank=True, null=True)
+    official_website = models.URLField(max_length=500, blank=True, null=True)
+    # True when the lookup failed or found nothing; those expire sooner.
+    negative = models.BooleanField(default=False)
+    fetched_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.wikidata_id} ({'miss' if self.negative else 'hit'})"
+
+
+class FacetCount(models.Model):
+    """Park count for one facet value over the whole table, maintained by ``parks.facets``."""
+    facet = models.CharField(max_length=32)
+    value = models.CharField(max_length=200)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('facet', 'value')
+
+    def __str__(self):
+        return f"{self.facet}={self.value}: {self.count}"
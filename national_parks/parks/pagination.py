@@ -0,0 +1,136 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def _json_default(value):
+    # Full-precision ISO timestamps; keyset comparisons must round-trip exactly.
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(values):
+    """Opaque, URL-safe token for a keyset position."""
+    raw = json.dumps(list(values), separators=(',', ':'), default=_json_default).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, size):
+    """Inverse of ``encode_cursor``; returns None for anything malformed."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def clean_position(model, fields, values):
+    """``values`` converted to the types of ``model``'s ``fields``, or None if any doesn't fit.
+
+    Cursors come from the client, so a forged one must not reach the ORM with,
+    say, a list where an integer belongs.
+    """
+    if values is None:
+        return None
+    try:
+        return [model._meta.get_field(field.lstrip('-')).to_python(value) for field, value in zip(fields, values)]
+    except (FieldDoesNotExist, ValidationError, TypeError, ValueError):
+        return None
+
+
+def after(fields, values):
+    """Q matching rows strictly after ``values`` in ``fields`` order.
+
+    ``fields`` follow ``order_by`` syntax, so ``('name', 'id')`` gives
+    ``name >= a AND (name > a OR (name = a AND id > b))``; the redundant leading
+    range keeps the condition usable as an index range scan. A leading ``-``
+    flips the comparisons.
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(fields, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    first = fields[0]
+    lookup = 'lte' if first.startswith('-') else 'gte'
+    return Q(**{f'{first.lstrip("-")}__{lookup}': values[0]}) & condition
+
+
+class KeysetPagination(BasePagination):
+    """Forward-only cursor pagination over a unique composite ordering.
+
+    Unlike offset pagination every page is one indexed range scan, so deep pages
+    cost the same as the first. Subclasses set ``ordering`` to the fields of a
+    matching index, ending in a unique column.
+    """
+    ordering = ('id',)
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = clean_position(
+            queryset.model, self.ordering,
+            decode_cursor(request.query_params.get(self.cursor_query_param), len(self.ordering)),
+        )
+        if position:
+            queryset = queryset.filter(after(self.ordering, position))
+        rows = list(queryset[:size + 1])
+        self.next_position = None
+        if len(rows) > size:
+            rows = rows[:size]
+            self.next_position = [getattr(rows[-1], field.lstrip('-')) for field in self.ordering]
+        return rows
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class ParkPagination(KeysetPagination):
+    ordering = ('name', 'id')
+
+
+class RatingPagination(KeysetPagination):
+    # Newest first.
+    ordering = ('-created_at', '-id')
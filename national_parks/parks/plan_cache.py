@@ -0,0 +1,215 @@
+"""Cache of generated trip plans, in front of ``parks.trip_planner``.
+
+Plans are keyed on the park id, the topic ``detect_request_type`` picks, a hash
+of the normalized user input and a version of the park fields the prompt uses,
+so editing a park's description retires its plans. Entries live in a
+per-process LRU (``TRIP_PLAN_CACHE_SIZE`` entries):
+
+- fresh for ``TRIP_PLAN_CACHE_TTL`` seconds: served without calling the API
+- then stale for ``TRIP_PLAN_CACHE_STALE`` more seconds: served at once while
+  one background request regenerates the plan
+
+Concurrent misses for the same key share one upstream request: the first starts
+it and every caller streams the same chunks as they arrive. The request is
+cancelled once no caller is left listening, unless it is a background refresh.
+Counts, and the API time hits saved, are in ``stats()``.
+"""
+import asyncio
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from . import trip_planner as trip_planning
+
+DEFAULT_TTL = 6 * 60 * 60
+DEFAULT_STALE = 24 * 60 * 60
+DEFAULT_SIZE = 1000
+OUTCOMES = ('hit', 'stale', 'miss', 'shared', 'error')
+
+_space_re = re.compile(r'\s+')
+_lock = threading.Lock()
+_entries = OrderedDict()
+_flights = {}
+_counts = dict.fromkeys(OUTCOMES, 0)
+_saved = {'seconds': 0.0}
+
+
+def ttl():
+    return getattr(settings, 'TRIP_PLAN_CACHE_TTL', DEFAULT_TTL)
+
+
+def stale_ttl():
+    return getattr(settings, 'TRIP_PLAN_CACHE_STALE', DEFAULT_STALE)
+
+
+def max_entries():
+    return getattr(settings, 'TRIP_PLAN_CACHE_SIZE', DEFAULT_SIZE)
+
+
+@dataclass
+class Entry:
+    text: str
+    fresh_until: float
+    stale_until: float
+    # How long generating it took, i.e. what each hit saves.
+    duration: float
+
+
+def normalize(user_input):
+    return _space_re.sub(' ', (user_input or '').strip().lower()).strip(' .!?')
+
+
+def park_version(park):
+    """Digest of the park fields that go into the prompt."""
+    return hashlib.sha256('\x00'.join([park.name, park.country, park.description or '']).encode()).hexdigest()[:12]
+
+
+def cache_key(park, user_input):
+    text = normalize(user_input)
+    topic = trip_planning.detect_request_type(text)
+    return (park.pk, topic, hashlib.sha256(text.encode()).hexdigest()[:16], park_version(park))
+
+
+def _count(outcome, saved=0.0):
+    with _lock:
+        _counts[outcome] += 1
+        _saved['seconds'] += saved
+
+
+def _get(key):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+        return entry
+
+
+def _put(key, entry):
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > max_entries():
+            _entries.popitem(last=False)
+
+
+class Flight:
+    """One upstream request whose chunks any number of callers can stream."""
+
+    def __init__(self, key, messages, background=False):
+        self.key = key
+        self.background = background
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.listeners = 0
+        self.changed = asyncio.Condition()
+        self.task = asyncio.get_running_loop().create_task(self.run(messages))
+
+    async def publish(self, chunk=None, done=False, error=None):
+        async with self.changed:
+            if chunk is not None:
+                self.chunks.append(chunk)
+            self.done, self.error = done, error
+            self.changed.notify_all()
+
+    async def run(self, messages):
+        started = time.monotonic()
+        try:
+            async for text in trip_planning.stream_chat(messages):
+                await self.publish(text)
+        except asyncio.CancelledError:
+            await self.publish(done=True, error=trip_planning.TripPlannerError('cancelled'))
+        except trip_planning.TripPlannerError as exc:
+            _count('error')
+            await self.publish(done=True, error=exc)
+        else:
+            now = time.time()
+            _put(self.key, Entry(''.join(self.chunks).strip(), now + ttl(), now + ttl() + stale_ttl(),
+                                 time.monotonic() - started))
+            await self.publish(done=True)
+        finally:
+            if _flights.get(self.key) is self:
+                del _flights[self.key]
+
+    async def listen(self):
+        self.listeners += 1
+        position = 0
+        try:
+            while True:
+                async with self.changed:
+                    await self.changed.wait_for(lambda: len(self.chunks) > position or self.done)
+                    chunks, done, error = self.chunks[position:], self.done, self.error
+                position += len(chunks)
+                for chunk in chunks:
+                    yield chunk
+                if done:
+                    if error is not None:
+                        raise trip_planning.TripPlannerError(str(error))
+                    return
+        finally:
+            self.listeners -= 1
+            if not self.listeners and not self.done and not self.background:
+                self.task.cancel()
+
+
+def _flight(key, park, user_input, background=False):
+    flight = _flights.get(key)
+    if flight is None or flight.task.get_loop() is not asyncio.get_running_loop():
+        flight = _flights[key] = Flight(key, trip_planning.build_messages(park, user_input), background)
+        return flight, False
+    return flight, True
+
+
+async def _once(text):
+    yield text
+
+
+def stream(park, user_input=''):
+    """``(outcome, chunks)``: whether the plan came from the cache, and an async iterator of its text.
+
+    Must be called from a running event loop.
+    """
+    key = cache_key(park, user_input)
+    entry = _get(key)
+    now = time.time()
+    if entry is not None and now < entry.fresh_until:
+        _count('hit', entry.duration)
+        return 'hit', _once(entry.text)
+    if entry is not None and now < entry.stale_until:
+        _count('stale', entry.duration)
+        _flight(key, park, user_input, background=True)
+        return 'stale', _once(entry.text)
+    flight, shared = _flight(key, park, user_input)
+    _count('shared' if shared else 'miss')
+    return ('shared' if shared else 'miss'), flight.listen()
+
+
+async def plan(park, user_input=''):
+    """The whole plan as one string, through the cache."""
+    _, chunks = stream(park, user_input)
+    return ''.join([text async for text in chunks]).strip()
+
+
+def stats():
+    with _lock:
+        result = dict(_counts)
+        result['entries'] = len(_entries)
+        result['saved_seconds'] = round(_saved['seconds'], 2)
+    served = result['hit'] + result['stale'] + result['shared']
+    lookups = served + result['miss']
+    result['in_flight'] = len(_flights)
+    result['hit_ratio'] = round(served / lookups, 3) if lookups else None
+    return result
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _flights.clear()
+        _counts.update(dict.fromkeys(OUTCOMES, 0))
+        _saved['seconds'] = 0.0
@@ -0,0 +1,170 @@
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Q, Sum
+from django.db.models.functions import Cast, NullIf
+
+from .models import ParkRatingSummary, Rating
+from . import facets
+from . import response_cache
+
+SCORES = range(1, 6)
+
+
+def summary_for(park):
+    """Return the park's rating summary, or an empty unsaved one if nobody rated it yet."""
+    try:
+        return park.rating_summary
+    except ParkRatingSummary.DoesNotExist:
+        return ParkRatingSummary(park=park)
+
+
+def _apply(park_id, deltas):
+    """Apply ``{score: +n/-n}`` to the park's summary with a single UPDATE.
+
+    The arithmetic happens in SQL on top of whatever is committed, so concurrent
+    raters never overwrite each other's counts. The callers hold the summary's
+    row lock, so the row read here is current and the park's rating facet can
+    be moved from its old to its new average without recounting.
+    """
+    deltas = {score: delta for score, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    count_delta = sum(deltas.values())
+    total_delta = sum(score * delta for score, delta in deltas.items())
+    updates = {f'score_{score}': F(f'score_{score}') + delta for score, delta in deltas.items()}
+    summary, _ = ParkRatingSummary.objects.get_or_create(park_id=park_id)
+    ParkRatingSummary.objects.filter(park_id=park_id).update(
+        count=F('count') + count_delta,
+        total=F('total') + total_delta,
+        average=Cast(F('total') + total_delta, FloatField()) / NullIf(F('count') + count_delta, 0),
+        **updates,
+    )
+    count = summary.count + count_delta
+    facets.rating_moved(summary.average, (summary.total + total_delta) / count if count else None)
+
+
+def _lock(park_id):
+    # Every rating write for a park goes through its summary row, so locking it
+    # serializes concurrent raters of the same park.
+    ParkRatingSummary.objects.get_or_create(park_id=park_id)
+    ParkRatingSummary.objects.select_for_update().filter(park_id=park_id).first()
+
+
+def rating_added(park_id, score):
+    _apply(park_id, {score: 1})
+
+
+def rating_removed(park_id, score):
+    _apply(park_id, {score: -1})
+
+
+def rating_changed(old_park_id, old_score, new_park_id, new_score):
+    if old_park_id == new_park_id:
+        deltas = {old_score: -1}
+        deltas[new_score] = deltas.get(new_score, 0) + 1
+        _apply(new_park_id, deltas)
+    else:
+        rating_removed(old_park_id, old_score)
+        rating_added(new_park_id, new_score)
+
+
+def save_rating(user, park, score, comment=''):
+    """Create or update ``user``'s rating of ``park``; returns ``(rating, created)``."""
+    with transaction.atomic():
+        _lock(park.pk)
+        rating = Rating.objects.select_for_update().filter(user=user, park=park).first()
+        if rating is None:
+            rating = Rating.objects.create(user=user, park=park, score=score, comment=comment)
+            rating_added(park.pk, score)
+            return rating, True
+        old_score = rating.score
+        rating.score = score
+        rating.comment = comment
+        rating.save(update_fields=['score', 'comment'])
+        rating_changed(park.pk, old_score, park.pk, score)
+        return rating, False
+
+
+def create_rating(serializer, **kwargs):
+    """Save a new rating through a DRF serializer and count it."""
+    with transaction.atomic():
+        _lock(serializer.validated_data['park'].pk)
+        rating = serializer.save(**kwargs)
+        rating_added(rating.park_id, rating.score)
+    return rating
+
+
+def update_rating(serializer, **kwargs):
+    """Save changes to an existing rating through a DRF serializer and re-count it."""
+    with transaction.atomic():
+        previous = Rating.objects.select_for_update().get(pk=serializer.instance.pk)
+        _lock(previous.park_id)
+        rating = serializer.save(**kwargs)
+        if rating.park_id != previous.park_id:
+            _lock(rating.park_id)
+        rating_changed(previous.park_id, previous.score, rating.park_id, rating.score)
+    return rating
+
+
+def delete_rating(rating):
+    with transaction.atomic():
+        _lock(rating.park_id)
+        deleted, _ = Rating.objects.filter(pk=rating.pk).delete()
+        if deleted:
+            rating_removed(rating.park_id, rating.score)
+
+
+def upsert_ratings(ratings):
+    """Create or update many ratings at once, keyed on (park, user), and re-count their parks.
+
+    One INSERT ... ON CONFLICT DO UPDATE writes the ratings; the summaries of
+    the parks involved are locked first and then rebuilt from the Rating table.
+    Returns the number of ratings written.
+    """
+    park_ids = sorted({rating.park_id for rating in ratings})
+    if not park_ids:
+        return 0
+    with transaction.atomic():
+        ParkRatingSummary.objects.bulk_create(
+            [ParkRatingSummary(park_id=park_id) for park_id in park_ids], ignore_conflicts=True,
+        )
+        list(ParkRatingSummary.objects.select_for_update().filter(park_id__in=park_ids)
+             .order_by('park_id').values_list('pk', flat=True))
+        Rating.objects.bulk_create(
+            ratings, batch_size=1000, update_conflicts=True,
+            unique_fields=['park', 'user'], update_fields=['score', 'comment'],
+        )
+        rebuild_summaries(park_ids)
+    return len(ratings)
+
+
+def rebuild_summaries(park_ids=None):
+    """Recompute summaries from the ``Rating`` table; all parks unless ``park_ids`` is given.
+
+    Returns the number of summaries written.
+    """
+    ratings = Rating.objects.all()
+    summaries = ParkRatingSummary.objects.all()
+    if park_ids is not None:
+        park_ids = list(park_ids)
+        ratings = ratings.filter(park_id__in=park_ids)
+        summaries = summaries.filter(park_id__in=park_ids)
+
+    rows = (
+        ratings.values('park_id')
+        .annotate(
+            count=Count('id'),
+            total=Sum('score'),
+            **{f'score_{score}': Count('id', filter=Q(score=score)) for score in SCORES},
+        )
+        .order_by()
+    )
+    objs = [
+        ParkRatingSummary(average=row['total'] / row['count'], **row)
+        for row in rows
+    ]
+    with transaction.atomic():
+        summaries.delete()
+        ParkRatingSummary.objects.bulk_create(objs, batch_size=1000)
+        transaction.on_commit(response_cache.invalidate)
+        transaction.on_commit(facets.refresh_ratings)
+    return len(objs)
@@ -0,0 +1,168 @@
+"""Whole-response cache for anonymous reads of the park pages and API.
+
+Entries are keyed on a global version, the path, the query parameters the view
+actually reads and (for the API) the Accept header. Any Park, Rating or flag
+write bumps the version, which orphans every entry at once; bulk writes that
+skip signals call ``invalidate()`` themselves. The version is the nanosecond
+timestamp of the last write, so it doubles as Last-Modified, and the ETag is
+derived from the key, which lets conditional requests get a 304 without
+touching the cached body.
+
+The cache is the ``RESPONSE_CACHE_ALIAS`` alias (``"responses"``), local
+memory unless configured otherwise; with several server processes use a
+shared backend so invalidations reach all of them. Hit/miss counts and
+latency per URL name are kept in the same cache, see ``stats()``.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+VERSION_KEY = 'resp:version'
+STATS_KEY = 'resp:stats:{endpoint}:{name}'
+ENDPOINTS_KEY = 'resp:endpoints'
+DEFAULT_TIMEOUT = 10 * 60
+OUTCOMES = ('hit', 'miss', 'not_modified', 'bypass')
+STORED_HEADERS = ('Content-Type', 'Content-Language', 'Allow', 'Vary')
+
+
+def _cache():
+    alias = getattr(settings, 'RESPONSE_CACHE_ALIAS', 'responses')
+    return caches[alias if alias in settings.CACHES else 'default']
+
+
+def version():
+    cache = _cache()
+    current = cache.get(VERSION_KEY)
+    if current is None:
+        current = time.time_ns()
+        if not cache.add(VERSION_KEY, current, None):
+            current = cache.get(VERSION_KEY, current)
+    return current
+
+
+def invalidate():
+    """Make every cached response stale."""
+    _cache().set(VERSION_KEY, max(time.time_ns(), version() + 1), None)
+
+
+def _count(endpoint, outcome, elapsed):
+    cache = _cache()
+    for name, value in ((outcome, 1), (f'{outcome}_us', int(elapsed * 1_000_000))):
+        key = STATS_KEY.format(endpoint=endpoint, name=name)
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            cache.add(key, 0, None)
+            cache.incr(key, value)
+    endpoints = cache.get(ENDPOINTS_KEY, set())
+    if endpoint not in endpoints:
+        cache.set(ENDPOINTS_KEY, endpoints | {endpoint}, None)
+
+
+def stats():
+    """``{endpoint: {outcome: count, outcome + '_ms': average latency, 'hit_ratio': ...}}``."""
+    cache = _cache()
+    result = {}
+    for endpoint in sorted(cache.get(ENDPOINTS_KEY, set())):
+        keys = {STATS_KEY.format(endpoint=endpoint, name=name): name
+                for outcome in OUTCOMES for name in (outcome, f'{outcome}_us')}
+        values = {keys[key]: value for key, value in cache.get_many(keys).items()}
+        row = {}
+        for outcome in OUTCOMES:
+            count = values.get(outcome, 0)
+            row[outcome] = count
+            row[f'{outcome}_ms'] = round(values.get(f'{outcome}_us', 0) / count / 1000, 2) if count else None
+        lookups = row['hit'] + row['miss'] + row['not_modified']
+        row['hit_ratio'] = round((row['hit'] + row['not_modified']) / lookups, 3) if lookups else None
+        result[endpoint] = row
+    return result
+
+
+def reset_stats():
+    cache = _cache()
+    endpoints = cache.get(ENDPOINTS_KEY, set())
+    cache.delete_many([STATS_KEY.format(endpoint=endpoint, name=name)
+                       for endpoint in endpoints for outcome in OUTCOMES
+                       for name in (outcome, f'{outcome}_us')] + [ENDPOINTS_KEY])
+
+
+def _cacheable(request):
+    return (request.method in ('GET', 'HEAD')
+            and not request.user.is_authenticated
+            and 'HTTP_AUTHORIZATION' not in request.META)
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return since is not None and since >= last_modified
+
+
+def cached_response(params=(), vary=(), timeout=DEFAULT_TIMEOUT):
+    """Cache a view's 200 responses for anonymous GETs.
+
+    ``params`` are the query parameters that change the response; others are
+    ignored so they don't split the cache. ``vary`` lists request headers that
+    do (e.g. ``Accept`` for content-negotiated API views). Use on functions or,
+    via ``method_decorator``, on ``dispatch``.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            started = time.perf_counter()
+            match = request.resolver_match
+            endpoint = match.url_name if match and match.url_name else request.path
+            if not _cacheable(request):
+                response = view(request, *args, **kwargs)
+                response['X-Cache'] = 'BYPASS'
+                _count(endpoint, 'bypass', time.perf_counter() - started)
+                return response
+
+            current = version()
+            query = sorted((name, value) for name in params for value in request.GET.getlist(name))
+            headers = [(header, request.headers.get(header, '')) for header in vary]
+            digest = hashlib.sha256(repr((request.path, query, headers)).encode()).hexdigest()[:32]
+            key = f'resp:{current}:{digest}'
+            etag = quote_etag(f'{current:x}-{digest[:16]}')
+            last_modified = current // 1_000_000_000
+
+            if _not_modified(request, etag, last_modified):
+                response = HttpResponseNotModified()
+                outcome = 'not_modified'
+            else:
+                entry = _cache().get(key)
+                if entry is not None:
+                    response = HttpResponse(entry['content'], status=entry['status'])
+                    for header, value in entry['headers'].items():
+                        response[header] = value
+                    outcome = 'hit'
+                else:
+                    response = view(request, *args, **kwargs)
+                    if hasattr(response, 'render') and callable(response.render):
+                        response = response.render()
+                    # Like Django's cache middleware, never share a response that sets cookies.
+                    if response.status_code == 200 and not response.cookies and not response.streaming:
+                        _cache().set(key, {
+                            'content': response.content,
+                            'status': response.status_code,
+                            'headers': {h: response[h] for h in STORED_HEADERS if response.has_header(h)},
+                        }, timeout)
+                    outcome = 'miss'
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+                response['Last-Modified'] = http_date(last_modified)
+                response['Cache-Control'] = 'no-cache'
+            response['X-Cache'] = outcome.upper().replace('_', '-')
+            elapsed = time.perf_counter() - started
+            response['Server-Timing'] = f'app;dur={elapsed * 1000:.1f}'
+            _count(endpoint, outcome, elapsed)
+            return response
+        return wrapped
+    return decorator
@@ -0,0 +1,189 @@
+"""Full-text search over park name, description, country and region.
+
+SQLite uses an FTS5 table (``parks_park_fts``, rowid = park id) and Postgres a
+``parks_park_search`` table holding a weighted tsvector behind a GIN index; both
+are created by migration 0007. Other backends fall back to ``icontains``.
+Query terms match as prefixes, and terms missing from the index vocabulary are
+widened with their closest indexed spellings.
+"""
+import difflib
+import re
+import time
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+
+FTS_TABLE = 'parks_park_fts'
+PG_TABLE = 'parks_park_search'
+COLUMNS = ('name', 'description', 'country', 'region')
+# bm25 weights for COLUMNS; tsvector weights A-D play the same role on Postgres.
+SQLITE_WEIGHTS = (10.0, 1.0, 4.0, 4.0)
+PG_WEIGHTS = {'name': 'A', 'description': 'C', 'country': 'B', 'region': 'B'}
+DEFAULT_LIMIT = 200
+VOCABULARY_TTL = 300
+
+_term_re = re.compile(r'\w+', re.UNICODE)
+_vocabulary = {'loaded_at': 0.0, 'terms': None}
+
+
+def backend():
+    if connection.vendor in ('sqlite', 'postgresql'):
+        return connection.vendor
+    return None
+
+
+def _chunks(ids, size=500):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def index_parks(park_ids):
+    """(Re)index the given parks from their current rows."""
+    vendor = backend()
+    if vendor is None:
+        return
+    with connection.cursor() as cursor:
+        for chunk in _chunks(park_ids):
+            placeholders = ', '.join(['%s'] * len(chunk))
+            if vendor == 'sqlite':
+                cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', chunk)
+                cursor.execute(
+                    f'INSERT INTO {FTS_TABLE} (rowid, name, description, country, region) '
+                    f'SELECT id, name, description, country, region FROM parks_park WHERE id IN ({placeholders})',
+                    chunk,
+                )
+            else:
+                document = ' || '.join(
+                    f"setweight(to_tsvector('simple', coalesce({column}, '')), '{weight}')"
+                    for column, weight in PG_WEIGHTS.items()
+                )
+                cursor.execute(
+                    f'INSERT INTO {PG_TABLE} (park_id, document) '
+                    f'SELECT id, {document} FROM parks_park WHERE id IN ({placeholders}) '
+                    f'ON CONFLICT (park_id) DO UPDATE SET document = EXCLUDED.document',
+                    chunk,
+                )
+    _vocabulary['terms'] = None
+
+
+def remove_parks(park_ids):
+    vendor = backend()
+    if vendor is None:
+        return
+    table, key = (FTS_TABLE, 'rowid') if vendor == 'sqlite' else (PG_TABLE, 'park_id')
+    with connection.cursor() as cursor:
+        for chunk in _chunks(park_ids):
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'DELETE FROM {table} WHERE {key} IN ({placeholders})', chunk)
+    _vocabulary['terms'] = None
+
+
+def rebuild():
+    """Drop every index entry and re-index all parks; returns the number indexed."""
+    from .models import Park
+
+    vendor = backend()
+    if vendor is None:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE if vendor == "sqlite" else PG_TABLE}')
+    ids = list(Park.objects.values_list('id', flat=True))
+    index_parks(ids)
+    return len(ids)
+
+
+def _load_vocabulary():
+    if _vocabulary['terms'] is not None and time.monotonic() - _vocabulary['loaded_at'] < VOCABULARY_TTL:
+        return _vocabulary['terms']
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            cursor.execute(f'SELECT term FROM {FTS_TABLE}_vocab')
+        else:
+            cursor.execute('SELECT word FROM ts_stat(%s)', [f'SELECT document FROM {PG_TABLE}'])
+        terms = {}
+        for (term,) in cursor.fetchall():
+            terms.setdefault(term[:1], []).append(term)
+    _vocabulary.update(terms=terms, loaded_at=time.monotonic())
+    return terms
+
+
+def _expand(term):
+    """The term itself plus close spellings from the index when it isn't indexed verbatim."""
+    candidates = _load_vocabulary().get(term[:1], [])
+    if len(term) < 4 or any(word.startswith(term) for word in candidates):
+        return [term]
+    return [term] + difflib.get_close_matches(term, candidates, n=3, cutoff=0.75)
+
+
+def _sqlite_match(terms, columns):
+    groups = []
+    for term in terms:
+        options = ' OR '.join(f'"{variant}"*' for variant in _expand(term))
+        groups.append(f'({options})')
+    match = ' AND '.join(groups)
+    if columns:
+        match = '{%s} : (%s)' % (' '.join(columns), match)
+    return match
+
+
+def _pg_tsquery(terms, columns):
+    weights = ''.join(sorted({PG_WEIGHTS[column] for column in columns})) if columns else ''
+    groups = []
+    for term in terms:
+        options = ' | '.join(f"'{variant}':*{weights}" for variant in _expand(term))
+        groups.append(f'({options})')
+    return ' & '.join(groups)
+
+
+def search(query, columns=None, limit=DEFAULT_LIMIT, within=None):
+    """Return park ids matching ``query``, best match first.
+
+    ``columns`` restricts matching to a subset of ``COLUMNS``; ``limit=None``
+    returns every match. ``within`` is a Park queryset the matches must belong
+    to, applied before ranking and ``limit``.
+    """
+    terms = [term.lower() for term in _term_re.findall(query or '')]
+    vendor = backend()
+    if not terms or vendor is None:
+        return []
+    limit_clause = f'LIMIT {int(limit)}' if limit is not None else ''
+    within_clause, within_params = '', []
+    if within is not None:
+        sql, within_params = within.order_by().values('pk').query.sql_with_params()
+        within_clause = f'AND {"rowid" if vendor == "sqlite" else "park_id"} IN ({sql})'
+    with connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            weights = ', '.join(str(weight) for weight in SQLITE_WEIGHTS)
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s {within_clause} '
+                f'ORDER BY bm25({FTS_TABLE}, {weights}) {limit_clause}',
+                [_sqlite_match(terms, columns), *within_params],
+            )
+        else:
+            cursor.execute(
+                f"SELECT park_id FROM {PG_TABLE}, to_tsquery('simple', %s) query "
+                f'WHERE document @@ query {within_clause} ORDER BY ts_rank_cd(document, query) DESC {limit_clause}',
+                [_pg_tsquery(terms, columns), *within_params],
+            )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def filter_queryset(queryset, query, columns=None, limit=DEFAULT_LIMIT):
+    """Restrict ``queryset`` to the parks matching ``query``, best match first.
+
+    The queryset's own filters are applied inside the search, so ``limit``
+    counts only parks that pass them.
+    """
+    if backend() is None:
+        columns = columns or COLUMNS
+        condition = Q()
+        for column in columns:
+            condition |= Q(**{f'{column}__icontains': query})
+        return queryset.filter(condition)
+    ids = search(query, columns=columns, limit=limit, within=queryset if queryset.query.where else None)
+    if not ids:
+        return queryset.none()
+    rank = Case(*[When(pk=pk, then=Value(position)) for position, pk in enumerate(ids)],
+                output_field=IntegerField())
+    return queryset.filter(pk__in=ids).annotate(search_rank=rank).order_by('search_rank')
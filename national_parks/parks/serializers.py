@@ -1,5 +1,8 @@
+from django.core.validators import MaxValueValidator, MinValueValidator
 from rest_framework import serializers
 from .models import Park, Rating
+from . import images
+from .ratings import summary_for
 
 
 class RatingSerializer(serializers.ModelSerializer):
@@ -9,23 +12,49 @@ class RatingSerializer(serializers.ModelSerializer):
         model = Rating
         fields = ['id', 'park', 'user', 'user_username', 'score', 'comment', 'created_at']
         read_only_fields = ['user']
+        # Same range as rate_park; parks.ratings keeps one summary column per score.
+        extra_kwargs = {'score': {'validators': [MinValueValidator(1), MaxValueValidator(5)]}}
 
 
 class ParkSerializer(serializers.ModelSerializer):
+    """Park representation; pass ``fields=[...]`` to render a sparse fieldset.
+
+    ``average_rating``/``ratings_count`` come from the ``avg_rating``/``num_ratings``
+    annotations when the queryset provides them (see ``ParkViewSet``).
+    """
     image = serializers.ImageField(use_url=True, required=False, allow_null=True)
+    image_variants = serializers.SerializerMethodField()
     average_rating = serializers.SerializerMethodField()
     ratings_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Park
-        fields = ['id', 'name', 'description', 'location', 'country', 'region', 'official_website', 'image', 'average_rating', 'ratings_count']
+        fields = ['id', 'name', 'description', 'location', 'country', 'region', 'official_website', 'image', 'image_variants', 'average_rating', 'ratings_count']
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def get_image_variants(self, obj):
+        """srcset candidates per format, e.g. ``{"webp": [{"url": ..., "width": 320, "height": 213}]}``."""
+        if not obj.image or not images.is_current(obj):
+            return {}
+        storage = obj.image.storage
+        return {
+            fmt: [{'url': storage.url(v['name']), 'width': v['width'], 'height': v['height']} for v in variants]
+            for fmt, variants in obj.image_variants.get('formats', {}).items()
+        }
 
     def get_average_rating(self, obj):
-        ratings_qs = obj.ratings.all()
-        if not ratings_qs.exists():
-            return None
-        avg = sum(r.score for r in ratings_qs) / ratings_qs.count()
-        return round(avg, 2)
+        if hasattr(obj, 'avg_rating'):
+            average = obj.avg_rating
+        else:
+            average = summary_for(obj).average
+        return round(average, 2) if average is not None else None
 
     def get_ratings_count(self, obj):
-        return obj.ratings.count() 
\ No newline at end of file
+        if hasattr(obj, 'num_ratings'):
+            return obj.num_ratings
+        return summary_for(obj).count
@@ -0,0 +1,107 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import CountryFlag, Park, Rating
+from . import facets
+from . import images
+from . import ratings as rating_store
+from . import response_cache
+from . import search
+from .caching import invalidate_countries
+
+logger = logging.getLogger(__name__)
+
+SEARCH_FIELDS = set(search.COLUMNS)
+FACET_FIELDS = {'country', 'region', 'image', 'official_website'}
+
+
+@receiver(post_save, sender=Park)
+def index_park(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields is not None and not SEARCH_FIELDS & set(update_fields)):
+        return
+    search.index_parks([instance.pk])
+
+
+@receiver(post_delete, sender=Park)
+def unindex_park(sender, instance, **kwargs):
+    search.remove_parks([instance.pk])
+
+
+@receiver(post_save, sender=Park)
+@receiver(post_delete, sender=Park)
+def invalidate_park_caches(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'country' in update_fields:
+        invalidate_countries()
+
+
+@receiver(post_save, sender=Park)
+def build_image_variants(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields is not None and 'image' not in update_fields):
+        return
+    if not images.is_current(instance):
+        # A bad image mustn't fail the save; park_picture falls back to the
+        # original and generate_image_variants can retry later.
+        try:
+            images.generate(instance)
+        except Exception:
+            logger.exception('Could not build image variants for park %s', instance.pk)
+
+
+@receiver(post_save, sender=Park)
+@receiver(post_delete, sender=Park)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+@receiver(post_save, sender=CountryFlag)
+@receiver(post_delete, sender=CountryFlag)
+def invalidate_responses(sender, raw=False, **kwargs):
+    # After commit, so a request can't cache the old rows under the new version.
+    if not raw:
+        transaction.on_commit(response_cache.invalidate)
+
+
+@receiver(pre_save, sender=Park)
+def remember_facet_values(sender, instance, update_fields=None, raw=False, **kwargs):
+    instance._facet_values = None
+    if raw or (update_fields is not None and not FACET_FIELDS & set(update_fields)):
+        return
+    old = Park.objects.filter(pk=instance.pk).only(*FACET_FIELDS).first() if instance.pk else None
+    instance._facet_values = facets.facet_values(old) if old else set()
+
+
+@receiver(post_save, sender=Park)
+def update_facets(sender, instance, created=False, **kwargs):
+    old = getattr(instance, '_facet_values', None)
+    if old is not None:
+        new = facets.facet_values(instance)
+        if created:
+            new.add(facets.UNRATED)
+        facets.park_changed(old, new)
+
+
+@receiver(pre_delete, sender=Park)
+def remember_rating_bucket(sender, instance, **kwargs):
+    # The summary goes by cascade before post_delete.
+    instance._rating_bucket = facets.rating_bucket(rating_store.summary_for(instance).average)
+
+
+@receiver(post_delete, sender=Park)
+def remove_from_facets(sender, instance, **kwargs):
+    bucket = getattr(instance, '_rating_bucket', facets.UNRATED[1])
+    facets.park_changed(facets.facet_values(instance) | {('rating', bucket)}, set())
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def remember_rated_parks(sender, instance, **kwargs):
+    instance._rated_park_ids = list(Rating.objects.filter(user=instance).values_list('park_id', flat=True))
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def recount_rated_parks(sender, instance, **kwargs):
+    # The user's ratings went with it by cascade, around parks.ratings.
+    park_ids = getattr(instance, '_rated_park_ids', None)
+    if park_ids:
+        rating_store.rebuild_summaries(park_ids)
@@ -0,0 +1,69 @@
+"""Aggregate park statistics for ``/api/parks/stats/``.
+
+Four queries whatever the table size: the totals and rating histogram in one
+aggregate, then the per-country counts, the per-region counts and the top
+rated parks. The result is cached under the response-cache version, so any
+park or rating write (see ``parks.response_cache``) recomputes it.
+"""
+from django.core.cache import cache
+from django.db.models import Count, Sum
+
+from .models import HAS_IMAGE, HAS_WEBSITE, Park, ParkRatingSummary
+from . import response_cache
+
+STATS_KEY = 'parks:stats:{version}'
+STATS_TIMEOUT = 60 * 60
+TOP_RATED = 10
+# Parks need this many ratings to appear among the top rated.
+TOP_RATED_MIN_RATINGS = 3
+SCORES = range(1, 6)
+
+
+def _percentage(part, whole):
+    return round(part / whole * 100, 1) if whole else 0
+
+
+def compute():
+    totals = Park.objects.aggregate(
+        total_parks=Count('id'),
+        parks_with_images=Count('id', filter=HAS_IMAGE),
+        parks_with_websites=Count('id', filter=HAS_WEBSITE),
+        total_ratings=Sum('rating_summary__count', default=0),
+        score_total=Sum('rating_summary__total', default=0),
+        **{f'score_{score}': Sum(f'rating_summary__score_{score}', default=0) for score in SCORES},
+    )
+    by_country = (
+        Park.objects.exclude(country='').values('country')
+        .annotate(parks=Count('id')).order_by('-parks', 'country')
+    )
+    by_region = (
+        Park.objects.exclude(region='').values('country', 'region')
+        .annotate(parks=Count('id')).order_by('-parks', 'country', 'region')
+    )
+    top_rated = (
+        ParkRatingSummary.objects.filter(count__gte=TOP_RATED_MIN_RATINGS)
+        .select_related('park').only('park__name', 'park__country', 'average', 'count')
+        .order_by('-average', '-count', 'park_id')[:TOP_RATED]
+    )
+    total_parks, total_ratings = totals['total_parks'], totals['total_ratings']
+    return {
+        'total_parks': total_parks,
+        'parks_with_images': totals['parks_with_images'],
+        'parks_with_websites': totals['parks_with_websites'],
+        'total_ratings': total_ratings,
+        'image_percentage': _percentage(totals['parks_with_images'], total_parks),
+        'website_percentage': _percentage(totals['parks_with_websites'], total_parks),
+        'average_rating': round(totals['score_total'] / total_ratings, 2) if total_ratings else None,
+        'rating_histogram': {score: totals[f'score_{score}'] for score in SCORES},
+        'by_country': list(by_country),
+        'by_region': list(by_region),
+        'top_rated': [
+            {'id': summary.park_id, 'name': summary.park.name, 'country': summary.park.country,
+             'average_rating': round(summary.average, 2), 'ratings_count': summary.count}
+            for summary in top_rated
+        ],
+    }
+
+
+def park_stats():
+    return cache.get_or_set(STATS_KEY.format(version=response_cache.version()), compute, STATS_TIMEOUT)
@@ -0,0 +1,25 @@
+from django import template
+
+from parks import images
+
+register = template.Library()
+
+
+@register.inclusion_tag('parks/_picture.html')
+def park_picture(park, sizes='100vw', css_class='', loading='lazy'):
+    """``<picture>`` for ``park.image`` with a srcset per variant format, falling back to the original."""
+    fallback = images.formats()[-1]
+    # Variants of a previous image (not rebuilt yet) would show the wrong picture.
+    current = bool(park.image_variants) and images.is_current(park)
+    sources = [
+        {'type': images.CONTENT_TYPES[fmt], 'srcset': images.srcset(park, fmt)}
+        for fmt in images.formats()[:-1]
+    ] if current else []
+    return {
+        'park': park,
+        'sources': [source for source in sources if source['srcset']],
+        'srcset': images.srcset(park, fallback) if current else '',
+        'sizes': sizes,
+        'css_class': css_class,
+        'loading': loading,
+    }
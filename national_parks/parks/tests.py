@@ -1,3 +1,847 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from urllib.parse import parse_qs, unquote, urlsplit
 
-# Create your tests here.
+import requests
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.template import Context, Template
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .caching import get_countries
+from .importer import Checkpoint, WikidataImporter, iter_bindings
+from .models import CountryFlag, Park, ParkIdentifier, ParkRatingSummary, Rating, iexact
+from .pagination import encode_cursor
+from .http_client import HttpClient
+from . import facets
+from . import images
+from . import flags as flag_store
+from . import plan_cache
+from . import search as park_search
+from . import ratings as rating_store
+from . import topics
+from . import trip_planner as trip_planning
+
+
+class ParkApiQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        users = [User.objects.create_user(f'user{i}', password='pw') for i in range(3)]
+        cls.parks = [
+            Park.objects.create(name=f'Park {i}', description='x' * 1000, country='Israel')
+            for i in range(15)
+        ]
+        for park in cls.parks[:10]:
+            for score, user in enumerate(users, start=3):
+                rating_store.save_rating(user, park, score)
+
+    def setUp(self):
+        caches['responses'].clear()
+        self.client = APIClient()
+
+    def test_list_query_count_is_constant(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/parks/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 15)
+        first = response.data['results'][0]
+        self.assertNotIn('description', first)
+        self.assertEqual(first['average_rating'], 4.0)
+        self.assertEqual(first['ratings_count'], 3)
+
+    def test_list_sparse_fieldset(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/parks/', {'fields': 'name,description'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name', 'description'})
+
+    def test_list_keyset_pages(self):
+        names = []
+        url = '/api/parks/?page_size=4'
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            names += [park['name'] for park in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(names, sorted(park.name for park in self.parks))
+
+    def test_malformed_cursor_is_ignored(self):
+        first_page = self.client.get('/api/parks/', {'page_size': 4}).data['results']
+        for values in ([['a'], {'b': 1}], ['Park 1', 'not an id'], ['Park 1']):
+            response = self.client.get('/api/parks/', {'page_size': 4, 'cursor': encode_cursor(values)})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['results'], first_page)
+        response = self.client.get('/api/ratings/', {'cursor': encode_cursor(['yesterday', 1])})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 20)
+
+    def test_detail_query_count(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/parks/{self.parks[0].pk}/')
+        self.assertEqual(response.data['description'], 'x' * 1000)
+        self.assertEqual(response.data['ratings_count'], 3)
+
+    def test_stats_query_count(self):
+        caches['default'].clear()
+        self.client.force_login(get_user_model().objects.get(username='user0'))
+        with self.assertNumQueries(4 + 2):  # plus session and user lookups
+            response = self.client.get('/api/parks/stats/')
+        self.assertEqual(response.data['total_parks'], 15)
+        self.assertEqual(response.data['total_ratings'], 30)
+        self.assertEqual(response.data['rating_histogram'], {1: 0, 2: 0, 3: 10, 4: 10, 5: 10})
+        self.assertEqual(response.data['by_country'], [{'country': 'Israel', 'parks': 15}])
+        self.assertEqual(len(response.data['top_rated']), 10)
+        with self.assertNumQueries(2):
+            self.client.get('/api/parks/stats/')
+
+    def test_ratings_query_count(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/parks/{self.parks[0].pk}/ratings/')
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIn(response.data['results'][0]['user_username'], {'user0', 'user1', 'user2'})
+
+
+class RatingSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [User.objects.create_user(f'rater{i}', password='pw') for i in range(2)]
+        cls.park = Park.objects.create(name='Rated Park', country='Kenya')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_login(self.users[0])
+
+    def summary(self):
+        summary = rating_store.summary_for(Park.objects.get(pk=self.park.pk))
+        return summary.count, summary.total, summary.histogram
+
+    def test_api_create_update_and_delete_keep_the_summary(self):
+        response = self.client.post('/api/ratings/', {'park': self.park.pk, 'score': 4})
+        self.assertEqual(response.status_code, 201)
+        rating_store.save_rating(self.users[1], self.park, 2)
+        self.assertEqual(self.summary(), (2, 6, {1: 0, 2: 1, 3: 0, 4: 1, 5: 0}))
+
+        response = self.client.patch(f"/api/ratings/{response.data['id']}/", {'score': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.summary(), (2, 7, {1: 0, 2: 1, 3: 0, 4: 0, 5: 1}))
+
+        self.assertEqual(self.client.delete(f"/api/ratings/{response.data['id']}/").status_code, 204)
+        self.assertEqual(self.summary(), (1, 2, {1: 0, 2: 1, 3: 0, 4: 0, 5: 0}))
+
+    def test_out_of_range_score_is_rejected(self):
+        for score in (0, 9):
+            response = self.client.post('/api/ratings/', {'park': self.park.pk, 'score': score})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('score', response.data)
+        self.assertFalse(Rating.objects.exists())
+
+    def test_deleting_a_user_recounts_their_parks(self):
+        for user, score in zip(self.users, (5, 3)):
+            rating_store.save_rating(user, self.park, score)
+        self.users[1].delete()
+        self.assertEqual(self.summary(), (1, 5, {1: 0, 2: 0, 3: 0, 4: 0, 5: 1}))
+
+    def test_rebuild_command_repairs_summaries(self):
+        rating_store.save_rating(self.users[0], self.park, 3)
+        ParkRatingSummary.objects.filter(park=self.park).update(count=7, total=1, score_3=0)
+        call_command('rebuild_rating_summaries', stdout=StringIO())
+        self.assertEqual(self.summary(), (1, 3, {1: 0, 2: 0, 3: 1, 4: 0, 5: 0}))
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.canyon = Park.objects.create(name='Grand Canyon', country='United States',
+                                         description='A mile-deep gorge carved by the Colorado River.')
+        cls.yellowstone = Park.objects.create(name='Yellowstone', country='United States', region='Wyoming',
+                                              description='Geysers, hot springs and a canyon of its own.')
+        cls.kruger = Park.objects.create(name='Kruger', country='South Africa', description='Big five safaris.')
+
+    def setUp(self):
+        caches['responses'].clear()
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(park_search.search('canyon'), [self.canyon.pk, self.yellowstone.pk])
+
+    def test_terms_match_as_prefixes(self):
+        self.assertEqual(park_search.search('yellow'), [self.yellowstone.pk])
+        self.assertEqual(park_search.search('gey spr'), [self.yellowstone.pk])
+
+    def test_misspelled_terms_are_widened(self):
+        self.assertEqual(park_search.search('yelowstone'), [self.yellowstone.pk])
+        self.assertEqual(park_search.search('safaries'), [self.kruger.pk])
+
+    def test_columns_restrict_matching(self):
+        self.assertEqual(park_search.search('canyon', columns=('name',)), [self.canyon.pk])
+
+    def test_search_endpoint(self):
+        response = self.client.get('/api/parks/search/', {'q': 'canyon'})
+        self.assertEqual([park['name'] for park in response.json()], ['Grand Canyon', 'Yellowstone'])
+        self.assertEqual(self.client.get('/api/parks/search/', {'q': 'canyon', 'limit': 1}).json()[0]['name'],
+                         'Grand Canyon')
+        self.assertEqual(self.client.get('/api/parks/search/').status_code, 400)
+        self.assertEqual(self.client.get('/api/parks/search/', {'q': 'x', 'limit': 'many'}).status_code, 400)
+
+    def test_search_limit_is_clamped(self):
+        for limit in (-1, 0):
+            response = self.client.get('/api/parks/search/', {'q': 'canyon', 'limit': limit})
+            self.assertEqual([park['name'] for park in response.json()], ['Grand Canyon'])
+        response = self.client.get('/api/parks/search/', {'q': 'canyon', 'limit': 10_000})
+        self.assertEqual(len(response.json()), 2)
+
+    def test_name_filter_matches_substrings(self):
+        response = self.client.get('/api/parks/', {'name': 'ellowst'})
+        self.assertEqual([park['name'] for park in response.data['results']], ['Yellowstone'])
+
+    def test_rebuild_command_restores_the_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {park_search.FTS_TABLE}')
+        park_search.index_parks([])  # forget the cached vocabulary
+        self.assertEqual(park_search.search('kruger'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 3 parks', out.getvalue())
+        self.assertEqual(park_search.search('kruger'), [self.kruger.pk])
+
+
+class HomeViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(30):
+            Park.objects.create(name=f'Home Park {i:02d}', country='Kenya' if i % 3 else 'Chile')
+
+    def setUp(self):
+        caches['responses'].clear()
+        caches['default'].clear()
+
+    def names(self, response):
+        return [park.name for park in response.context['parks']]
+
+    def test_keyset_pages_follow_next_url(self):
+        response = self.client.get('/')
+        self.assertEqual(self.names(response), [f'Home Park {i:02d}' for i in range(24)])
+        response = self.client.get('/' + response.context['next_url'])
+        self.assertEqual(self.names(response), [f'Home Park {i:02d}' for i in range(24, 30)])
+        self.assertNotIn('next_url', response.context)
+
+    def test_search_results_page_by_offset(self):
+        response = self.client.get('/', {'q': 'home park'})
+        self.assertEqual(len(response.context['parks']), 24)
+        second = self.client.get('/' + response.context['next_url'])
+        self.assertEqual(len(second.context['parks']), 6)
+        self.assertFalse(set(self.names(response)) & set(self.names(second)))
+
+    def test_country_filter_applies_before_the_search_limit(self):
+        chile = Park.objects.filter(iexact('country', 'chile'))
+        self.assertEqual(park_search.filter_queryset(chile, 'home park', limit=5).count(), 5)
+        response = self.client.get('/', {'q': 'home park', 'country': 'chile'})
+        self.assertEqual(len(response.context['parks']), 10)
+        self.assertContains(response, f'Showing the {park_search.DEFAULT_LIMIT} best matches at most.')
+
+    def test_benchmark_compares_deep_pages_with_the_first(self):
+        out = StringIO()
+        call_command('benchmark_home', '--sizes', '60', '--repeat', '1', '--max-ratio', '1000', stdout=out)
+        self.assertIn('ratio', out.getvalue())
+        with self.assertRaisesMessage(CommandError, 'slower than the first page at 60 parks'):
+            call_command('benchmark_home', '--sizes', '60', '--repeat', '1', '--max-ratio', '0', stdout=StringIO())
+        self.assertEqual(Park.objects.count(), 30)
+
+    def test_fragment_renders_only_the_cards(self):
+        response = self.client.get('/', {'country': 'chile', 'fragment': '1'})
+        self.assertTemplateUsed(response, 'parks/_park_cards.html')
+        self.assertTemplateNotUsed(response, 'home.html')
+        self.assertEqual(len(response.context['parks']), 10)
+
+    def test_malformed_cursors_serve_the_first_page(self):
+        for params in ({'after': encode_cursor([[1], {'id': 2}])}, {'after': encode_cursor(['Home Park 03', 'x'])},
+                       {'after': 'not a cursor'}, {'q': 'home', 'after': encode_cursor([-5])}):
+            response = self.client.get('/', params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['parks']), 24)
+            if 'q' not in params:
+                self.assertEqual(self.names(response)[0], 'Home Park 00')
+
+    def test_countries_are_cached_until_a_park_changes(self):
+        self.assertEqual(get_countries(), ['Chile', 'Kenya'])
+        with self.assertNumQueries(0):
+            get_countries()
+        with self.captureOnCommitCallbacks(execute=True):
+            Park.objects.create(name='Torres del Paine', country='Argentina')
+        self.assertEqual(get_countries(), ['Argentina', 'Chile', 'Kenya'])
+
+
+class ResponseCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.park = Park.objects.create(name='Cached Park', country='Kenya')
+
+    def setUp(self):
+        caches['responses'].clear()
+
+    def test_second_anonymous_request_is_served_from_cache(self):
+        first = self.client.get('/api/parks/', {'utm_source': 'a'})
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/parks/', {'utm_source': 'b'})
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.client.get('/api/parks/', {'country': 'Kenya'})['X-Cache'], 'MISS')
+
+    def test_conditional_request_gets_304(self):
+        first = self.client.get(f'/park/{self.park.pk}/')
+        self.assertEqual(first.status_code, 200)
+        response = self.client.get(f'/park/{self.park.pk}/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['X-Cache'], 'NOT-MODIFIED')
+
+    def test_park_write_invalidates(self):
+        first = self.client.get(f'/api/parks/{self.park.pk}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.park.name = 'Renamed Park'
+            self.park.save()
+        response = self.client.get(f'/api/parks/{self.park.pk}/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['name'], 'Renamed Park')
+
+    def test_authenticated_requests_bypass_cache(self):
+        user = get_user_model().objects.create_user('rater', password='pw')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/')['X-Cache'], 'BYPASS')
+
+
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('facets', password='pw')
+        for i in range(6):
+            Park.objects.create(name=f'Facet Park {i}', country='Israel' if i % 2 else 'Kenya',
+                                region=f'Region {i % 3}',
+                                official_website='https://example.com' if i < 2 else None)
+
+    def setUp(self):
+        caches['responses'].clear()
+
+    def test_filtered_facets_query_count(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/parks/facets/', {'country': 'israel'})
+        self.assertEqual(response.data['total'], 3)
+        self.assertEqual(response.data['country'], [{'value': 'Israel', 'count': 3}])
+        self.assertEqual(response.data['has_website'], [{'value': 'true', 'count': 1}, {'value': 'false', 'count': 2}])
+
+    def test_facet_limit_is_clamped(self):
+        for facet_limit, regions in (('-5', 1), ('0', 1), ('many', 3), ('10000', 3)):
+            response = self.client.get('/api/parks/facets/', {'country': 'kenya', 'facet_limit': facet_limit})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['region']), regions)
+
+    def test_materialized_counts_follow_writes(self):
+        facets.rebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            park = Park.objects.create(name='New Park', country='Chile', region='Patagonia')
+        with self.captureOnCommitCallbacks(execute=True):
+            park.country = 'Israel'
+            park.official_website = 'https://example.org'
+            park.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            rating_store.save_rating(self.user, park, 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            Park.objects.get(name='Facet Park 0').delete()
+        expected = facets.compute(Park.objects.all(), limit=None)
+        self.assertEqual(facets.materialized(limit=None), expected)
+        self.assertEqual(expected['rating'][0], {'value': '4-5', 'count': 1})
+        self.assertNotIn('Chile', [row['value'] for row in expected['country']])
+
+    def test_rating_writes_move_buckets_without_recounting(self):
+        facets.rebuild()
+        park = Park.objects.get(name='Facet Park 2')
+        other = get_user_model().objects.create_user('facets2', password='pw')
+        with CaptureQueriesContext(connection) as queries:
+            rating_store.save_rating(self.user, park, 5)
+            rating_store.save_rating(other, park, 2)
+            rating_store.delete_rating(park.ratings.get(user=other))
+        self.assertFalse([query['sql'] for query in queries if 'COUNT(' in query['sql']])
+        rated = Park.objects.get(name='Facet Park 3')
+        rating_store.save_rating(self.user, rated, 3)
+        rated.delete()
+        expected = facets.compute(Park.objects.all(), limit=None)
+        self.assertEqual(facets.materialized(limit=None), expected)
+        self.assertEqual(expected['rating'][0], {'value': '4-5', 'count': 1})
+
+    def test_park_change_only_prunes_the_values_it_left(self):
+        facets.rebuild()
+        park = Park.objects.get(name='Facet Park 1')
+        values = facets.facet_values(park)
+        with self.assertNumQueries(1):
+            facets.park_changed(values, values)
+        moved = (values - {('region', 'Region 1')}) | {('region', 'Region 9')}
+        with CaptureQueriesContext(connection) as queries:
+            facets.park_changed(values, moved)
+        deletes = [query['sql'] for query in queries if query['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 1)
+        self.assertIn("'Region 1'", deletes[0])
+        regions = {row['value']: row['count'] for row in facets.materialized(limit=None)['region']}
+        self.assertEqual(regions, {'Region 0': 2, 'Region 1': 1, 'Region 2': 2, 'Region 9': 1})
+
+
+class BulkImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.admin = User.objects.create_superuser('bulkadmin', password='pw')
+        cls.users = [User.objects.create_user(f'partner{i}', password='pw') for i in range(2)]
+        cls.park = Park.objects.create(name='Bulk Park', country='Kenya')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_login(self.admin)
+
+    def test_rating_upsert_reports_bad_rows(self):
+        rating_store.save_rating(self.users[0], self.park, 1)
+        body = '\n'.join([
+            f'{{"park": {self.park.pk}, "user": {self.users[0].pk}, "score": 5}}',
+            f'{{"park": {self.park.pk}, "username": "partner1", "score": "4", "comment": "nice"}}',
+            f'{{"park": {self.park.pk}, "username": "nobody", "score": 9}}',
+            '{"park": 999999, "user": 1, "score": 3}',
+            'not json',
+        ])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/ratings/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['rows'], response.data['written'], response.data['failed']), (5, 2, 3))
+        self.assertEqual([error['line'] for error in response.data['errors']], [5, 3, 4])
+        self.assertEqual(set(response.data['errors'][1]['errors']), {'score', 'user'})
+        summary = rating_store.summary_for(Park.objects.get(pk=self.park.pk))
+        self.assertEqual((summary.count, summary.total, summary.score_1), (2, 9, 0))
+
+    def test_park_csv_import_is_idempotent_per_source(self):
+        body = ('name,country,official_website,source,source_id\n'
+                'Serengeti,Tanzania,https://serengeti.example,partner,1\n'
+                ',Tanzania,,partner,2\n')
+        for expected in ({'created': 1, 'updated': 0}, {'created': 0, 'updated': 1}):
+            response = self.client.post('/api/parks/bulk/', body, content_type='text/csv')
+            self.assertEqual({key: response.data[key] for key in expected}, expected)
+            self.assertEqual(response.data['errors'], [{'line': 3, 'errors': {'name': 'name is required and at most 200 characters'}}])
+        self.assertEqual(Park.objects.filter(name='Serengeti', country='Tanzania').count(), 1)
+
+    def test_long_values_stay_out_of_the_numpy_columns(self):
+        # Fixed-width arrays of these would take 4 bytes x 2M chars x every row of the batch.
+        long_text = 'x' * 2_000_000
+        rows = [{'name': f'Long Park {i}', 'description': long_text if i == 0 else 'short',
+                 'source': 'partner', 'source_id': str(i)} for i in range(500)]
+        rows.append({'name': 'Bad Key Park', 'source': 'partner', 'source_id': '9' * 1_000_000})
+        body = '\n'.join(json.dumps(row) for row in rows)
+        response = self.client.post('/api/parks/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual((response.data['created'], response.data['failed']), (500, 1))
+        self.assertEqual(len(Park.objects.get(name='Long Park 0').description), 2_000_000)
+
+        body = '\n'.join([
+            json.dumps({'park': self.park.pk, 'user': self.users[0].pk, 'score': 4, 'comment': long_text}),
+            json.dumps({'park': self.park.pk, 'username': 'u' * 1_000_000, 'score': 4}),
+        ])
+        response = self.client.post('/api/ratings/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual((response.data['written'], response.data['failed']), (1, 1))
+        self.assertEqual(len(Rating.objects.get(user=self.users[0]).comment), 2_000_000)
+
+    def test_bulk_requires_admin(self):
+        self.client.force_login(self.users[0])
+        response = self.client.post('/api/ratings/bulk/', '', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 403)
+
+
+class LocalMediaTestCase(TestCase):
+    """Media goes to a temporary directory instead of S3."""
+
+    def setUp(self):
+        self.media = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': self.media}},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        }))
+
+
+class FlagTests(LocalMediaTestCase):
+    def test_prune_deletes_only_unused_flag_files(self):
+        name, sha256 = flag_store.save_file(b'kenya')
+        flag = flag_store.store('KE', name, sha256)
+        self.assertEqual(flag_store.save_file(b'kenya'), (name, sha256))
+        storage = CountryFlag._meta.get_field('image').storage
+        storage.save('flags/ke_a1b2c3.png', ContentFile(b'old copy'))
+
+        out = StringIO()
+        call_command('prune_flags', '--dry-run', stdout=out)
+        self.assertIn('Would delete 1', out.getvalue())
+        self.assertTrue(storage.exists('flags/ke_a1b2c3.png'))
+        call_command('prune_flags', stdout=StringIO())
+        self.assertFalse(storage.exists('flags/ke_a1b2c3.png'))
+        self.assertTrue(storage.exists(flag.image.name))
+
+
+def png_bytes(size=(40, 30)):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'green').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class ImageSpoolTests(TestCase):
+    def test_spool_accepts_an_image_in_chunks(self):
+        data = png_bytes()
+        spooled, fmt, dimensions = images.spool([data[i:i + 7] for i in range(0, len(data), 7)])
+        with spooled:
+            self.assertEqual((fmt, dimensions, spooled.read()), ('png', (40, 30), data))
+
+    def test_spool_rejects_bad_downloads(self):
+        for chunks, kwargs in [
+            ([b'<html>not an image</html>'], {}),
+            ([png_bytes()], {'allowed': ('jpeg',)}),
+            ([png_bytes()], {'max_bytes': 10}),
+            ([png_bytes()], {'max_dimension': 20}),
+            ([png_bytes()[:40]], {}),
+        ]:
+            with self.subTest(kwargs=kwargs), self.assertRaises(images.ImageRejected):
+                images.spool(chunks, **kwargs)
+
+
+@override_settings(PARK_IMAGE_WIDTHS=(16, 32, 64), PARK_IMAGE_FORMATS=('webp', 'jpeg'))
+class ImageVariantTests(LocalMediaTestCase):
+    def render(self, park):
+        return Template('{% load park_images %}{% park_picture park %}').render(Context({'park': park}))
+
+    def test_saving_an_image_builds_its_variants(self):
+        park = Park.objects.create(name='Picture Park', image=ContentFile(png_bytes(), name='picture.png'))
+        variants = Park.objects.get(pk=park.pk).image_variants
+        self.assertEqual((variants['source'], variants['width'], variants['height']), (park.image.name, 40, 30))
+        self.assertEqual([v['width'] for v in variants['formats']['webp']], [16, 32])
+        self.assertEqual(variants['formats']['jpeg'][0]['height'], 12)
+        html = self.render(park)
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('-16w.jpg 16w', html)
+
+    def test_broken_image_is_saved_without_variants(self):
+        with self.assertLogs('parks.signals', 'ERROR'):
+            park = Park.objects.create(name='Broken Park', image=ContentFile(b'not an image', name='broken.png'))
+        park.refresh_from_db()
+        self.assertEqual((park.image.name, park.image_variants), ('parks/broken.png', {}))
+        self.assertNotIn('srcset', self.render(park))
+
+    def test_stale_variants_are_not_rendered(self):
+        park = Park.objects.create(name='Stale Park', image=ContentFile(png_bytes(), name='old.png'))
+        park.image.name = 'parks/new.png'
+        self.assertFalse(images.is_current(park))
+        html = self.render(park)
+        self.assertNotIn('srcset', html)
+        self.assertIn('parks/new.png', html)
+
+
+class StubOrigin(BaseHTTPRequestHandler):
+    """Replies with the next ``(status, headers, body)`` queued for the path in ``server.replies``."""
+
+    def do_GET(self):
+        self.server.requests.append((self.command, self.path, dict(self.headers)))
+        status, headers, body = self.server.replies[self.path].pop(0)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(HTTP_CLIENT_CACHE_ALIAS='default')
+class HttpClientTests(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubOrigin)
+        self.server.requests, self.server.replies = [], {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base = f'http://127.0.0.1:{self.server.server_port}'
+        self.http = HttpClient(retries=2, backoff=0)
+        self.addCleanup(self.http.close)
+        caches['default'].clear()
+
+    def test_fresh_response_is_served_from_cache(self):
+        self.server.replies['/a'] = [(200, {'Cache-Control': 'max-age=60'}, b'first')]
+        self.assertFalse(self.http.get(self.base + '/a').from_cache)
+        cached = self.http.get(self.base + '/a')
+        self.assertEqual((cached.from_cache, cached.content), (True, b'first'))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_stale_response_is_revalidated(self):
+        self.server.replies['/a'] = [(200, {'ETag': '"v1"', 'Cache-Control': 'no-cache'}, b'body'),
+                                     (304, {'ETag': '"v1"'}, b'')]
+        self.http.get(self.base + '/a')
+        response = self.http.get(self.base + '/a')
+        self.assertEqual((response.from_cache, response.content), (True, b'body'))
+        self.assertEqual(self.server.requests[1][2]['If-None-Match'], '"v1"')
+        host = urlsplit(self.base).netloc
+        self.assertEqual(self.http.stats()[host]['revalidated'], 1)
+
+    def test_no_store_is_not_cached(self):
+        self.server.replies['/a'] = [(200, {'Cache-Control': 'no-store', 'ETag': '"v1"'}, b'one'),
+                                     (200, {}, b'two')]
+        self.http.get(self.base + '/a')
+        self.assertEqual(self.http.get(self.base + '/a').content, b'two')
+
+    def test_gets_are_retried_and_posts_are_not(self):
+        self.server.replies['/a'] = [(503, {'Retry-After': '0'}, b''), (200, {}, b'ok')]
+        self.assertEqual(self.http.get(self.base + '/a').content, b'ok')
+        self.server.replies['/b'] = [(503, {}, b''), (200, {}, b'ok')]
+        with self.assertRaises(requests.HTTPError):
+            self.http.post(self.base + '/b')
+        host = urlsplit(self.base).netloc
+        stats = self.http.stats()[host]
+        self.assertEqual((stats['requests'], stats['retries']), (3, 1))
+
+    def test_report_has_a_line_per_host(self):
+        self.server.replies['/a'] = [(200, {}, b'ok')]
+        self.http.get(self.base + '/a')
+        self.assertEqual(len(self.http.report()), 1)
+        self.assertIn('1 requests', self.http.report()[0])
+
+
+class StubWikidata(BaseHTTPRequestHandler):
+    """Answers the importer's SPARQL pages from ``server.items`` and its Wikipedia lookups.
+
+    Page number ``server.fail_page`` (counted from 1) fails with a 500.
+    """
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/sparql':
+            query = parse_qs(url.query)['query'][0]
+            after = re.search(r'> "(.*)"\)', query).group(1)
+            limit = int(re.search(r'LIMIT (\d+)', query).group(1))
+            self.server.pages.append(after)
+            if len(self.server.pages) == self.server.fail_page:
+                self.send_error(500)
+                return
+            items = [item for item in self.server.items if item > after][:limit]
+            rows = [{'item': {'value': item}, 'itemLabel': {'value': f'Park {item[-2:]}'},
+                     'countryLabel': {'value': 'Kenya'}} for item in items]
+            # Each item comes back twice, like one with two regions.
+            rows = [row for row in rows for _ in range(2)]
+            self.reply({'head': {'vars': []}, 'results': {'bindings': rows}})
+        else:
+            title = unquote(url.path.rsplit('/', 1)[-1])
+            self.reply({'extract': f'About {title}', 'content_urls': {'desktop': {'page': f'https://wiki.example/{title}'}}})
+
+    def reply(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CountingImporter(WikidataImporter):
+    def refresh(self):
+        self.refreshes = getattr(self, 'refreshes', 0) + 1
+        super().refresh()
+
+
+class WikidataImporterTests(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubWikidata)
+        self.server.items = [f'http://www.wikidata.org/entity/Q{n}' for n in range(10, 17)]
+        self.server.pages, self.server.fail_page = [], None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        base = f'http://127.0.0.1:{self.server.server_port}'
+        self.enterContext(override_settings(WIKIDATA_SPARQL_URL=f'{base}/sparql',
+                                            WIKIPEDIA_SUMMARY_URL=f'{base}/summary/'))
+        self.checkpoint = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'checkpoint.json')
+        caches['responses'].clear()
+
+    def importer(self):
+        return CountingImporter(workers=2, batch_size=2, page_size=3, retries=0, backoff=0,
+                                checkpoint_path=self.checkpoint, log=lambda message, level='info': None)
+
+    def test_import_refreshes_derived_data_once(self):
+        importer = self.importer()
+        stats = importer.run(0)
+        self.assertEqual((stats.rows, stats.created), (7, 7))
+        self.assertEqual(self.server.pages, ['', self.server.items[2], self.server.items[5]])
+        self.assertEqual(importer.refreshes, 1)
+        park = ParkIdentifier.objects.get(source_name='wikidata', source_id='Q12').park
+        self.assertEqual((park.name, park.description), ('Park 12', 'About Park_12'))
+        self.assertEqual(facets.materialized(limit=None)['country'], [{'value': 'Kenya', 'count': 7}])
+        self.assertEqual(park_search.search('About Park_12', columns=['description'])[0], park.pk)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_interrupted_import_resumes_from_checkpoint(self):
+        self.server.fail_page = 2
+        importer = self.importer()
+        with self.assertRaises(Exception):
+            importer.run(0)
+        self.assertEqual(importer.refreshes, 1)
+        state = Checkpoint(self.checkpoint).load()
+        self.assertEqual((state.after, state.imported, state.done), (self.server.items[2], 3, set()))
+
+        stats = self.importer().run(0)
+        self.assertEqual(self.server.pages[2:], [self.server.items[2], self.server.items[5]])
+        self.assertEqual((stats.rows, stats.created), (4, 4))
+        self.assertEqual(Park.objects.count(), 7)
+
+    def test_resume_skips_parks_written_from_the_current_page(self):
+        state = Checkpoint(self.checkpoint)
+        state.done = {'Q10', 'Q11'}
+        state.save()
+        stats = self.importer().run(3)
+        self.assertEqual((stats.rows, stats.skipped, stats.created), (3, 2, 1))
+        self.assertEqual(list(ParkIdentifier.objects.values_list('source_id', flat=True)), ['Q12'])
+
+    def test_iter_bindings_streams_split_chunks(self):
+        body = json.dumps({'head': {}, 'results': {'bindings': [{'name': 'Ein Gedi ☀'}, {'name': 'Timna'}]}},
+                          ensure_ascii=False).encode()
+        chunks = [body[i:i + 5] for i in range(0, len(body), 5)]
+        self.assertEqual([row['name'] for row in iter_bindings(chunks)], ['Ein Gedi ☀', 'Timna'])
+        with self.assertRaises(ValueError):
+            list(iter_bindings([b'{"error": "timeout"}']))
+
+
+class StubCompletions(BaseHTTPRequestHandler):
+    """Streams OpenAI-style chat completion chunks; ``server.endless`` keeps going until the client leaves."""
+
+    def do_POST(self):
+        self.server.requests.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        try:
+            for text in ['Day 1: ', 'hike ', 'the ridge.']:
+                self.chunk({'choices': [{'index': 0, 'delta': {'content': text}}]})
+            while self.server.endless:
+                self.chunk({'choices': [{'index': 0, 'delta': {'content': '.'}}]})
+                time.sleep(0.02)
+            self.wfile.write(b'data: [DONE]\n\n')
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.disconnected.set()
+
+    def chunk(self, data):
+        self.wfile.write(f'data: {json.dumps(data)}\n\n'.encode())
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+class TripPlannerStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.park = Park.objects.create(name='Stream Park', country='Kenya')
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubCompletions)
+        self.server.requests, self.server.endless, self.server.disconnected = [], False, threading.Event()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        url = f'http://127.0.0.1:{self.server.server_port}/v1/chat/completions'
+        self.enterContext(override_settings(TRIP_PLANNER_API_URL=url))
+        plan_cache.clear()
+
+    def test_page_loads_the_stream_script_once(self):
+        html = self.client.get(f'/parks/trip-planner/{self.park.pk}/').content.decode()
+        self.assertIn('<title>Trip Planner - Stream Park</title>', html)
+        self.assertEqual(html.count('form.dataset.streamUrl'), 1)
+
+    async def test_view_streams_tokens_as_sse(self):
+        response = await self.async_client.post(f'/parks/trip-planner/{self.park.pk}/stream/', {'user_input': 'hotels'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        events = [(part.split('\n')[0][7:], json.loads(part.split('\n')[1][6:])) for part in body.strip().split('\n\n')]
+        self.assertEqual(events, [('token', {'text': 'Day 1: '}), ('token', {'text': 'hike '}),
+                                  ('token', {'text': 'the ridge.'}), ('done', {})])
+        self.assertTrue(self.server.requests[0]['stream'])
+        self.assertIn('only hotels', self.server.requests[0]['messages'][1]['content'])
+
+    async def test_closing_the_stream_closes_the_upstream_request(self):
+        self.server.endless = True
+        tokens = trip_planning.stream_plan(self.park)
+        self.assertEqual(await anext(tokens), 'Day 1: ')
+        await tokens.aclose()
+        self.assertTrue(await asyncio.to_thread(self.server.disconnected.wait, 5))
+
+    async def test_identical_requests_share_one_upstream_call(self):
+        first, chunks = plan_cache.stream(self.park, 'Family trip')
+        second, shared = plan_cache.stream(self.park, '  family   TRIP ')
+        self.assertEqual((first, second), ('miss', 'shared'))
+        texts = await asyncio.gather(*[self._join(stream) for stream in (chunks, shared)])
+        self.assertEqual(texts, ['Day 1: hike the ridge.'] * 2)
+        self.assertEqual(plan_cache.stream(self.park, 'family trip')[0], 'hit')
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(plan_cache.stats()['hit_ratio'], 0.667)
+
+    @override_settings(TRIP_PLAN_CACHE_TTL=0)
+    async def test_stale_plan_is_served_while_refreshing(self):
+        await plan_cache.plan(self.park)
+        outcome, chunks = plan_cache.stream(self.park)
+        self.assertEqual((outcome, await self._join(chunks)), ('stale', 'Day 1: hike the ridge.'))
+        while plan_cache.stats()['in_flight']:
+            await asyncio.sleep(0.01)
+        self.assertEqual(len(self.server.requests), 2)
+
+    async def _join(self, chunks):
+        return ''.join([text async for text in chunks])
+
+
+# (user input, expected detect_request_type)
+TOPIC_CORPUS = [
+    ('', 'general'),
+    ('family with kids', 'general'),
+    ('great views at sunset', 'general'),
+    ('careful, we have a toddler', 'general'),
+    ('inner canyon viewpoints', 'general'),
+    ('cheap hostels near the gate', 'specific:hotels'),
+    ('Where to stay for two nights?', 'specific:hotels'),
+    ('a bed and breakfast with a view', 'specific:hotels'),
+    ('Any good restaurants?', 'specific:restaurants'),
+    ('vegetarian dinner options', 'specific:restaurants'),
+    ('where can we eat lunch', 'specific:restaurants'),
+    ('best trails for beginners', 'specific:hikes'),
+    ('easy hiking, short walks', 'specific:hikes'),
+    ('tent camping spots', 'specific:camping'),
+    ('campgrounds with showers', 'specific:camping'),
+    ('buses from the airport', 'specific:transport'),
+    ('is there parking at the visitor center', 'specific:transport'),
+    ('hike to the lake, then a hotel; hotels near trails', 'specific:hotels'),
+]
+
+
+class TopicClassifierTests(TestCase):
+    def test_labeled_corpus(self):
+        for text, expected in TOPIC_CORPUS:
+            with self.subTest(text=text):
+                self.assertEqual(trip_planning.detect_request_type(text), expected)
+
+    def test_scores_and_configured_topics(self):
+        self.assertEqual(topics.classify('hotel, hikes and a trail'), [('hikes', 0.667), ('hotels', 0.333)])
+        with override_settings(TRIP_PLANNER_TOPICS={'wildlife': ['bear', 'bird watching']}):
+            self.assertEqual(topics.classify('Bears and BIRD  watching, no hotels'), [('wildlife', 1.0)])
+        self.assertEqual(topics.classify('bears'), [])
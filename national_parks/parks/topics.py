@@ -0,0 +1,137 @@
+"""Keyword topic classifier for trip planner requests.
+
+Keywords are compiled once into a word -> topic table (plus the few multi-word
+keywords), and each input is split into words and looked up word by word, so
+the cost is one pass over the input however many keywords there are. Matches
+are whole words, so "eat" doesn't fire on "great" or "inn" on "dinner", and a
+keyword also matches its plural ("hikes", "buses", but not "cares" for "car").
+Multi-word keywords match across any whitespace.
+
+Topics come from the ``TRIP_PLANNER_TOPICS`` setting (``{topic: [keywords]}``),
+defaulting to ``DEFAULT_TOPICS``.
+"""
+import re
+import string
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+DEFAULT_TOPICS = {
+    "hotels": ["hotel", "accommodation", "lodging", "lodge", "hostel", "motel", "airbnb", "inn",
+               "bed and breakfast", "place to stay", "where to stay"],
+    "restaurants": ["restaurant", "food", "dining", "eat", "eating", "cafe", "breakfast", "lunch", "dinner"],
+    "hikes": ["hike", "hiking", "trail", "walk", "walking", "trek", "trekking"],
+    "camping": ["camp", "camping", "campsite", "campground", "tent"],
+    "transport": ["bus", "car", "train", "transport", "shuttle", "parking", "drive", "driving"],
+}
+
+# Punctuation becomes whitespace, so split() yields the words. Splitting UTF-8
+# bytes this way measured several times faster than re.findall(r'\w+') or
+# str.translate on typical inputs, so words and keywords are compared as bytes.
+_separators = bytes.maketrans(string.punctuation.encode(), b' ' * len(string.punctuation))
+_unicode_separators = str.maketrans(dict.fromkeys('\u2018\u2019\u201c\u201d\u2013\u2014\u2026', ' '))
+_classifier = None
+
+
+def words_of(text):
+    """The lowercased words of ``text``, as UTF-8 bytes."""
+    text = text.lower()
+    if not text.isascii():
+        text = text.translate(_unicode_separators)
+    return text.encode().translate(_separators).split()
+
+
+def plural(word):
+    """English plural of ``word`` (bytes)."""
+    if word.endswith((b's', b'x', b'z', b'ch', b'sh')):
+        return word + b'es'
+    if re.search(rb'[^aeiou]y$', word):
+        return word[:-1] + b'ies'
+    return word + b's'
+
+
+class TopicClassifier:
+    def __init__(self, topics):
+        self.topics = list(topics)
+        self.order = {topic: index for index, topic in enumerate(self.topics)}
+        # One-word keywords (and their plurals) -> topic.
+        self.words = {}
+        multi_word = []
+        for topic in self.topics:
+            for keyword in topics[topic]:
+                words = words_of(keyword)
+                if not words:
+                    continue
+                for form in (words, words[:-1] + [plural(words[-1])]):
+                    if len(form) == 1:
+                        self.words.setdefault(form[0], topic)
+                    else:
+                        multi_word.append((form, topic))
+        # Multi-word keywords: (first word, padded the way ``counts`` joins the
+        # input, topic, topics of the one-word keywords inside it).
+        self.phrases = [
+            (form[0], b' ' + b'  '.join(form) + b' ', topic, [self.words[word] for word in form if word in self.words])
+            for form, topic in multi_word
+        ]
+        self.phrase_starts = {form[0] for form, _ in multi_word}
+
+    def counts(self, text):
+        """``{topic: keyword occurrences}`` in ``text``. A multi-word keyword
+        hides the keywords inside it ("bed and breakfast" is not a meal)."""
+        words = words_of(text) if text else ()
+        keywords = self.words
+        counts = {}
+        for topic in [keywords[word] for word in words if word in keywords]:
+            counts[topic] = counts.get(topic, 0) + 1
+        starts = self.phrase_starts.intersection(words)
+        if starts:
+            # Words joined by two spaces, so adjacent occurrences don't share one.
+            joined = b' ' + b'  '.join(words) + b' '
+            for first, phrase, topic, inner in self.phrases:
+                occurrences = joined.count(phrase) if first in starts else 0
+                if occurrences:
+                    counts[topic] = counts.get(topic, 0) + occurrences
+                    for hidden in inner:
+                        counts[hidden] -= occurrences
+            counts = {topic: count for topic, count in counts.items() if count > 0}
+        return counts
+
+    def classify(self, text):
+        """``[(topic, score), ...]`` best first; the score is the topic's share of the keyword matches."""
+        counts = self.counts(text)
+        if len(counts) < 2:
+            return [(topic, 1.0) for topic in counts]
+        total = sum(counts.values())
+        ranked = sorted(counts.items(), key=lambda item: (-item[1], self.order[item[0]]))
+        return [(topic, round(count / total, 3)) for topic, count in ranked]
+
+    def best(self, text):
+        """The top topic of ``classify(text)``, or None."""
+        counts = self.counts(text)
+        if not counts:
+            return None
+        return max(counts, key=lambda topic: (counts[topic], -self.order[topic]))
+
+
+def get_classifier():
+    """The classifier for ``TRIP_PLANNER_TOPICS``, compiled on first use."""
+    global _classifier
+    if _classifier is None:
+        _classifier = TopicClassifier(getattr(settings, 'TRIP_PLANNER_TOPICS', None) or DEFAULT_TOPICS)
+    return _classifier
+
+
+@receiver(setting_changed)
+def _topics_changed(setting, **kwargs):
+    global _classifier
+    if setting == 'TRIP_PLANNER_TOPICS':
+        _classifier = None
+
+
+def classify(text):
+    return get_classifier().classify(text)
+
+
+def best(text):
+    return get_classifier().best(text)
@@ -0,0 +1,123 @@
+"""AI trip plans for a park, streamed from an OpenAI-compatible chat completions API.
+
+``stream_plan`` yields the plan's text as the model generates it. Requests go
+through one pooled ``httpx.AsyncClient`` per event loop, and the upstream
+response is closed as soon as the consumer stops iterating, e.g. when the
+browser behind the SSE view disconnects and Django cancels the response.
+(``parks.http_client`` is blocking and made for cached, retried GETs, so it
+isn't used for these streamed POSTs.)
+
+The endpoint, key and model come from the ``TRIP_PLANNER_*`` settings (the key
+defaults to ``GROQ_API_KEY``), so tests and local development can point them at
+a stub server.
+"""
+import asyncio
+import json
+import os
+import weakref
+
+import httpx
+from django.conf import settings
+
+from . import topics
+
+API_URL = 'https://api.groq.com/openai/v1/chat/completions'
+MODEL = 'llama-3.1-8b-instant'
+MAX_TOKENS = 300
+TIMEOUT = httpx.Timeout(10.0, read=30.0)
+LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+
+_clients = weakref.WeakKeyDictionary()
+
+
+class TripPlannerError(Exception):
+    pass
+
+
+def detect_request_type(user_input: str) -> str:
+    """``"specific:<topic>"`` for the best-scoring topic in ``user_input``, else ``"general"``."""
+    topic = topics.best(user_input)
+    return f"specific:{topic}" if topic else "general"
+
+
+def build_messages(park, user_input):
+    request_type = detect_request_type(user_input)
+    if request_type == "general":
+        prompt_text = f"""
+        You are a professional travel planner.
+        Create a short, clear, family-friendly trip plan for **{park.name}**, in **{park.country}**.
+        Park info: {park.description or "No description"}.
+        Focus on main highlights, attractions, and useful tips.
+        Extra info from user: {user_input or "N/A"}.
+        """
+    else:
+        topic = request_type.split(":")[1]
+        prompt_text = f"""
+        You are a professional travel assistant.
+        The user wants **only {topic}** information for **{park.name}** in **{park.country}**.
+        Park info: {park.description or "No description"}.
+        Respond with concise, accurate info about {topic} relevant to this park and surroundings.
+        Extra info from user: {user_input}.
+        """
+    return [
+        {"role": "system", "content": "You are a helpful travel planner."},
+        {"role": "user", "content": prompt_text},
+    ]
+
+
+def get_client():
+    """The shared client for the running event loop (an AsyncClient can't cross loops)."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _clients[loop] = httpx.AsyncClient(timeout=TIMEOUT, limits=LIMITS)
+    return client
+
+
+async def stream_chat(messages, temperature=0.7, max_tokens=MAX_TOKENS):
+    """Yield the content deltas of a streamed chat completion.
+
+    Raises ``TripPlannerError`` for HTTP and transport errors. Closing the
+    generator (or cancelling the task iterating it) closes the upstream response.
+    """
+    headers = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+    api_key = getattr(settings, 'TRIP_PLANNER_API_KEY', None) or os.getenv('GROQ_API_KEY')
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    payload = {
+        "model": getattr(settings, 'TRIP_PLANNER_MODEL', MODEL),
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": True,
+    }
+    url = getattr(settings, 'TRIP_PLANNER_API_URL', API_URL)
+    try:
+        async with get_client().stream("POST", url, headers=headers, json=payload) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                raise TripPlannerError(f"{response.status_code} from the trip planner API: {response.text[:200]}")
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    return
+                try:
+                    choice = json.loads(data)["choices"][0]
+                except (ValueError, KeyError, IndexError):
+                    continue
+                text = (choice.get("delta") or {}).get("content")
+                if text:
+                    yield text
+    except httpx.HTTPError as exc:
+        raise TripPlannerError(str(exc) or exc.__class__.__name__) from exc
+
+
+def stream_plan(park, user_input=''):
+    return stream_chat(build_messages(park, user_input))
+
+
+async def plan(park, user_input=''):
+    """The whole plan as one string."""
+    return ''.join([text async for text in stream_plan(park, user_input)]).strip()
@@ -1,8 +1,11 @@
 from django.urls import path
-from .views import ParkCreateView, trip_planner
+from .views import ParkCreateView, response_cache_stats, trip_plan_cache_stats, trip_planner, trip_planner_stream
 
 urlpatterns = [
     path('add/', ParkCreateView.as_view(), name='park-add'),
     path("trip-planner/<int:park_id>/", trip_planner, name="trip_planner"),
+    path("trip-planner/<int:park_id>/stream/", trip_planner_stream, name="trip_planner_stream"),
+    path("trip-planner/cache-stats/", trip_plan_cache_stats, name="trip_plan_cache_stats"),
+    path('cache-stats/', response_cache_stats, name='response-cache-stats'),
 ]
 
@@ -1,49 +1,93 @@
 from django.shortcuts import render
 from django.urls import reverse_lazy
 from django.views.generic import ListView, DetailView, CreateView
-from .models import Park, Rating
-from django.shortcuts import get_object_or_404, redirect
-from django.contrib.auth.decorators import login_required
-from django.db.models import Avg
+from .models import Park, Rating, iexact
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.db.models import F
 from .forms import ParkForm
+from . import ratings as rating_store
+from . import search as park_search
+from .caching import get_countries
+from .pagination import after as keyset_after, clean_position, decode_cursor, encode_cursor
 from django.contrib.auth.mixins import UserPassesTestMixin
-from django.http import HttpResponseForbidden
-import requests
+from django.http import HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST
+from asgiref.sync import sync_to_async
+from django.utils.decorators import method_decorator
+from . import plan_cache
+from . import response_cache
+from . import trip_planner as trip_planning
+from .response_cache import cached_response
+import json
 from dotenv import load_dotenv
-import os
 load_dotenv()
 
+@method_decorator(cached_response(params=('q', 'country', 'after', 'fragment')), name='dispatch')
 class HomeView(ListView):
     model = Park
     template_name = 'home.html'
     context_object_name = 'parks'
+    paginate_by = 24
+    # Columns the park cards render; keeps the Wikipedia description out of the query.
+    card_fields = ('id', 'name', 'country', 'image', 'image_variants', 'country_flag__image')
+    ordering_fields = ('name', 'id')
 
-
-    def get(self, request, *args, **kwargs):
-        print("HomeView GET called")
-        return super().get(request, *args, **kwargs)
+    def get_template_names(self):
+        if self.request.GET.get("fragment"):
+            return ['parks/_park_cards.html']
+        return super().get_template_names()
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        """Parks by name, or with ?q= the ``park_search.DEFAULT_LIMIT`` best matches.
+
+        The country filter goes first so the search cap counts only parks in
+        that country.
+        """
+        queryset = super().get_queryset().select_related('country_flag').only(*self.card_fields)
         q = self.request.GET.get("q")
         country = self.request.GET.get("country")
 
-        if q:
-            queryset = queryset.filter(name__icontains=q)
         if country:
-            queryset = queryset.filter(country=country)
+            queryset = queryset.filter(iexact('country', country))
+        if q:
+            queryset = park_search.filter_queryset(queryset, q)
+        else:
+            queryset = queryset.order_by(*self.ordering_fields)
 
         return queryset
 
+    def paginate_queryset(self, queryset, page_size):
+        """Keyset pagination: ``?after=`` carries the last (name, id) shown.
+
+        Search results are ranked rather than name-ordered and capped at
+        ``park_search.DEFAULT_LIMIT``, so for those the cursor is an offset.
+        """
+        token = self.request.GET.get("after")
+        if self.request.GET.get("q"):
+            position = decode_cursor(token, 1)
+            offset = position[0] if position and type(position[0]) is int and position[0] > 0 else 0
+            rows = list(queryset[offset:offset + page_size + 1])
+            next_cursor = encode_cursor([offset + page_size])
+        else:
+            position = clean_position(Park, self.ordering_fields, decode_cursor(token, len(self.ordering_fields)))
+            if position:
+                queryset = queryset.filter(keyset_after(self.ordering_fields, position))
+            rows = list(queryset[:page_size + 1])
+            next_cursor = encode_cursor([rows[page_size - 1].name, rows[page_size - 1].id]) if len(rows) > page_size else None
+        has_next = len(rows) > page_size
+        self.next_cursor = next_cursor if has_next else None
+        return (None, None, rows[:page_size], has_next)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["countries"] = (
-            Park.objects.exclude(country__isnull=True)
-                        .exclude(country__exact="")
-                        .values_list("country", flat=True)
-                        .distinct()
-                        .order_by("country")
-        )
+        context["countries"] = get_countries()
+        context["search_limit"] = park_search.DEFAULT_LIMIT
+        if self.next_cursor:
+            params = self.request.GET.copy()
+            params.pop("fragment", None)
+            params["after"] = self.next_cursor
+            context["next_url"] = f"?{params.urlencode()}"
         return context
 
 class ParkCreateView(UserPassesTestMixin, CreateView):
@@ -67,102 +111,76 @@ class ParkListView(ListView):
     paginate_by = 10
 
     def get_queryset(self):
-        qs = super().get_queryset()
+        qs = super().get_queryset().select_related('country_flag')
         sort = self.request.GET.get('sort')
         if sort == 'rating':
-            qs = qs.annotate(avg_rating=Avg('ratings__score')).order_by('-avg_rating')
+            qs = qs.select_related('rating_summary').order_by(
+                F('rating_summary__average').desc(nulls_last=True), 'name'
+            )
         elif sort == 'name':
             qs = qs.order_by('name')
         return qs
 
+@method_decorator(cached_response(), name='dispatch')
 class ParkDetailView(DetailView):
     model = Park
     template_name = 'parks/park_detail.html'
+    queryset = Park.objects.select_related('rating_summary', 'country_flag')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        ratings = self.object.ratings.all().order_by('-created_at')
-        if ratings.exists():
-            context['average_rating'] = round(sum(r.score for r in ratings) / ratings.count(), 2)
-        else:
-            context['average_rating'] = None
+        summary = rating_store.summary_for(self.object)
+        ratings = self.object.ratings.select_related('user').order_by('-created_at')
+        context['average_rating'] = round(summary.average, 2) if summary.average is not None else None
+        context['ratings_count'] = summary.count
         context['ratings'] = ratings
         return context
 
-def trip_planner(request, park_id):
-    park = get_object_or_404(Park, id=park_id)
+async def trip_planner(request, park_id):
+    """Trip planner page. The form streams the plan from ``trip_planner_stream``;
+    a plain (no-JS) POST waits for the whole plan instead."""
+    park = await aget_object_or_404(Park, id=park_id)
     plan = None
-
     if request.method == "POST":
-        user_input = request.POST.get("user_input", "").strip()
-        request_type = detect_request_type(user_input)
-        if request_type == "general":
-            prompt_text = f"""
-            You are a professional travel planner.
-            Create a short, clear, family-friendly trip plan for **{park.name}**, in **{park.country}**.
-            Park info: {park.description or "No description"}.
-            Focus on main highlights, attractions, and useful tips.
-            Extra info from user: {user_input or "N/A"}.
-            """
-        else:
-            topic = request_type.split(":")[1]
-            prompt_text = f"""
-            You are a professional travel assistant.
-            The user wants **only {topic}** information for **{park.name}** in **{park.country}**.
-            Park info: {park.description or "No description"}.
-            Respond with concise, accurate info about {topic} relevant to this park and surroundings.
-            Extra info from user: {user_input}.
-            """
-
-        headers = {
-            "Authorization": f"Bearer {os.getenv('GROQ_API_KEY')}",
-            "Content-Type": "application/json",
-        }
-
-        payload = {
-            "model": "llama-3.1-8b-instant",
-            "messages": [
-                {"role": "system", "content": "You are a helpful travel planner."},
-                {"role": "user", "content": prompt_text},
-            ],
-            "temperature": 0.7,
-            "max_tokens": 300,
-        }
-
         try:
-            response = requests.post(
-                "https://api.groq.com/openai/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-            response.raise_for_status()
-            data = response.json()
-            plan = data["choices"][0]["message"]["content"].strip()
-        except Exception as e:
+            plan = await plan_cache.plan(park, request.POST.get("user_input", "").strip())
+        except trip_planning.TripPlannerError as e:
             plan = f"Error generating trip plan: {str(e)}"
+    return await sync_to_async(render)(request, "parks/trip_planner.html", {"park": park, "plan": plan})
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    return render(request, "parks/trip_planner.html", {"park": park, "plan": plan})
 
-def detect_request_type(user_input: str) -> str:
-    if not user_input or len(user_input.strip()) == 0:
-        return "general"
+@require_POST
+async def trip_planner_stream(request, park_id):
+    """Server-sent events: ``token`` events carrying the plan's text as it is
+    generated, then ``done`` (or ``error``). Plans come from ``plan_cache``
+    when possible; X-Cache says whether this one did.
 
-    text = user_input.lower()
+    If the browser goes away, Django cancels the response and the upstream
+    request is closed with it.
+    """
+    park = await aget_object_or_404(Park, id=park_id)
+    user_input = request.POST.get("user_input", "").strip()
 
-    topics = {
-        "hotels": ["hotel", "hotels", "accommodation", "lodging", "hostel", "airbnb", "inn"],
-        "restaurants": ["restaurant", "food", "dining", "eat"],
-        "hikes": ["hike", "trail", "walk", "trek"],
-        "camping": ["camp", "camping", "tent"],
-        "transport": ["bus", "car", "train", "transport"],
-    }
+    outcome, chunks = plan_cache.stream(park, user_input)
 
-    for topic, keywords in topics.items():
-        if any(word in text for word in keywords):
-            return f"specific:{topic}"
+    async def events():
+        try:
+            async for text in chunks:
+                yield _sse("token", {"text": text})
+        except trip_planning.TripPlannerError as e:
+            yield _sse("error", {"message": f"Error generating trip plan: {e}"})
+            return
+        yield _sse("done", {})
 
-    return "general"
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # stop nginx from buffering the stream
+    response["X-Cache"] = outcome.upper()
+    return response
 
 
 @login_required
@@ -176,9 +194,17 @@ def rate_park(request, pk):
     if score < 1 or score > 5:
         return redirect('park_detail', pk=pk)
     comment = (request.POST.get('comment') or '').strip()
-    rating, created = Rating.objects.update_or_create(
-        user=request.user,
-        park=park,
-        defaults={'score': score, 'comment': comment}
-    )
+    rating_store.save_rating(request.user, park, score, comment)
     return redirect('park_detail', pk=pk)
+
+
+@user_passes_test(lambda user: user.is_staff)
+def response_cache_stats(request):
+    """Hit ratio and latency per cached endpoint, for staff."""
+    return JsonResponse(response_cache.stats())
+
+
+@user_passes_test(lambda user: user.is_staff)
+def trip_plan_cache_stats(request):
+    """Trip plan cache hits, misses and the API time the hits saved, for staff."""
+    return JsonResponse(plan_cache.stats())
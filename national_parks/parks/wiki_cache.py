@@ -0,0 +1,86 @@
+"""Wikipedia summary cache for the importer, keyed by Wikidata id.
+
+Entries live in ``WikiCacheEntry`` rows, so a lookup is an indexed read and a
+write touches only its own row. Failed lookups are cached too, with the
+shorter ``WIKI_CACHE_NEGATIVE_TTL``, so they get retried on a later import.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import WikiCacheEntry
+
+DEFAULT_TTL = 30 * 24 * 60 * 60
+DEFAULT_NEGATIVE_TTL = 24 * 60 * 60
+
+
+def ttl(negative):
+    if negative:
+        return getattr(settings, 'WIKI_CACHE_NEGATIVE_TTL', DEFAULT_NEGATIVE_TTL)
+    return getattr(settings, 'WIKI_CACHE_TTL', DEFAULT_TTL)
+
+
+def as_dict(entry):
+    return {"description": entry.description, "official_website": entry.official_website}
+
+
+def get_many(wikidata_ids):
+    """Unexpired summaries for the given ids, as ``{wikidata_id: {"description", "official_website"}}``."""
+    entries = WikiCacheEntry.objects.filter(wikidata_id__in=list(wikidata_ids), expires_at__gt=timezone.now())
+    return {entry.wikidata_id: as_dict(entry) for entry in entries}
+
+
+def get(wikidata_id):
+    return get_many([wikidata_id]).get(wikidata_id)
+
+
+def entry_for(wikidata_id, data, title=''):
+    now = timezone.now()
+    negative = not data.get("description")
+    return WikiCacheEntry(
+        wikidata_id=wikidata_id,
+        title=title[:300],
+        description=data.get("description"),
+        official_website=data.get("official_website"),
+        negative=negative,
+        fetched_at=now,
+        expires_at=now + timedelta(seconds=ttl(negative)),
+    )
+
+
+def put_many(items):
+    """Upsert ``(wikidata_id, data, title)`` triples; each row is replaced atomically."""
+    entries = [entry_for(*item) for item in items]
+    WikiCacheEntry.objects.bulk_create(
+        entries,
+        update_conflicts=True,
+        unique_fields=['wikidata_id'],
+        update_fields=['title', 'description', 'official_website', 'negative', 'fetched_at', 'expires_at'],
+        batch_size=500,
+    )
+
+
+def put(wikidata_id, data, title=''):
+    put_many([(wikidata_id, data, title)])
+
+
+def prune(negative_only=False, expired_only=True):
+    """Delete cache rows; returns the number removed."""
+    entries = WikiCacheEntry.objects.all()
+    if expired_only:
+        entries = entries.filter(expires_at__lte=timezone.now())
+    if negative_only:
+        entries = entries.filter(negative=True)
+    deleted, _ = entries.delete()
+    return deleted
+
+
+def stats():
+    now = timezone.now()
+    return WikiCacheEntry.objects.aggregate(
+        total=Count('wikidata_id'),
+        negative=Count('wikidata_id', filter=Q(negative=True)),
+        expired=Count('wikidata_id', filter=Q(expires_at__lte=now)),
+    )
@@ -175,7 +175,8 @@ class ChatWidget {
       }
       
       const data = await response.json();
-      this.messages = Array.isArray(data) ? data : [];
+      // Paginated newest-first; show the latest page oldest-first.
+      this.messages = Array.isArray(data.results) ? data.results.slice().reverse() : [];
       this.renderMessages();
     } catch (error) {
       console.error('Error loading messages:', error);